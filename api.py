@@ -1,10 +1,22 @@
-from flask import Flask, jsonify, request # type: ignore
+from flask import Flask, Response, g, jsonify, request, stream_with_context # type: ignore
 from flask_cors import CORS # type: ignore
+import hmac
 import json
 import os
 import logging
+import time
+import config
+from src import metrics
 from src.baxus_client import BaxusClient
+from src.batch import BatchRecommender
+from src.catalog_reload import CatalogReloader
+from src.jobs import PRIORITIES, JobQueue, JobQueueFullError
+from src.precompute import fingerprint
+from src.llm_client import LLMError, LLMUnavailableError
 from src.recommendation_engine import RecommendationEngine
+from src.recommendation_store import RecommendationStore
+from src.single_flight import SingleFlight, content_hash
+from src.structured_output import MalformedOutputError
 
 app = Flask(__name__)
 CORS(app, origins=["http://localhost:3000"], supports_credentials=True)
@@ -15,192 +27,500 @@ logger = logging.getLogger(__name__)
 baxus_client = BaxusClient()
 recommendation_engine = RecommendationEngine()
 
-# Load the bottle data for recommendations
-bottles = []
-try:
-    # Use absolute path based on the script location
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    data_file = os.path.join(base_dir, 'data', 'whiskey_data_set.json')
-    
-    logger.info(f"Loading whiskey data from: {data_file}")
-    with open(data_file, 'r') as f:
-        bottles = json.load(f)
-    
-    logger.info(f"Successfully loaded {len(bottles)} whiskey bottles")
-    
-    # Validate data structure (basic check)
-    if not isinstance(bottles, list) or len(bottles) == 0:
-        logger.error("Whiskey data appears to be empty or not in expected format")
-except Exception as e:
-    logger.error(f"Failed to load whiskey data: {str(e)}")
+# Identical concurrent recommendation requests share one generation
+recommendation_flights = SingleFlight("recommendations")
+
+# Recommendations precomputed for returning users (see precompute.py)
+recommendation_store = RecommendationStore(
+    path=config.RECOMMENDATION_STORE_PATH,
+    max_age=config.RECOMMENDATION_STORE_MAX_AGE_SECONDS
+) if config.RECOMMENDATION_STORE_ENABLED else None
+
+# Load the bottle data for recommendations. Each request works on the
+# snapshot in catalogs.current when it starts; reloads swap in a new one
+base_dir = os.path.dirname(os.path.abspath(__file__))
+data_file = os.path.join(base_dir, 'data', 'whiskey_data_set.json')
+catalogs = CatalogReloader(data_file)
+
+logger.info(f"Loading whiskey data from: {data_file}")
+loaded = catalogs.reload(force=True)
+if loaded.get('error'):
+    logger.error(f"Failed to load whiskey data: {loaded['error']}")
+else:
+    logger.info(f"Successfully loaded {loaded['bottles']} whiskey bottles (catalog version {loaded['version']})")
+# Pick up dataset changes without a restart
+catalogs.watch(config.CATALOG_RELOAD_INTERVAL_SECONDS)
+
+SUGGESTION_TYPES = {
+    'general': "General recommendation based on collection analysis",
+    'similar-price': "Recommendation within similar price range",
+    'similar-profile': "Recommendation with similar profile to your collection",
+    'complementary': "Complementary addition to diversify your collection",
+}
+
+def error_status(e):
+    """HTTP status for an error raised while generating recommendations"""
+    if isinstance(e, LLMUnavailableError):
+        return 503
+    if isinstance(e, (LLMError, MalformedOutputError)):
+        # The upstream model failed or never produced a usable answer
+        return 502
+    return 500
+
+def price_bounds(payload):
+    """min_price/max_price from a JSON body as floats (None when absent); raises ValueError"""
+    bounds = []
+    for name in ('min_price', 'max_price'):
+        value = payload.get(name)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+            raise ValueError(f"{name} must be a non-negative number")
+        bounds.append(None if value is None else float(value))
+    return tuple(bounds)
+
+def filter_to_catalog(recommendations, suggestion_type, catalog, mode=None):
+    """Keep only recommendations that resolved to a bottle in the catalog"""
+    start = time.perf_counter()
+    filtered_recommendations = []
+    for rec in recommendations:
+        # Check if recommendation exists in our dataset
+        if catalog.has_ranking(rec.get('bottle_data', {}).get('ranking')):
+            rec['suggestion_type'] = suggestion_type
+            filtered_recommendations.append(rec)
+    metrics.observe_stage('filter', time.perf_counter() - start, provider='', **({'mode': mode} if mode else {}))
+    metrics.count_recommendations('returned', len(filtered_recommendations), mode)
+    metrics.count_recommendations('dropped_unranked', len(recommendations) - len(filtered_recommendations), mode)
+    return filtered_recommendations
+
+def filter_modes(results, catalog):
+    """filter_to_catalog for every mode of a generate_all_modes result"""
+    return {
+        mode: filter_to_catalog(recommendations, SUGGESTION_TYPES[mode], catalog, mode)
+        for mode, recommendations in results.items()
+    }
+
+def precomputed(username, catalog, user_bar, user_wishlist):
+    """Every mode's stored recommendations when the store has a fresh entry generated
+    from this catalog version and the user's current bar and wishlist, else None"""
+    if recommendation_store is None:
+        return None
+    return recommendation_store.get(username, fingerprint(catalog, user_bar, user_wishlist))
+
+def fetch_user_data(username, wishlist):
+    """The user's bar and, when asked for, wishlist (fetched concurrently); None otherwise"""
+    if wishlist:
+        return baxus_client.get_user_bar_and_wishlist(username)
+    return baxus_client.get_user_bar(username), None
+
+def request_key(kind, username, user_bar, user_wishlist, catalog, **params):
+    """Coalescing key: same user, kind, query parameters, bar and wishlist contents and catalog version"""
+    return (
+        username, kind, tuple(sorted(params.items())),
+        content_hash(user_bar), content_hash(user_wishlist), catalog.version,
+    )
+
+def coalesced(kind, username, user_bar, user_wishlist, catalog, generate, **params):
+    """Run generate() once for concurrent identical requests; duplicates get the same result"""
+    return recommendation_flights.do(
+        request_key(kind, username, user_bar, user_wishlist, catalog, **params), generate
+    )
+
+@app.before_request
+def start_request_metrics():
+    # Route template and mode label every stage timed while serving the request
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_start = time.perf_counter()
+    metrics.begin_request(g.metrics_route, (request.view_args or {}).get('mode', ''))
+
+@app.after_request
+def record_request_metrics(response):
+    if 'metrics_start' in g:
+        metrics.observe_request(g.metrics_route, request.method, response.status_code,
+                                time.perf_counter() - g.metrics_start)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Request and stage latency histograms, LLM token counts, LLM and BAXUS cache activity, dropped recommendations and coalesced requests (Prometheus text format)"""
+    if not config.METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(metrics.render(), content_type=metrics.MetricsRegistry.CONTENT_TYPE)
+
+def admin_authorized(authorization):
+    """Whether an Authorization header carries the configured admin token"""
+    if not config.ADMIN_TOKEN or not authorization:
+        return False
+    return hmac.compare_digest(authorization.encode(), f"Bearer {config.ADMIN_TOKEN}".encode())
 
 @app.route('/recommendations/<username>', methods=['GET'])
 def get_recommendations(username):
     """General recommendations endpoint"""
+    catalog = catalogs.current
     try:
-        # Get user bar data
-        user_bar = baxus_client.get_user_bar(username)
+        # Get user bar data and wishlist (if available) concurrently
+        user_bar, user_wishlist = baxus_client.get_user_bar_and_wishlist(username)
         if not user_bar:
             return jsonify({"error": "Could not fetch user bar data"}), 400
         
-        # Get user wishlist if available
-        user_wishlist = baxus_client.get_user_wishlist(username)
+        results = precomputed(username, catalog, user_bar, user_wishlist)
+        if results is not None:
+            return jsonify(results['general'])
         
-        # Generate recommendations
-        recommendations = recommendation_engine.generate_recommendations(
-            username=username,
-            user_bar=user_bar,
-            user_wishlist=user_wishlist,
-            bottles=bottles
-        )
-        
-        # Filter to ensure only bottles from the dataset are included
-        available_rankings = {bottle.get('ranking') for bottle in bottles if 'ranking' in bottle}
-        filtered_recommendations = []
+        def generate():
+            recommendations = recommendation_engine.generate_recommendations(
+                username=username,
+                user_bar=user_bar,
+                user_wishlist=user_wishlist,
+                bottles=catalog
+            )
+            # Filter to ensure only bottles from the dataset are included
+            return filter_to_catalog(recommendations, SUGGESTION_TYPES['general'], catalog, 'general')
         
-        for rec in recommendations:
-            # Check if recommendation exists in our dataset
-            if rec.get('bottle_data', {}).get('ranking') in available_rankings:
-                rec['suggestion_type'] = "General recommendation based on collection analysis"
-                filtered_recommendations.append(rec)
-        
-        return jsonify(filtered_recommendations)
+        return jsonify(coalesced('general', username, user_bar, user_wishlist, catalog, generate))
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"error": str(e)}), error_status(e)
 
 @app.route('/recommendations/<username>/similar-price', methods=['GET'])
 def get_recommendations_by_price(username):
     """Recommendations within similar price ranges"""
+    catalog = catalogs.current
     try:
-        # Get user bar data
-        user_bar = baxus_client.get_user_bar(username)
-        if not user_bar:
-            return jsonify({"error": "Could not fetch user bar data"}), 400
-            
         # Get price range parameters (optional)
         min_price = request.args.get('min_price', type=float)
         max_price = request.args.get('max_price', type=float)
         
-        # Generate price-based recommendations
-        recommendations = recommendation_engine.generate_price_based_recommendations(
-            username=username,
-            user_bar=user_bar,
-            bottles=bottles,
-            min_price=min_price,
-            max_price=max_price
-        )
+        # Precomputed results cover the default range only; checking them needs the wishlist too
+        use_store = recommendation_store is not None and min_price is None and max_price is None
+        user_bar, user_wishlist = fetch_user_data(username, use_store)
+        if not user_bar:
+            return jsonify({"error": "Could not fetch user bar data"}), 400
         
-        # Filter to ensure only bottles from the dataset are included
-        available_rankings = {bottle.get('ranking') for bottle in bottles if 'ranking' in bottle}
-        filtered_recommendations = []
+        results = precomputed(username, catalog, user_bar, user_wishlist) if use_store else None
+        if results is not None:
+            return jsonify(results['similar-price'])
         
-        for rec in recommendations:
-            # Check if recommendation exists in our dataset
-            if rec.get('bottle_data', {}).get('ranking') in available_rankings:
-                rec['suggestion_type'] = "Recommendation within similar price range"
-                filtered_recommendations.append(rec)
+        def generate():
+            recommendations = recommendation_engine.generate_price_based_recommendations(
+                username=username,
+                user_bar=user_bar,
+                bottles=catalog,
+                min_price=min_price,
+                max_price=max_price
+            )
+            # Filter to ensure only bottles from the dataset are included
+            return filter_to_catalog(recommendations, SUGGESTION_TYPES['similar-price'], catalog, 'similar-price')
         
-        return jsonify(filtered_recommendations)
+        return jsonify(coalesced('similar-price', username, user_bar, None, catalog, generate,
+                                 min_price=min_price, max_price=max_price))
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"error": str(e)}), error_status(e)
 
 @app.route('/recommendations/<username>/similar-profile', methods=['GET'])
 def get_recommendations_by_profile(username):
     """Recommendations with similar profiles to existing collection"""
+    catalog = catalogs.current
     try:
-        # Get user bar data
-        user_bar = baxus_client.get_user_bar(username)
-        if not user_bar:
-            return jsonify({"error": "Could not fetch user bar data"}), 400
-            
         # Optional profile focus parameter
         profile_focus = request.args.get('focus', default=None)
         
-        # Generate profile-based recommendations
-        recommendations = recommendation_engine.generate_profile_based_recommendations(
-            username=username,
-            user_bar=user_bar,
-            bottles=bottles,
-            profile_focus=profile_focus
-        )
+        # Precomputed results have no focus; checking them needs the wishlist too
+        use_store = recommendation_store is not None and profile_focus is None
+        user_bar, user_wishlist = fetch_user_data(username, use_store)
+        if not user_bar:
+            return jsonify({"error": "Could not fetch user bar data"}), 400
         
-        # Filter to ensure only bottles from the dataset are included
-        available_rankings = {bottle.get('ranking') for bottle in bottles if 'ranking' in bottle}
-        filtered_recommendations = []
+        results = precomputed(username, catalog, user_bar, user_wishlist) if use_store else None
+        if results is not None:
+            return jsonify(results['similar-profile'])
         
-        for rec in recommendations:
-            # Check if recommendation exists in our dataset
-            if rec.get('bottle_data', {}).get('ranking') in available_rankings:
-                rec['suggestion_type'] = "Recommendation with similar profile to your collection"
-                filtered_recommendations.append(rec)
+        def generate():
+            recommendations = recommendation_engine.generate_profile_based_recommendations(
+                username=username,
+                user_bar=user_bar,
+                bottles=catalog,
+                profile_focus=profile_focus
+            )
+            # Filter to ensure only bottles from the dataset are included
+            return filter_to_catalog(recommendations, SUGGESTION_TYPES['similar-profile'], catalog, 'similar-profile')
         
-        return jsonify(filtered_recommendations)
+        return jsonify(coalesced('similar-profile', username, user_bar, None, catalog, generate,
+                                 focus=profile_focus))
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"error": str(e)}), error_status(e)
 
 @app.route('/recommendations/<username>/complementary', methods=['GET'])
 def get_complementary_recommendations(username):
     """Recommendations for bottles that diversify a collection"""
+    catalog = catalogs.current
     try:
-        # Get user bar data
-        user_bar = baxus_client.get_user_bar(username)
+        # Checking precomputed results needs the wishlist too
+        use_store = recommendation_store is not None
+        user_bar, user_wishlist = fetch_user_data(username, use_store)
         if not user_bar:
             return jsonify({"error": "Could not fetch user bar data"}), 400
+        
+        results = precomputed(username, catalog, user_bar, user_wishlist) if use_store else None
+        if results is not None:
+            return jsonify(results['complementary'])
             
-        # Generate diversifying recommendations
-        recommendations = recommendation_engine.generate_complementary_recommendations(
-            username=username,
-            user_bar=user_bar,
-            bottles=bottles
-        )
+        def generate():
+            recommendations = recommendation_engine.generate_complementary_recommendations(
+                username=username,
+                user_bar=user_bar,
+                bottles=catalog
+            )
+            # Filter to ensure only bottles from the dataset are included
+            return filter_to_catalog(recommendations, SUGGESTION_TYPES['complementary'], catalog, 'complementary')
+        
+        return jsonify(coalesced('complementary', username, user_bar, None, catalog, generate))
+    except Exception as e:
+        return jsonify({"error": str(e)}), error_status(e)
+
+@app.route('/recommendations/<username>/all', methods=['GET'])
+def get_all_recommendations(username):
+    """General, price, profile and complementary recommendations from a single LLM call"""
+    catalog = catalogs.current
+    try:
+        params = {
+            'min_price': request.args.get('min_price', type=float),
+            'max_price': request.args.get('max_price', type=float),
+            'profile_focus': request.args.get('focus', default=None),
+        }
+        
+        # Get user bar data and wishlist (if available) concurrently
+        user_bar, user_wishlist = baxus_client.get_user_bar_and_wishlist(username)
+        if not user_bar:
+            return jsonify({"error": "Could not fetch user bar data"}), 400
         
-        # Filter to ensure only bottles from the dataset are included
-        available_rankings = {bottle.get('ranking') for bottle in bottles if 'ranking' in bottle}
-        filtered_recommendations = []
+        if all(value is None for value in params.values()):
+            results = precomputed(username, catalog, user_bar, user_wishlist)
+            if results is not None:
+                return jsonify(results)
         
-        for rec in recommendations:
-            # Check if recommendation exists in our dataset
-            if rec.get('bottle_data', {}).get('ranking') in available_rankings:
-                rec['suggestion_type'] = "Complementary addition to diversify your collection"
-                filtered_recommendations.append(rec)
+        def generate():
+            # Generate every mode at once
+            results = recommendation_engine.generate_all_modes(
+                username=username,
+                user_bar=user_bar,
+                bottles=catalog,
+                user_wishlist=user_wishlist,
+                **params
+            )
+            # Filter to ensure only bottles from the dataset are included
+            return filter_modes(results, catalog)
         
-        return jsonify(filtered_recommendations)
+        return jsonify(coalesced('all', username, user_bar, user_wishlist, catalog, generate, **params))
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"error": str(e)}), error_status(e)
 
 @app.route('/direct-recommendations/<username>', methods=['GET'])
 def get_direct_recommendations(username):
     """Generate whisky recommendations directly without storing in a file"""
+    catalog = catalogs.current
     try:
-        # Get user bar data
-        user_bar = baxus_client.get_user_bar(username)
+        # Get user bar data and wishlist (if available) concurrently
+        user_bar, user_wishlist = baxus_client.get_user_bar_and_wishlist(username)
         if not user_bar:
             return jsonify({"error": "Could not fetch user bar data"}), 400
         
-        # Get user wishlist if available
-        user_wishlist = baxus_client.get_user_wishlist(username)
+        results = precomputed(username, catalog, user_bar, user_wishlist)
+        if results is not None:
+            return jsonify([
+                dict(rec, suggestion_type="Direct personalized recommendation based on analysis")
+                for rec in results['general']
+            ])
         
-        # Generate recommendations
-        recommendations = recommendation_engine.generate_recommendations(
+        def generate():
+            recommendations = recommendation_engine.generate_recommendations(
+                username=username,
+                user_bar=user_bar,
+                user_wishlist=user_wishlist,
+                bottles=catalog
+            )
+            # Filter to ensure only bottles from the dataset are included
+            return filter_to_catalog(recommendations, "Direct personalized recommendation based on analysis", catalog, 'general')
+        
+        return jsonify(coalesced('direct', username, user_bar, user_wishlist, catalog, generate))
+    except Exception as e:
+        return jsonify({"error": str(e)}), error_status(e)
+
+@app.route('/recommendations/batch', methods=['POST'])
+def get_batch_recommendations():
+    """Recommendations for many users, streamed back as NDJSON as each completes"""
+    payload = request.get_json(silent=True) or {}
+    usernames = payload.get('usernames')
+    mode = payload.get('mode', 'general')
+    
+    if not isinstance(usernames, list) or not usernames or not all(isinstance(u, str) for u in usernames):
+        return jsonify({"error": "Request body must include a non-empty 'usernames' list"}), 400
+    if len(usernames) > config.BATCH_MAX_USERNAMES:
+        return jsonify({"error": f"At most {config.BATCH_MAX_USERNAMES} usernames per batch"}), 400
+    if mode not in RecommendationEngine.MODES:
+        return jsonify({"error": f"Unknown recommendation mode: {mode}"}), 400
+    try:
+        min_price, max_price = price_bounds(payload)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    catalog = catalogs.current
+    batch = BatchRecommender(
+        baxus_client,
+        recommendation_engine,
+        catalog,
+        postprocess=lambda recs, mode: filter_to_catalog(recs, SUGGESTION_TYPES[mode], catalog, mode)
+    )
+    results = batch.run(
+        usernames,
+        mode=mode,
+        min_price=min_price,
+        max_price=max_price,
+        profile_focus=payload.get('focus')
+    )
+    
+    def lines():
+        for result in results:
+            yield json.dumps(result) + "\n"
+    
+    return Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+
+def job_request(payload):
+    """Validate a job submission; returns (dedup key, params, priority) or raises ValueError"""
+    payload = payload if isinstance(payload, dict) else {}
+    username = payload.get('username')
+    mode = payload.get('mode', 'general')
+    priority = payload.get('priority', 'normal')
+    
+    if not isinstance(username, str) or not username:
+        raise ValueError("Request body must include a 'username'")
+    if mode != 'all' and mode not in RecommendationEngine.MODES:
+        raise ValueError(f"Unknown recommendation mode: {mode}")
+    if priority not in PRIORITIES:
+        raise ValueError(f"priority must be one of: {', '.join(PRIORITIES)}")
+    min_price, max_price = price_bounds(payload)
+    params = {
+        'username': username,
+        'mode': mode,
+        'min_price': min_price,
+        'max_price': max_price,
+        'focus': payload.get('focus'),
+    }
+    # One pending job per user and query
+    return json.dumps(params, sort_keys=True), params, priority
+
+def run_recommendation_job(params):
+    """Fetch the user's data and generate one mode (or all of them) for a background job"""
+    username, mode = params['username'], params['mode']
+    metrics.begin_request('job', mode)
+    catalog = catalogs.current
+    if mode in ('general', 'all'):
+        user_bar, user_wishlist = baxus_client.get_user_bar_and_wishlist(username)
+    else:
+        user_bar, user_wishlist = baxus_client.get_user_bar(username), None
+    if not user_bar:
+        raise ValueError("Could not fetch user bar data")
+    
+    options = {
+        'min_price': params['min_price'],
+        'max_price': params['max_price'],
+        'profile_focus': params['focus'],
+    }
+    if mode == 'all':
+        results = recommendation_engine.generate_all_modes(
+            username, user_bar, catalog, user_wishlist=user_wishlist, **options
+        )
+        return filter_modes(results, catalog)
+    recommendations = recommendation_engine.generate_for_mode(
+        mode, username, user_bar, catalog, user_wishlist=user_wishlist, **options
+    )
+    return filter_to_catalog(recommendations, SUGGESTION_TYPES[mode], catalog, mode)
+
+# Background generations, so slow LLM calls never hold a request open
+jobs = JobQueue(run_recommendation_job)
+
+@app.route('/jobs/recommendations', methods=['POST'])
+def submit_recommendation_job():
+    """Queue a recommendation job and return its id at once; poll GET /jobs/<id> for the result"""
+    try:
+        key, params, priority = job_request(request.get_json(silent=True))
+        job = jobs.submit(key, params, priority)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except JobQueueFullError as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': str(config.JOBS_RETRY_AFTER_SECONDS)}
+    return jsonify(job), 202, {'Location': f"/jobs/{job['id']}"}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of a submitted job, with its result once done (kept for JOBS_RESULT_TTL_SECONDS)"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    return jsonify(job)
+
+@app.route('/admin/catalog', methods=['GET'])
+def get_catalog_status():
+    """Version, size and reload counts of the catalog snapshot being served"""
+    if not admin_authorized(request.headers.get('Authorization')):
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(catalogs.status())
+
+@app.route('/admin/catalog/reload', methods=['POST'])
+def reload_catalog():
+    """Reload the dataset now and swap it in; requests already running keep their snapshot"""
+    if not admin_authorized(request.headers.get('Authorization')):
+        return jsonify({"error": "Unauthorized"}), 401
+    status = catalogs.reload(force=True)
+    return jsonify(status), 500 if status.get('error') else 200
+
+def sse_event(event, data):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/recommendations/<username>/stream', defaults={'mode': 'general'}, methods=['GET'])
+@app.route('/recommendations/<username>/<mode>/stream', methods=['GET'])
+def stream_recommendations(username, mode):
+    """Stream recommendations as Server-Sent Events while the LLM generates them"""
+    if mode not in RecommendationEngine.MODES:
+        return jsonify({"error": f"Unknown recommendation mode: {mode}"}), 404
+    catalog = catalogs.current
+    try:
+        # Get user bar data (and the wishlist for general recommendations)
+        if mode == 'general':
+            user_bar, user_wishlist = baxus_client.get_user_bar_and_wishlist(username)
+        else:
+            user_bar, user_wishlist = baxus_client.get_user_bar(username), None
+        if not user_bar:
+            return jsonify({"error": "Could not fetch user bar data"}), 400
+        
+        recommendations = recommendation_engine.stream_recommendations(
+            mode=mode,
             username=username,
             user_bar=user_bar,
+            bottles=catalog,
             user_wishlist=user_wishlist,
-            bottles=bottles
+            min_price=request.args.get('min_price', type=float),
+            max_price=request.args.get('max_price', type=float),
+            profile_focus=request.args.get('focus', default=None)
         )
-        
-        # Filter to ensure only bottles from the dataset are included
-        available_rankings = {bottle.get('ranking') for bottle in bottles if 'ranking' in bottle}
-        filtered_recommendations = []
-        
-        for rec in recommendations:
-            # Check if recommendation exists in our dataset
-            if rec.get('bottle_data', {}).get('ranking') in available_rankings:
-                rec['suggestion_type'] = "Direct personalized recommendation based on analysis"
-                filtered_recommendations.append(rec)
-        
-        return jsonify(filtered_recommendations)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"error": str(e)}), error_status(e)
+    
+    def events():
+        count = 0
+        try:
+            for rec in recommendations:
+                # Push each catalog-matched recommendation the moment it is parsed
+                for filtered in filter_to_catalog([rec], SUGGESTION_TYPES[mode], catalog, mode):
+                    count += 1
+                    yield sse_event("recommendation", filtered)
+            yield sse_event("done", {"count": count})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
     
     
 if __name__ == '__main__':
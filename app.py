@@ -2,10 +2,13 @@ import sys
 import os
 import json
 
+import config
 from src.baxus_client import BaxusClient
 from src.data_processor import WhiskyDataProcessor
 # Comment out or remove this line:
-from src.llm_client import LLMClient
+from src.llm_client import LLMError
+from src.llm_cache import CachedLLMClient
+from src.llm_router import build_llm_client
 # Add this import:
 # from src.local_llm_client import LocalLLMClient
 # from src.remote_llm_client import RemoteLLMClient
@@ -27,7 +30,9 @@ def main():
         return
     
     # Initialize LLM client
-    llm_client = LLMClient(provider='anthropic')
+    llm_client = build_llm_client(config.LLM_PROVIDERS)
+    if config.LLM_CACHE_ENABLED:
+        llm_client = CachedLLMClient(llm_client)
     
     # Initialize Local LLM client instead of using LLMClient with Gemini
     # You can specify a different model path if needed
@@ -65,7 +70,11 @@ def main():
     
     # Generate recommendations
     print("\nAnalyzing collection and generating recommendations...")
-    recommendations = recommender.recommend(user_bar)
+    try:
+        recommendations = recommender.recommend(user_bar)
+    except LLMError as e:
+        print(f"Could not generate recommendations: {e}")
+        return
     
     # Display recommendations
     print("\n" + "="*50)
@@ -0,0 +1,410 @@
+"""ASGI serving mode: the api.py routes on an event loop
+
+BAXUS fetches and LLM generations are awaited instead of blocking a worker
+thread, so one process can hold hundreds of in-flight recommendations.
+Clients without async support (the local and remote LLM clients) still run
+in a worker thread per generation.
+
+Run with: python asgi.py (config.ASGI_WORKERS processes), or
+uvicorn asgi:app --port 2005 --workers <cores>
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from urllib.parse import parse_qs, unquote
+
+import config
+from api import (SUGGESTION_TYPES, admin_authorized, catalogs, error_status, filter_modes, filter_to_catalog, job_request,
+                 jobs, precomputed, price_bounds, recommendation_engine, recommendation_store, request_key, sse_event)
+from src import metrics
+from src.async_baxus_client import AsyncBaxusClient
+from src.batch import BatchRecommender
+from src.jobs import JobQueueFullError
+from src.recommendation_engine import RecommendationEngine
+from src.single_flight import AsyncSingleFlight
+
+# Same policy as the Flask app's flask_cors setup
+CORS_ORIGINS = ("http://localhost:3000",)
+CORS_METHODS = "DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"
+
+baxus_client = AsyncBaxusClient()
+
+# Identical concurrent recommendation requests share one generation
+recommendation_flights = AsyncSingleFlight("recommendations")
+
+
+class Request:
+    """The parts of an ASGI HTTP scope the routes use"""
+
+    def __init__(self, scope, receive):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+        self.query = {name: values[0] for name, values in parse_qs(scope["query_string"].decode("latin-1")).items()}
+        self._receive = receive
+
+    def arg(self, name, type=str, default=None):
+        """Query parameter like Flask's request.args.get: default when missing or not convertible"""
+        try:
+            return type(self.query[name])
+        except (KeyError, ValueError):
+            return default
+
+    async def json(self):
+        """Request body parsed as JSON, or None"""
+        body = b""
+        while True:
+            message = await self._receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        try:
+            return json.loads(body or b"null")
+        except ValueError:
+            return None
+
+
+class Response:
+    """JSON body, raw bytes, or an async iterator of text chunks streamed as they are produced"""
+
+    def __init__(self, body, status=200, content_type="application/json", headers=None):
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers or {}
+
+    async def send(self, send, extra_headers):
+        headers = {"content-type": self.content_type, **self.headers, **extra_headers}
+        payload = None
+        if isinstance(self.body, bytes):
+            payload = self.body
+        elif self.content_type == "application/json":
+            payload = json.dumps(self.body).encode()
+        if payload is not None:
+            headers["content-length"] = str(len(payload))
+        await send({
+            "type": "http.response.start",
+            "status": self.status,
+            "headers": [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()],
+        })
+        if payload is not None:
+            await send({"type": "http.response.body", "body": payload})
+            return
+        async for chunk in self.body:
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+
+def error(message, status):
+    return Response({"error": message}, status)
+
+
+async def coalesced(kind, username, user_bar, user_wishlist, catalog, generate, **params):
+    """Await generate() once for concurrent identical requests; duplicates get the same result"""
+    return await recommendation_flights.do(
+        request_key(kind, username, user_bar, user_wishlist, catalog, **params), generate
+    )
+
+
+async def mode_recommendations(request, username, mode, suggestion_type, kind, **params):
+    """Fetch the bar (and wishlist for general or a store check), serve stored results for it, or generate one mode and keep catalog matches"""
+    catalog = catalogs.current
+    # Precomputed results cover the default query only, and checking them needs the wishlist
+    use_store = recommendation_store is not None and all(value is None for value in params.values())
+    if mode == 'general' or use_store:
+        user_bar, user_wishlist = await baxus_client.get_user_bar_and_wishlist(username)
+    else:
+        user_bar, user_wishlist = await baxus_client.get_user_bar(username), None
+    if not user_bar:
+        return error("Could not fetch user bar data", 400)
+
+    # The store is SQLite, so read it in a worker thread
+    if use_store:
+        results = await asyncio.to_thread(precomputed, username, catalog, user_bar, user_wishlist)
+        if results is not None:
+            return Response([dict(rec, suggestion_type=suggestion_type) for rec in results[mode]])
+
+    async def generate():
+        recommendations = await recommendation_engine.agenerate_for_mode(
+            mode, username, user_bar, catalog, user_wishlist=user_wishlist, **params
+        )
+        # Filter to ensure only bottles from the dataset are included
+        return filter_to_catalog(recommendations, suggestion_type, catalog, mode)
+
+    return Response(await coalesced(kind, username, user_bar, user_wishlist, catalog, generate, **params))
+
+
+async def get_recommendations(request, username):
+    """General recommendations endpoint"""
+    return await mode_recommendations(request, username, 'general', SUGGESTION_TYPES['general'], 'general')
+
+
+async def get_recommendations_by_price(request, username):
+    """Recommendations within similar price ranges"""
+    return await mode_recommendations(
+        request, username, 'similar-price', SUGGESTION_TYPES['similar-price'], 'similar-price',
+        min_price=request.arg('min_price', float), max_price=request.arg('max_price', float)
+    )
+
+
+async def get_recommendations_by_profile(request, username):
+    """Recommendations with similar profiles to existing collection"""
+    return await mode_recommendations(
+        request, username, 'similar-profile', SUGGESTION_TYPES['similar-profile'], 'similar-profile',
+        profile_focus=request.arg('focus')
+    )
+
+
+async def get_complementary_recommendations(request, username):
+    """Recommendations for bottles that diversify a collection"""
+    return await mode_recommendations(
+        request, username, 'complementary', SUGGESTION_TYPES['complementary'], 'complementary'
+    )
+
+
+async def get_direct_recommendations(request, username):
+    """Generate whisky recommendations directly without storing in a file"""
+    return await mode_recommendations(
+        request, username, 'general', "Direct personalized recommendation based on analysis", 'direct'
+    )
+
+
+async def get_all_recommendations(request, username):
+    """General, price, profile and complementary recommendations from a single LLM call"""
+    params = {
+        'min_price': request.arg('min_price', float),
+        'max_price': request.arg('max_price', float),
+        'profile_focus': request.arg('focus'),
+    }
+    catalog = catalogs.current
+    user_bar, user_wishlist = await baxus_client.get_user_bar_and_wishlist(username)
+    if not user_bar:
+        return error("Could not fetch user bar data", 400)
+
+    if all(value is None for value in params.values()):
+        results = await asyncio.to_thread(precomputed, username, catalog, user_bar, user_wishlist)
+        if results is not None:
+            return Response(results)
+
+    async def generate():
+        results = await recommendation_engine.agenerate_all_modes(
+            username, user_bar, catalog, user_wishlist=user_wishlist, **params
+        )
+        return filter_modes(results, catalog)
+
+    return Response(await coalesced('all', username, user_bar, user_wishlist, catalog, generate, **params))
+
+
+async def get_batch_recommendations(request):
+    """Recommendations for many users, streamed back as NDJSON as each completes"""
+    payload = await request.json() or {}
+    usernames = payload.get('usernames') if isinstance(payload, dict) else None
+    mode = payload.get('mode', 'general') if isinstance(payload, dict) else None
+
+    if not isinstance(usernames, list) or not usernames or not all(isinstance(u, str) for u in usernames):
+        return error("Request body must include a non-empty 'usernames' list", 400)
+    if len(usernames) > config.BATCH_MAX_USERNAMES:
+        return error(f"At most {config.BATCH_MAX_USERNAMES} usernames per batch", 400)
+    if mode not in RecommendationEngine.MODES:
+        return error(f"Unknown recommendation mode: {mode}", 400)
+    try:
+        min_price, max_price = price_bounds(payload)
+    except ValueError as e:
+        return error(str(e), 400)
+
+    catalog = catalogs.current
+    batch = BatchRecommender(
+        baxus_client,
+        recommendation_engine,
+        catalog,
+        postprocess=lambda recs, mode: filter_to_catalog(recs, SUGGESTION_TYPES[mode], catalog, mode)
+    )
+    results = batch.arun(
+        usernames,
+        mode=mode,
+        min_price=min_price,
+        max_price=max_price,
+        profile_focus=payload.get('focus')
+    )
+
+    async def lines():
+        async for result in results:
+            yield json.dumps(result) + "\n"
+
+    return Response(lines(), content_type="application/x-ndjson")
+
+
+async def submit_recommendation_job(request):
+    """Queue a recommendation job and return its id at once; poll GET /jobs/<id> for the result"""
+    try:
+        key, params, priority = job_request(await request.json())
+        job = jobs.submit(key, params, priority)
+    except ValueError as e:
+        return error(str(e), 400)
+    except JobQueueFullError as e:
+        return Response({"error": str(e)}, 503, headers={"retry-after": str(config.JOBS_RETRY_AFTER_SECONDS)})
+    return Response(job, 202, headers={"location": f"/jobs/{job['id']}"})
+
+
+async def get_job(request, job_id):
+    """Status of a submitted job, with its result once done (kept for JOBS_RESULT_TTL_SECONDS)"""
+    job = jobs.get(job_id)
+    if job is None:
+        return error("Unknown or expired job", 404)
+    return Response(job)
+
+
+async def stream_recommendations(request, username, mode='general'):
+    """Stream recommendations as Server-Sent Events while the LLM generates them"""
+    if mode not in RecommendationEngine.MODES:
+        return error(f"Unknown recommendation mode: {mode}", 404)
+    catalog = catalogs.current
+    if mode == 'general':
+        user_bar, user_wishlist = await baxus_client.get_user_bar_and_wishlist(username)
+    else:
+        user_bar, user_wishlist = await baxus_client.get_user_bar(username), None
+    if not user_bar:
+        return error("Could not fetch user bar data", 400)
+
+    recommendations = recommendation_engine.astream_recommendations(
+        mode, username, user_bar, catalog,
+        user_wishlist=user_wishlist,
+        min_price=request.arg('min_price', float),
+        max_price=request.arg('max_price', float),
+        profile_focus=request.arg('focus')
+    )
+
+    async def events():
+        count = 0
+        try:
+            async for rec in recommendations:
+                # Push each catalog-matched recommendation the moment it is parsed
+                for filtered in filter_to_catalog([rec], SUGGESTION_TYPES[mode], catalog, mode):
+                    count += 1
+                    yield sse_event("recommendation", filtered)
+            yield sse_event("done", {"count": count})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+        finally:
+            await recommendations.aclose()
+
+    return Response(
+        events(),
+        content_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"}
+    )
+
+
+async def get_catalog_status(request):
+    """Version, size and reload counts of the catalog snapshot being served"""
+    if not admin_authorized(request.headers.get("authorization")):
+        return error("Unauthorized", 401)
+    return Response(catalogs.status())
+
+
+async def reload_catalog(request):
+    """Reload the dataset now and swap it in; requests already running keep their snapshot"""
+    if not admin_authorized(request.headers.get("authorization")):
+        return error("Unauthorized", 401)
+    # Building the indexes is CPU work; keep it off the event loop
+    status = await asyncio.to_thread(catalogs.reload, True)
+    return Response(status, 500 if status.get("error") else 200)
+
+
+async def get_metrics(request):
+    """Request and stage latency histograms, LLM token counts, LLM and BAXUS cache activity, dropped recommendations and coalesced requests (Prometheus text format)"""
+    if not config.METRICS_ENABLED:
+        return error("Metrics are disabled", 404)
+    return Response(metrics.render().encode(), content_type=metrics.MetricsRegistry.CONTENT_TYPE)
+
+
+ROUTES = [
+    ("GET", r"/metrics", get_metrics),
+    ("POST", r"/recommendations/batch", get_batch_recommendations),
+    ("GET", r"/recommendations/(?P<username>[^/]+)", get_recommendations),
+    ("GET", r"/recommendations/(?P<username>[^/]+)/similar-price", get_recommendations_by_price),
+    ("GET", r"/recommendations/(?P<username>[^/]+)/similar-profile", get_recommendations_by_profile),
+    ("GET", r"/recommendations/(?P<username>[^/]+)/complementary", get_complementary_recommendations),
+    ("GET", r"/recommendations/(?P<username>[^/]+)/all", get_all_recommendations),
+    ("GET", r"/direct-recommendations/(?P<username>[^/]+)", get_direct_recommendations),
+    ("GET", r"/recommendations/(?P<username>[^/]+)/stream", stream_recommendations),
+    ("GET", r"/recommendations/(?P<username>[^/]+)/(?P<mode>[^/]+)/stream", stream_recommendations),
+    ("POST", r"/jobs/recommendations", submit_recommendation_job),
+    ("GET", r"/jobs/(?P<job_id>[^/]+)", get_job),
+    ("GET", r"/admin/catalog", get_catalog_status),
+    ("POST", r"/admin/catalog/reload", reload_catalog),
+]
+# Each route is labelled in /metrics by its template, as Flask names it (/recommendations/<username>)
+ROUTES = [
+    (method, re.compile(f"^{pattern}$"), handler, re.sub(r"\(\?P<(\w+)>[^)]*\)", r"<\1>", pattern))
+    for method, pattern, handler in ROUTES
+]
+
+
+def cors_headers(request):
+    """Allow the configured origins, with credentials"""
+    origin = request.headers.get("origin")
+    if origin not in CORS_ORIGINS:
+        return {}
+    return {"access-control-allow-origin": origin, "access-control-allow-credentials": "true", "vary": "Origin"}
+
+
+async def dispatch(request):
+    """Route a request; a path served under another method answers 405"""
+    allowed = []
+    for method, pattern, handler, route in ROUTES:
+        match = pattern.match(request.path)
+        if not match:
+            continue
+        if method != request.method:
+            allowed.append(method)
+            continue
+        params = {name: unquote(value) for name, value in match.groupdict().items()}
+        start = time.perf_counter()
+        metrics.begin_request(route, params.get("mode", ""))
+        try:
+            response = await handler(request, **params)
+        except Exception as e:
+            response = error(str(e), error_status(e))
+        metrics.observe_request(route, request.method, response.status, time.perf_counter() - start)
+        return response
+    if allowed:
+        return Response({"error": "Method not allowed"}, 405, headers={"allow": ", ".join(allowed + ["OPTIONS"])})
+    return error("Not found", 404)
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await baxus_client.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    request = Request(scope, receive)
+    cors = cors_headers(request)
+    if request.method == "OPTIONS":
+        # CORS preflight
+        if cors:
+            cors["access-control-allow-methods"] = CORS_METHODS
+            if "access-control-request-headers" in request.headers:
+                cors["access-control-allow-headers"] = request.headers["access-control-request-headers"]
+        await Response(b"", content_type="text/plain").send(send, cors)
+        return
+    response = await dispatch(request)
+    await response.send(send, cors)
+
+
+if __name__ == '__main__':
+    import uvicorn # type: ignore
+    port = int(os.environ.get('PORT', 2005))
+    # Worker processes import the app by name
+    uvicorn.run('asgi:app' if config.ASGI_WORKERS > 1 else app, host='0.0.0.0', port=port,
+                workers=config.ASGI_WORKERS)
@@ -0,0 +1,152 @@
+"""Concurrent /recommendations load: Flask on a thread pool vs the ASGI app
+
+Starts the stub BAXUS and stub Anthropic servers as subprocesses, then sends
+`requests` GET /recommendations/<username> requests for distinct users (so
+nothing is coalesced or cached) all at once. The Flask app serves them from
+a pool of `threads` worker threads, as a threaded WSGI server would; the
+ASGI app serves them all from one event loop. The LLM stub takes
+`first_token_seconds` before its first token, which dominates each request.
+Latencies are measured from when the burst is sent, so they include time a
+Flask request spends queued for a worker thread.
+
+Usage: python benchmarks/bench_async_load.py [requests] [threads] [first_token_seconds]
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BAXUS_PORT = 8792
+ANTHROPIC_PORT = 8793
+
+# The LLM clients are built when api is imported, so point them at the stub first
+os.environ["ANTHROPIC_BASE_URL"] = f"http://127.0.0.1:{ANTHROPIC_PORT}"
+os.environ.setdefault("ANTHROPIC_API_KEY", "stub")
+
+import config
+
+config.LLM_PROVIDER = "anthropic"
+config.LLM_CACHE_ENABLED = False
+config.BAXUS_CACHE_TTL_SECONDS = 0
+config.ANTHROPIC_API_KEY = os.environ["ANTHROPIC_API_KEY"]
+
+import httpx
+
+import api
+import asgi
+from src.async_baxus_client import AsyncBaxusClient
+from src.baxus_client import BaxusClient
+
+
+def start_stub(script, port, env=None):
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "benchmarks", script), str(port)],
+                               env={**os.environ, **(env or {})}, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"{script} did not start on port {port}")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def report(label, wall, cpu, latencies, statuses, peak_threads):
+    ok = sum(status == 200 for status in statuses)
+    print(f"{label:<22} {wall:6.2f} s  {len(statuses) / wall:6.1f} req/s  "
+          f"p50 {percentile(latencies, 50):5.2f} s  p95 {percentile(latencies, 95):5.2f} s  "
+          f"{ok}/{len(statuses)} ok  cpu {cpu:5.2f} s  peak threads {peak_threads}")
+
+
+class ThreadPeak:
+    """Samples the process thread count in the background"""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(0.02):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_flask(count, threads):
+    api.baxus_client = BaxusClient(api_url=f"http://127.0.0.1:{BAXUS_PORT}", pool_size=2 * threads)
+    client = api.app.test_client()
+
+    def one(i):
+        status = client.get(f"/recommendations/flask{i}").status_code
+        return time.perf_counter() - start, status
+
+    with ThreadPeak() as peak:
+        cpu, start = time.process_time(), time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            results = list(pool.map(one, range(count)))
+        wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+    api.baxus_client.close()
+    report(f"flask, {threads} threads", wall, cpu, [r[0] for r in results], [r[1] for r in results], peak.peak)
+
+
+async def run_asgi(count):
+    asgi.baxus_client = AsyncBaxusClient(api_url=f"http://127.0.0.1:{BAXUS_PORT}")
+    transport = httpx.ASGITransport(app=asgi.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://asgi", timeout=None) as client:
+        async def one(i):
+            start = time.perf_counter()
+            status = (await client.get(f"/recommendations/asgi{i}")).status_code
+            return time.perf_counter() - start, status
+
+        with ThreadPeak() as peak:
+            cpu, start = time.process_time(), time.perf_counter()
+            results = await asyncio.gather(*(one(i) for i in range(count)))
+            wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+    await asgi.baxus_client.close()
+    report("asgi, one event loop", wall, cpu, [r[0] for r in results], [r[1] for r in results], peak.peak)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    first_token_seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+
+    stubs = [
+        start_stub("stub_baxus.py", BAXUS_PORT),
+        start_stub("stub_anthropic.py", ANTHROPIC_PORT, {
+            "STUB_ANTHROPIC_FIRST_TOKEN_SECONDS": str(first_token_seconds),
+            "STUB_ANTHROPIC_TOKEN_SECONDS": "0.005",
+        }),
+    ]
+    try:
+        print(f"{count} concurrent requests for distinct users, LLM first token "
+              f"{first_token_seconds * 1000:.0f} ms, BAXUS 50 ms/request")
+        run_flask(count, threads)
+        asyncio.run(run_asgi(count))
+    finally:
+        for stub in stubs:
+            stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
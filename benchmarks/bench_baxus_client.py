@@ -0,0 +1,50 @@
+"""Compare serial, connection-per-call fetches with the pooled BaxusClient
+
+Usage: python benchmarks/bench_baxus_client.py [iterations]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests # type: ignore
+
+from benchmarks.stub_baxus import StubBaxusServer
+from src.baxus_client import BaxusClient
+
+
+def legacy_fetch(api_url, username):
+    """What /recommendations/<username> used to do: two fresh requests in series"""
+    headers = {"Content-Type": "application/json"}
+    bar = requests.get(f"{api_url}/bar/user/{username}", headers=headers).json()
+    wishlist = requests.get(f"{api_url}/wishlist/user/{username}", headers=headers).json()
+    return bar, wishlist
+
+
+def timed(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with StubBaxusServer(latency=0.05, connect_latency=0.05) as stub:
+        client = BaxusClient(api_url=stub.url, cache_ttl=0)  # measure the network path, not the cache
+        client.get_user_bar_and_wishlist("warmup")
+
+        legacy_ms = timed(lambda: legacy_fetch(stub.url, "heisjoel0x"), iterations)
+        pooled_ms = timed(lambda: client.get_user_bar_and_wishlist("heisjoel0x"), iterations)
+        client.close()
+
+        print(f"stub latency:        50 ms/request + 50 ms/new connection")
+        print(f"legacy serial fetch: {legacy_ms:.1f} ms per user")
+        print(f"pooled concurrent:   {pooled_ms:.1f} ms per user")
+        print(f"speedup:             {legacy_ms / pooled_ms:.1f}x")
+        print(f"connections opened:  {stub.connections} for {stub.requests} requests")
+
+
+if __name__ == "__main__":
+    main()
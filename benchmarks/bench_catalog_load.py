@@ -0,0 +1,114 @@
+"""Catalog cold start and memory: JSON dataset vs compiled, memory-mapped file
+
+Writes a synthetic catalog of `rows` bottles (the real dataset's bottles,
+repeated with new ids and names), compiles it, and for each format starts
+`workers` fresh processes that load the catalog and run one candidate
+retrieval and one fuzzy name lookup. Reports load time, the time to warm
+the indexes a compiled catalog builds after opening (the name resolver),
+first retrieval and lookup times, and the resident (RSS) and proportional
+(PSS, shared pages split between the processes mapping them) memory the
+catalog added to each process.
+
+Usage: python benchmarks/bench_catalog_load.py [rows] [workers]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATASET = os.path.join(ROOT, 'data', 'whiskey_data_set.json')
+
+WORKER = r"""
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+from src.catalog import Catalog
+from src.retrieval import CandidateRetriever
+
+def memory():
+    values = {{}}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith(('Rss:', 'Pss:')):
+                key, value = line.split()[:2]
+                values[key[:-1]] = int(value) / 1024
+    return values
+
+before = memory()
+start = time.perf_counter()
+catalog = Catalog.load({path!r})
+loaded = time.perf_counter() - start
+start = time.perf_counter()
+catalog.warm()
+warmed = time.perf_counter() - start
+start = time.perf_counter()
+bar = [{{"product": {{"id": catalog[row]["id"]}}}} for row in range(0, len(catalog), len(catalog) // 20)]
+CandidateRetriever(catalog).retrieve('general', bar, 40)
+retrieved = time.perf_counter() - start
+start = time.perf_counter()
+catalog.resolve_name(catalog[len(catalog) // 2]["name"].lower())
+resolved = time.perf_counter() - start
+after = memory()
+print(json.dumps({{"load": loaded, "warm": warmed, "retrieve": retrieved, "resolve": resolved,
+                  "rss": after["Rss"] - before["Rss"], "pss": after["Pss"] - before["Pss"]}}), flush=True)
+sys.stdin.read()  # Stay alive until every worker has reported, so shared pages count as shared
+"""
+
+
+def synthetic_catalog(path, rows):
+    with open(DATASET) as f:
+        bottles = json.load(f)
+    out = []
+    for i in range(rows):
+        bottle = dict(bottles[i % len(bottles)])
+        bottle["id"] = i + 1
+        bottle["ranking"] = i + 1
+        bottle["name"] = f"{bottle['name']} #{i // len(bottles)}"
+        out.append(bottle)
+    with open(path, 'w') as f:
+        json.dump(out, f)
+
+
+def run_workers(path, workers):
+    procs = [
+        subprocess.Popen([sys.executable, '-c', WORKER.format(root=ROOT, path=path)],
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        for _ in range(workers)
+    ]
+    results = [json.loads(proc.stdout.readline()) for proc in procs]
+    for proc in procs:
+        proc.communicate('')
+    return results
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    from src.catalog import compile_catalog
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, 'catalog.json')
+        synthetic_catalog(json_path, rows)
+        start = time.perf_counter()
+        compiled = compile_catalog(json_path)
+        print(f"{rows} bottles: JSON {os.path.getsize(json_path) / 1e6:.1f} MB, compiled "
+              f"{os.path.getsize(compiled) / 1e6:.1f} MB in {time.perf_counter() - start:.1f} s; {workers} workers")
+        print(f"{'format':<9}  {'load':>9}  {'warm':>9}  {'1st query':>9}  {'1st name':>9}  {'RSS':>8}  {'PSS':>8}"
+              f"   (per worker, mean)")
+        for label, path in (("json", json_path), ("compiled", compiled)):
+            results = run_workers(path, workers)
+
+            def mean(key):
+                return sum(r[key] for r in results) / len(results)
+
+            print(f"{label:<9}  {mean('load') * 1000:>6.0f} ms  {mean('warm') * 1000:>6.0f} ms  "
+                  f"{mean('retrieve') * 1000:>6.0f} ms  {mean('resolve') * 1000:>6.1f} ms  "
+                  f"{mean('rss'):>5.0f} MB  {mean('pss'):>5.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
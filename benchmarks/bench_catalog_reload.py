@@ -0,0 +1,104 @@
+"""Request latency while the catalog is hot-reloaded
+
+Worker threads keep preparing general-mode prompts (retrieval and prompt
+compilation) against whatever snapshot is current when each request
+starts, first with no reloads, then while another thread rewrites the
+dataset and reloads it every `reload_seconds`. Requests run to completion
+on the snapshot they started with (errors are counted); latency
+percentiles show what the reloads cost the request path.
+
+Usage: python benchmarks/bench_catalog_reload.py [seconds] [reload_seconds] [threads]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+config.LLM_CACHE_ENABLED = False
+config.USER_PROFILE_STORE_ENABLED = False
+
+from src.catalog_reload import CatalogReloader
+from src.recommendation_engine import RecommendationEngine
+from src.user_profile import UserProfile
+
+DATASET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'whiskey_data_set.json')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def run(reloader, seconds, threads, reload_seconds=None):
+    engine = RecommendationEngine()
+    latencies, errors = [], []
+    versions = set()
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(seed):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            catalog = reloader.current
+            try:
+                bar = [{"product": {"id": catalog[rng.randrange(len(catalog))]["id"]}} for _ in range(20)]
+                engine._build_mode_prompt('general', UserProfile.ensure(bar, catalog), catalog)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                versions.add(catalog.version)
+
+    def reload_loop(bottles):
+        rng = random.Random(0)
+        while time.perf_counter() < deadline:
+            time.sleep(reload_seconds)
+            with open(reloader.path, 'w') as f:
+                json.dump(rng.sample(bottles, len(bottles) - rng.randrange(1, 50)), f)
+            reloader.reload()
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    if reload_seconds:
+        with open(DATASET) as f:
+            pool.append(threading.Thread(target=reload_loop, args=(json.load(f),)))
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return latencies, versions, errors
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    reload_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'catalog.json')
+        with open(DATASET) as src, open(path, 'w') as dst:
+            dst.write(src.read())
+        reloader = CatalogReloader(path)
+        reloader.reload(force=True)
+
+        print(f"{threads} threads for {seconds:.0f} s each")
+        for label, interval in (("steady", None), (f"reload/{reload_seconds}s", reload_seconds)):
+            latencies, versions, errors = run(reloader, seconds, threads, interval)
+            print(f"{label:<12} {len(latencies):6d} requests  p50 {percentile(latencies, 50) * 1000:6.2f} ms  "
+                  f"p99 {percentile(latencies, 99) * 1000:6.2f} ms  versions served {len(versions):3d}  "
+                  f"errors {len(errors)}")
+        print(f"reloader stats {reloader.stats}")
+
+
+if __name__ == "__main__":
+    main()
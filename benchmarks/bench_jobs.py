@@ -0,0 +1,101 @@
+"""Web-tier latency with background recommendation jobs under a slow LLM
+
+Submits `count` jobs (one per user, plus a duplicate submission each) to
+POST /jobs/recommendations and polls GET /jobs/<id> until all are done,
+with a fake LLM that sleeps `llm_seconds` per call behind the engine and
+the stub BAXUS server behind BaxusClient. A high-priority job submitted
+last shows how far it jumps the backlog. For comparison, the same users
+are served synchronously by GET /recommendations/<username>.
+
+Usage: python benchmarks/bench_jobs.py [count] [llm_seconds] [workers]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+config.LLM_CACHE_ENABLED = False
+config.BAXUS_CACHE_TTL_SECONDS = 0
+config.JOBS_STORE_PATH = ''
+
+import api
+from benchmarks.bench_single_flight import SlowLLM
+from benchmarks.stub_baxus import StubBaxusServer
+from src.baxus_client import BaxusClient
+from src.jobs import JobQueue
+
+
+def ms(seconds):
+    return f"{seconds * 1000:7.1f} ms"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    response = fn(*args, **kwargs)
+    return time.perf_counter() - start, response
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    llm_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    with StubBaxusServer(latency=0.05, connect_latency=0.01) as stub:
+        api.baxus_client = BaxusClient(api_url=stub.url, pool_size=2 * workers)
+        llm = api.recommendation_engine.llm_client = SlowLLM(llm_seconds)
+        api.jobs = JobQueue(api.run_recommendation_job, workers=workers)
+        client = api.app.test_client()
+        print(f"{count} users, LLM {ms(llm_seconds).strip()}/call, {workers} job workers")
+
+        # Submit every job, then resubmit each one (a client retrying)
+        start = time.perf_counter()
+        submits, ids = [], []
+        for i in range(count):
+            seconds, response = timed(client.post, "/jobs/recommendations", json={"username": f"user{i}"})
+            submits.append(seconds)
+            ids.append(response.get_json()["id"])
+        for i in range(count):
+            seconds, response = timed(client.post, "/jobs/recommendations", json={"username": f"user{i}"})
+            submits.append(seconds)
+            assert response.get_json()["id"] == ids[i]
+        urgent = client.post("/jobs/recommendations", json={"username": "urgent", "priority": "high"}).get_json()["id"]
+
+        polls, finished = [], {}
+        while len(finished) < count + 1:
+            for job_id in ids + [urgent]:
+                if job_id in finished:
+                    continue
+                seconds, response = timed(client.get, f"/jobs/{job_id}")
+                polls.append(seconds)
+                if response.get_json()["status"] in ("done", "error"):
+                    finished[job_id] = time.perf_counter() - start
+            time.sleep(0.01)
+        wall = time.perf_counter() - start
+        ok = sum(client.get(f"/jobs/{job_id}").get_json()["status"] == "done" for job_id in ids)
+
+        print(f"jobs     submit p50 {ms(percentile(submits, 50))}  p95 {ms(percentile(submits, 95))}   "
+              f"poll p50 {ms(percentile(polls, 50))}  p95 {ms(percentile(polls, 95))}")
+        print(f"         {ok}/{count} done in {wall:.2f} s, LLM calls {llm.calls}, "
+              f"high-priority job done after {finished[urgent]:.2f} s (last normal job {max(finished[i] for i in ids):.2f} s)")
+        print(f"         {api.jobs.snapshot()}")
+
+        # The same users served synchronously, one request per user at once
+        llm = api.recommendation_engine.llm_client = SlowLLM(llm_seconds)
+        with ThreadPoolExecutor(count) as pool:
+            latencies = list(pool.map(lambda i: timed(client.get, f"/recommendations/sync{i}")[0], range(count)))
+        print(f"sync     request p50 {ms(percentile(latencies, 50))}  p95 {ms(percentile(latencies, 95))}   "
+              f"LLM calls {llm.calls}")
+        api.baxus_client.close()
+
+
+if __name__ == "__main__":
+    main()
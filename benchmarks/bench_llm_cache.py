@@ -0,0 +1,71 @@
+"""Repeated recommendation requests against the LLM response cache
+
+Asks RecommendationEngine for the same user's "general" recommendations
+`repeats` times, from threads and from an event loop, with a
+CachedLLMClient in front of a stub provider (see stub_llm_providers.py).
+The answer fills every section before its stream ends, so the parser
+closes the stream early; the complete answer must still be cached, and
+every repeat must be a cache hit rather than another provider call.
+
+Usage: python benchmarks/bench_llm_cache.py [repeats]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import config
+
+config.USER_PROFILE_STORE_ENABLED = False
+
+from benchmarks.stub_llm_providers import StubProvider
+from src.llm_cache import CachedLLMClient, LLMResponseCache
+from src.recommendation_engine import RecommendationEngine
+
+# Enough picks to fill the section; the closing "]}" arrives in a later chunk
+ANSWER = json.dumps({"recommendations": [{"i": i, "r": "S"} for i in range(config.MAX_RECOMMENDATIONS)]})
+
+
+def run(label, repeats, call):
+    stub = StubProvider("stub", latency=0.05, jitter=0.0, answer=ANSWER, chunks=6)
+    client = CachedLLMClient(stub, LLMResponseCache())
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        recommendations = call(client)
+        times.append(time.perf_counter() - start)
+        assert len(recommendations) == config.MAX_RECOMMENDATIONS, recommendations
+    stats = client.stats
+    print(f"{label:<8} provider calls {stub.counts['calls']}  closed early {stub.counts['cancelled']}  "
+          f"stores {stats['stores']}  hits {stats['memory_hits'] + stats['disk_hits']}  "
+          f"first {times[0] * 1000:6.1f} ms  repeats {sum(times[1:]) / max(1, len(times) - 1) * 1000:6.2f} ms")
+    assert stub.counts["calls"] == 1, "a repeated request went to the provider"
+    assert stats["stores"] == 1, "the answer was not cached"
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    with open(os.path.join(ROOT, "data", "whiskey_data_set.json")) as f:
+        bottles = json.load(f)
+    bar = [{"product": {"name": b["name"], "spirit": b.get("spirit_type")}} for b in bottles[:8]]
+    engine = RecommendationEngine()
+    print(f"{repeats} identical requests")
+
+    def sync_call(client):
+        engine.llm_client = client
+        return engine.generate_for_mode("general", "user", bar, bottles)
+
+    def async_call(client):
+        engine.llm_client = client
+        return asyncio.run(engine.agenerate_for_mode("general", "user", bar, bottles))
+
+    run("threads", repeats, sync_call)
+    run("asyncio", repeats, async_call)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""LLM call latency and errors: one provider vs the hedging, failing-over router
+
+Sends `requests` prompts from `threads` threads to stub providers (see
+stub_llm_providers.py) whose first chunk usually comes after ~50 ms but,
+for `slow_rate` of calls, only after a second. Compares one provider
+alone with an LLMRouter over two such providers (hedged once a call runs
+past the primary's p95), streamed from threads and from an event loop.
+A last run takes the primary down for the middle third of the requests:
+its circuit opens, calls fail over to the second provider, and a probe
+closes the circuit again once the primary is back.
+
+Usage: python benchmarks/bench_llm_router.py [requests] [threads] [slow_rate]
+"""
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+config.LLM_BREAKER_COOLDOWN_SECONDS = 0.5
+
+from benchmarks.stub_llm_providers import StubProvider
+from src.llm_router import LLMRouter
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def providers(slow_rate):
+    return [StubProvider("primary", slow_rate=slow_rate, seed=1),
+            StubProvider("secondary", latency=0.07, slow_rate=slow_rate, seed=2)]
+
+
+def run_threads(client, requests, threads, on_request=None):
+    def call(i):
+        if on_request:
+            on_request(i)
+        start = time.perf_counter()
+        try:
+            client.generate_recommendation(f"prompt {i}")
+        except Exception:
+            return None
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(call, range(requests)))
+
+
+def run_async(client, requests, threads):
+    async def call(i, slots):
+        async with slots:
+            start = time.perf_counter()
+            try:
+                async for _ in client.astream_recommendation(f"prompt {i}"):
+                    pass
+            except Exception:
+                return None
+            return time.perf_counter() - start
+
+    async def main():
+        slots = asyncio.Semaphore(threads)
+        return await asyncio.gather(*(call(i, slots) for i in range(requests)))
+
+    return asyncio.run(main())
+
+
+def report(label, results, stubs, router=None):
+    latencies = [r for r in results if r is not None]
+    print(f"{label:<18} p50 {percentile(latencies, 50) * 1000:6.1f} ms  p95 {percentile(latencies, 95) * 1000:6.1f} ms  "
+          f"p99 {percentile(latencies, 99) * 1000:6.1f} ms  errors {len(results) - len(latencies):4d}  "
+          f"provider calls {sum(stub.counts['calls'] for stub in stubs)}")
+    if router:
+        counts = router.provider_stats()
+        providers = counts.pop("providers")
+        print(f"{'':<18} {counts}")
+        for name, health in providers.items():
+            print(f"{'':<18} {name}: {health['state']}, trips {health['trips']}, rejected {health['rejected']}, "
+                  f"p95 {health['p95_seconds']} s")
+        print(f"{'':<18} losing streams cancelled: {sum(stub.counts['cancelled'] for stub in stubs)}")
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    slow_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.03
+    print(f"{requests} requests, {threads} at a time, {slow_rate:.0%} of calls slow (1 s)")
+
+    stubs = providers(slow_rate)[:1]
+    report("single provider", run_threads(stubs[0], requests, threads), stubs)
+
+    stubs = providers(slow_rate)
+    router = LLMRouter(stubs)
+    report("router (threads)", run_threads(router, requests, threads), stubs, router)
+
+    stubs = providers(slow_rate)
+    router = LLMRouter(stubs)
+    report("router (asyncio)", run_async(router, requests, threads), stubs, router)
+
+    stubs = providers(slow_rate)
+    router = LLMRouter(stubs)
+
+    def outage(i):
+        # The primary is down for the middle third of the requests
+        if i == requests // 3:
+            stubs[0].down = True
+        elif i == 2 * requests // 3:
+            stubs[0].down = False
+
+    report("primary outage", run_threads(router, requests, threads, outage), stubs, router)
+
+
+if __name__ == "__main__":
+    main()
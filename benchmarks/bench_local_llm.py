@@ -0,0 +1,90 @@
+"""Compare a server process per request (the old llama-cli path) with the resident worker
+
+Every request in the "per request" run starts a server, waits for the model
+to load, generates, and shuts it down, which is what spawning llama-cli did.
+The "resident" run sends the same requests through one LlamaServerWorker.
+It also kills the worker halfway through to check that it restarts.
+
+By default the stub server in benchmarks/stub_llama_server.py stands in for
+llama-server. Pass a real binary and a small GGUF model (e.g. a TinyLlama
+Q4 quant) to measure actual CPU inference.
+
+Usage: python benchmarks/bench_local_llm.py [requests] [concurrency] [server_bin model_path]
+"""
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.llama_server import LlamaServerWorker
+from src.structured_output import recommendation_schema
+
+PROMPT = "My collection: Buffalo Trace; Weller Special Reserve. Recommend 5 bottles from the candidates."
+
+
+def run(worker_factory, requests, concurrency, per_request):
+    """Send `requests` completions; return per-request latencies and wall time in seconds"""
+    schema = recommendation_schema(index_only=True)
+    shared = None if per_request else worker_factory()
+
+    def one(_):
+        worker = worker_factory() if per_request else shared
+        start = time.perf_counter()
+        try:
+            worker.complete(PROMPT, 64, schema)
+        finally:
+            if per_request:
+                worker.stop()
+        return time.perf_counter() - start
+
+    if shared:
+        shared.warm_up(background=False)
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            latencies = list(pool.map(one, range(requests)))
+        wall = time.perf_counter() - start
+        if shared:
+            # Simulate a crash and check the next request brings the worker back
+            shared._process.kill()
+            shared._process.wait()
+            start = time.perf_counter()
+            shared.complete(PROMPT, 64, schema)
+            print(f"after crash:    recovered in {time.perf_counter() - start:.2f}s, stats {shared.stats()}")
+    finally:
+        if shared:
+            shared.stop()
+    return latencies, wall
+
+
+def report(label, latencies, wall):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+    print(f"{label:<14} {len(latencies) / wall:6.2f} req/s   p50 {p50 * 1000:7.0f} ms   p95 {p95 * 1000:7.0f} ms")
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    if len(sys.argv) > 4:
+        server_bin, model_path = sys.argv[3], sys.argv[4]
+    else:
+        server_bin = f"{sys.executable} {os.path.join(ROOT, 'benchmarks', 'stub_llama_server.py')}"
+        model_path = tempfile.NamedTemporaryFile(suffix=".gguf", delete=False).name
+
+    def factory():
+        return LlamaServerWorker(model_path, server_bin=server_bin, parallel=concurrency,
+                                 log_path="", health_interval=0)
+
+    print(f"requests: {requests}, concurrency: {concurrency}, server: {server_bin}")
+    for label, per_request in (("per request", True), ("resident", False)):
+        report(label, *run(factory, requests, concurrency, per_request))
+
+
+if __name__ == "__main__":
+    main()
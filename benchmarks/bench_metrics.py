@@ -0,0 +1,84 @@
+"""Cost of the /metrics instrumentation, and what it shows for a request
+
+Times one stage observation in isolation, then serves `requests`
+sequential GET /recommendations/<username> requests through the Flask app
+(stub BAXUS server behind BaxusClient, an LLMRouter over two stub
+providers behind the engine) with metrics disabled and enabled, and
+compares the mean request time. Ends with the per-stage breakdown
+/metrics reports for that route.
+
+Usage: python benchmarks/bench_metrics.py [requests]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+config.LLM_CACHE_ENABLED = False
+config.USER_PROFILE_STORE_ENABLED = False
+config.RECOMMENDATION_STORE_ENABLED = False
+
+import api
+from benchmarks.stub_baxus import StubBaxusServer
+from benchmarks.stub_llm_providers import StubProvider
+from src import metrics
+from src.baxus_client import BaxusClient
+from src.llm_router import LLMRouter
+
+ANSWER = '{"recommendations":[{"i":0,"r":"S"},{"i":1,"r":"Q"},{"i":2,"r":"V"}]}'
+ROUTE = "/recommendations/<username>"
+
+
+def observe_cost(count=200000):
+    metrics.begin_request("bench", "general")
+    start = time.perf_counter()
+    for _ in range(count):
+        metrics.observe_stage("bench", 0.01)
+    return (time.perf_counter() - start) / count
+
+
+def serve(client, requests):
+    start = time.perf_counter()
+    for i in range(requests):
+        # A different user each time, so no cache or coalescing is involved
+        response = client.get(f"/recommendations/user{i}")
+        assert response.status_code == 200, response.get_data(as_text=True)
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    print(f"one stage observation: {observe_cost() * 1e6:.2f} us")
+
+    with StubBaxusServer(latency=0.0, connect_latency=0.0) as stub:
+        api.baxus_client = BaxusClient(api_url=stub.url, cache_ttl=0)
+        api.recommendation_engine.llm_client = LLMRouter([
+            StubProvider("primary", latency=0.002, jitter=0.0, answer=ANSWER, seed=1),
+            StubProvider("secondary", latency=0.002, jitter=0.0, answer=ANSWER, seed=2),
+        ])
+        client = api.app.test_client()
+        serve(client, 20)  # Warm up
+        for enabled in (False, True, False, True):
+            config.METRICS_ENABLED = enabled
+            print(f"metrics {'on ' if enabled else 'off'}: {serve(client, requests) * 1000:6.2f} ms/request")
+        api.baxus_client.close()
+
+        exposition = client.get("/metrics").get_data(as_text=True)
+    print(f"\n/metrics: {len(exposition.splitlines())} lines; per-stage means for {ROUTE}:")
+    sums = dict(re.findall(r'bob_stage_duration_seconds_sum\{stage="(\w+)",route="' + re.escape(ROUTE) + r'"[^}]*\} (\S+)',
+                           exposition))
+    counts = dict(re.findall(r'bob_stage_duration_seconds_count\{stage="(\w+)",route="' + re.escape(ROUTE) + r'"[^}]*\} (\S+)',
+                             exposition))
+    for stage in sums:
+        print(f"  {stage:<15} {float(sums[stage]) / float(counts[stage]) * 1000:7.3f} ms  ({counts[stage]} observations)")
+    for line in exposition.splitlines():
+        if line.startswith(("bob_llm_tokens_total", "bob_recommendations_total")) and ROUTE in line:
+            print(f"  {line}")
+
+
+if __name__ == "__main__":
+    main()
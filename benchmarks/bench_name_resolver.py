@@ -0,0 +1,85 @@
+"""Benchmark fuzzy bottle-name resolution against a large synthetic catalog
+
+Usage: python benchmarks/bench_name_resolver.py [catalog_size] [queries]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.name_resolver import NameResolver
+
+BRANDS = [
+    "Eagle Rare", "Buffalo Trace", "Weller", "Blanton's", "Elijah Craig", "Four Roses",
+    "Wild Turkey", "Knob Creek", "Woodford Reserve", "Old Forester", "Heaven Hill",
+    "Russell's Reserve", "Henry McKenna", "Stagg", "E.H. Taylor", "Lagavulin", "Macallan",
+    "Glenfiddich", "Redbreast", "Hibiki", "Booker's", "Baker's", "Old Grand Dad", "Michter's",
+]
+STYLES = [
+    "Single Barrel", "Small Batch", "Bottled in Bond", "Cask Strength", "Barrel Proof",
+    "Toasted Barrel", "Double Oaked", "Rye", "Straight Bourbon", "Port Finish", "Reserve",
+    "Private Selection", "Full Proof", "Wheated", "Sherry Cask", "Heritage",
+]
+
+
+def synthetic_name(rng):
+    """Random but realistic-looking bottle name"""
+    parts = [rng.choice(BRANDS)]
+    if rng.random() < 0.8:
+        parts.append(rng.choice(STYLES))
+    if rng.random() < 0.5:
+        parts.append(f"{rng.randint(4, 25)} Year")
+    if rng.random() < 0.3:
+        parts.append(f"{rng.randint(90, 140)} Proof")
+    # Batch / edition codes make names unique, like real releases
+    parts.append(f"Batch {rng.choice('ABCDEFGH')}{rng.randint(1, 9999)}")
+    return " ".join(parts)
+
+
+def perturb(name, rng):
+    """Simulate how an LLM tends to restate a bottle name"""
+    name = name.replace(" Year", rng.choice([" Year", " yr", "-Year-Old", " Years"]))
+    name = name.replace(" Proof", rng.choice([" Proof", " pf", " proof"]))
+    name = name.replace("'", rng.choice(["'", "", "’"]))
+    if rng.random() < 0.3:
+        # Single-character typo in a random word
+        words = name.split()
+        i = rng.randrange(len(words))
+        if len(words[i]) > 4:
+            j = rng.randrange(1, len(words[i]) - 1)
+            words[i] = words[i][:j] + words[i][j + 1:]
+        name = " ".join(words)
+    return name
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 5_000
+    rng = random.Random(42)
+
+    bottles = [{"id": i, "name": synthetic_name(rng)} for i in range(size)]
+
+    start = time.perf_counter()
+    resolver = NameResolver(bottles)
+    build_seconds = time.perf_counter() - start
+
+    targets = [rng.choice(bottles) for _ in range(query_count)]
+    queries = [perturb(b["name"], rng) for b in targets]
+
+    start = time.perf_counter()
+    matches = [resolver.resolve(q) for q in queries]
+    resolve_seconds = time.perf_counter() - start
+
+    correct = sum(1 for m, t in zip(matches, targets) if m and m.bottle["id"] == t["id"])
+    print(f"catalog size:      {size:,} names")
+    print(f"index build:       {build_seconds:.2f}s")
+    print(f"queries:           {query_count:,}")
+    print(f"throughput:        {query_count / resolve_seconds:,.0f} names/s")
+    print(f"mean latency:      {resolve_seconds / query_count * 1000:.3f} ms/name")
+    print(f"top-1 accuracy:    {correct / query_count:.1%}")
+
+
+if __name__ == "__main__":
+    main()
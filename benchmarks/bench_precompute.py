@@ -0,0 +1,92 @@
+"""Precompute runs and API latency served from the recommendation store
+
+Precomputes `count` users twice against the stub BAXUS server and a fake
+LLM that sleeps `llm_seconds` per call. The second run should find every
+bar unchanged and skip generation. Then GET /recommendations/<username>
+is timed for the precomputed users (store hits) and for users who are
+not in the store (live generation). A store hit still fetches the bar and
+wishlist, since stored results are only served for the ones they were
+generated from; the BAXUS cache is off here, so that is one round trip.
+
+Usage: python benchmarks/bench_precompute.py [count] [llm_seconds]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+config.LLM_CACHE_ENABLED = False
+config.BAXUS_CACHE_TTL_SECONDS = 0
+
+import api
+from benchmarks.stub_baxus import StubBaxusServer
+from benchmarks.stub_llama_server import answer_for
+from src.baxus_client import BaxusClient
+from src.precompute import Precomputer
+from src.recommendation_store import RecommendationStore
+
+
+class FakeLLM:
+    """Answers any schema after a fixed delay and counts its calls"""
+    provider = "anthropic"
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.seconds)
+        return answer_for(schema)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def timed_gets(client, urls):
+    latencies = []
+    for url in urls:
+        start = time.perf_counter()
+        assert client.get(url).status_code == 200
+        latencies.append(time.perf_counter() - start)
+    return f"p50 {percentile(latencies, 50) * 1000:7.2f} ms  p95 {percentile(latencies, 95) * 1000:7.2f} ms"
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    llm_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+
+    with StubBaxusServer(latency=0.05, connect_latency=0.01) as stub, tempfile.TemporaryDirectory() as tmp:
+        api.baxus_client = BaxusClient(api_url=stub.url)
+        api.recommendation_store = RecommendationStore(os.path.join(tmp, "recommendations.sqlite3"))
+        usernames = [f"user{i}" for i in range(count)]
+        print(f"{count} users, LLM {llm_seconds * 1000:.0f} ms/call, BAXUS 50 ms/request")
+
+        for label in ("first run", "second run"):
+            llm = api.recommendation_engine.llm_client = FakeLLM(llm_seconds)
+            catalog = api.catalogs.current
+            precomputer = Precomputer(api.baxus_client, api.recommendation_engine, catalog, api.recommendation_store,
+                                      postprocess=lambda results: api.filter_modes(results, catalog))
+            start = time.perf_counter()
+            counts = Counter(result["status"] for result in precomputer.run(usernames))
+            print(f"{label:<11} {time.perf_counter() - start:6.2f} s  LLM calls {llm.calls:3d}  {dict(counts)}")
+
+        client = api.app.test_client()
+        print(f"store hit   {timed_gets(client, [f'/recommendations/{name}' for name in usernames])}")
+        print(f"live        {timed_gets(client, [f'/recommendations/new{i}' for i in range(10)])}")
+        print(f"store stats {api.recommendation_store.stats}")
+        api.baxus_client.close()
+
+
+if __name__ == "__main__":
+    main()
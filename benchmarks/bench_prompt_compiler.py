@@ -0,0 +1,120 @@
+"""Input tokens of the compact compiled prompt against the old prose prompt
+
+For several users, builds the "general" prompt with RecommendationEngine and
+the prose prompt the old BobRecommender._create_llm_prompt wrote for the same
+collection and candidates (labelled lines, "Unknown" for the fields the
+dataset lacks). Both are sent to llama-server through LocalLLMClient, and the
+comparison uses the input tokens the server reports evaluating. The
+estimate_tokens figures the compiler budgets with are printed beside them.
+
+By default the stub server in benchmarks/stub_llama_server.py stands in for
+llama-server and counts about four characters per token. Pass a real binary
+and a GGUF model to count with the model's own tokenizer.
+
+Usage: python benchmarks/bench_prompt_compiler.py [users] [server_bin model_path]
+"""
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import config
+from benchmarks.bench_prompt_prefix import make_users
+from src.llama_server import LlamaServerWorker
+from src.llm_usage import estimate_tokens
+from src.local_llm_client import LocalLLMClient
+from src.recommendation_engine import RecommendationEngine
+
+config.LLM_CACHE_ENABLED = False
+config.USER_PROFILE_STORE_ENABLED = False
+config.PROMPT_PREFIX_CACHE_PROVIDERS = ()
+
+
+def prose_prompt(collection, candidates):
+    """The old BobRecommender prompt layout"""
+    prices = [b.get("avg_msrp") or 0 for b in collection] or [0]
+    owned = [f"{b.get('name', 'Unknown')} ({b.get('region', 'Unknown')} region, "
+             f"${b.get('avg_msrp', 0)}, {b.get('age_statement', 'NAS')})" for b in collection]
+    offered = [
+        f"[{i}] {b.get('name', 'Unknown')} - Region: {b.get('region', 'Unknown')}, "
+        f"Price: ${b.get('fair_price', 0)}, Age: {b.get('age_statement', 'NAS')}, "
+        f"Type: {b.get('type', 'Unknown')}, ABV: {b.get('abv', 'Unknown')}"
+        for i, b in enumerate(candidates)
+    ]
+    return f"""
+You are Bob, a whisky expert who helps users discover new bottles based on their current collection.
+
+### USER'S WHISKY COLLECTION PROFILE:
+- Top regions: Unknown ({len(collection)} bottles)
+- Price range: ${min(prices)} to ${max(prices)} (avg: ${sum(prices) / len(prices):.2f})
+- Top distilleries: Unknown ({len(collection)} bottles)
+- Total bottles: {len(collection)}
+
+### USER'S CURRENT BOTTLES ({len(owned)}):
+{chr(10).join(f"- {bottle}" for bottle in owned[:10])}
+
+### POTENTIAL RECOMMENDATIONS ({len(offered)}):
+{chr(10).join(offered)}
+
+Based on this user's collection, recommend {config.MAX_RECOMMENDATIONS} bottles from the potential recommendations list.
+For each recommendation:
+1. Reference the bottle by its number [X]
+2. Explain why it matches their preferences
+3. Note if it's similar to bottles they already enjoy or if it would diversify their collection
+
+Provide your recommendations in this format:
+BOTTLE [X]: <Name>
+REASONING: <Your explanation for why this matches their preferences>
+RELATIONSHIP TO COLLECTION: <Similar to their existing collection or complementary addition>
+"""
+
+
+def reported_input_tokens(client, prompt):
+    """Input tokens the server reports for one prompt"""
+    client.generate_recommendation(prompt, max_tokens=1)
+    call = client.usage.last
+    assert not call["estimated"], "the server reported no usage"
+    return call["uncached_input_tokens"] + call["cache_read_tokens"] + call["cache_write_tokens"]
+
+
+def main():
+    users_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    if len(sys.argv) > 3:
+        server_bin, model_path = sys.argv[2], sys.argv[3]
+    else:
+        os.environ.setdefault("STUB_LLAMA_PROMPT_SECONDS", "0")
+        server_bin = f"{sys.executable} {os.path.join(ROOT, 'benchmarks', 'stub_llama_server.py')}"
+        model_path = tempfile.NamedTemporaryFile(suffix=".gguf", delete=False).name
+
+    with open(os.path.join(ROOT, "data", "whiskey_data_set.json")) as f:
+        bottles = json.load(f)
+    users = make_users(bottles, users_count)
+    worker = LlamaServerWorker(model_path, server_bin=server_bin, parallel=1, log_path="", health_interval=0)
+    engine = RecommendationEngine()
+    client = LocalLLMClient(model_path, worker=worker)
+    worker.warm_up(background=False)
+
+    print(f"users: {users_count}, server: {server_bin}")
+    totals = {"prose": [0, 0], "compact": [0, 0]}
+    try:
+        for username, bar in users:
+            profile = engine._user_profile(username, bar, bottles)
+            compiled = engine._build_mode_prompt("general", profile, bottles)
+            for label, text in (("prose", prose_prompt(profile.owned_bottles(), compiled.candidates)),
+                                ("compact", compiled.text)):
+                totals[label][0] += reported_input_tokens(client, text)
+                totals[label][1] += estimate_tokens(text)
+    finally:
+        worker.stop()
+
+    for label, (reported, estimated) in totals.items():
+        print(f"{label:<8} reported input {reported / users_count:7.1f} tokens/prompt   "
+              f"estimated {estimated / users_count:7.1f}")
+    print(f"compact / prose (reported): {totals['compact'][0] / totals['prose'][0]:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Time to first recommendation, and how much of each prompt the KV cache serves
+
+Sends "general" recommendations for several users, one after another, through
+RecommendationEngine and LocalLLMClient. Every prompt starts with the same
+persona and answer format, so each slot's KV cache holds that prefix after
+the first request; the collection and the user's own candidate shortlist
+follow and are evaluated afresh. Reports the median and worst time to first
+recommendation and the share of input tokens read from the cache.
+
+By default the stub server in benchmarks/stub_llama_server.py stands in for
+llama-server, evaluating a prompt token every STUB_LLAMA_PROMPT_SECONDS
+(2 ms here, roughly a small quantized model on CPU). Pass a real binary and a
+GGUF model to measure actual inference.
+
+Usage: python benchmarks/bench_prompt_prefix.py [users] [server_bin model_path]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import config
+from src.llama_server import LlamaServerWorker
+from src.local_llm_client import LocalLLMClient
+from src.recommendation_engine import RecommendationEngine
+
+config.LLM_CACHE_ENABLED = False
+
+
+def make_users(bottles, count, bar_size=8, seed=7):
+    """Random bars in the BAXUS bar item format"""
+    rng = random.Random(seed)
+    users = []
+    for n in range(count):
+        picks = rng.sample(bottles, bar_size)
+        bar = [{"product": {"name": b["name"], "spirit": b.get("spirit_type")}} for b in picks]
+        users.append((f"user{n}", bar))
+    return users
+
+
+def run(engine, users, bottles):
+    """Return (first-recommendation latencies in seconds, usage snapshot)"""
+    engine.llm_client.usage = type(engine.llm_client.usage)()
+    latencies = []
+    for username, bar in users:
+        start = time.perf_counter()
+        first = None
+        # Read the whole answer so the server's final usage event is recorded
+        for _ in engine.stream_recommendations("general", username, bar, bottles):
+            if first is None:
+                first = time.perf_counter() - start
+        latencies.append(first if first is not None else time.perf_counter() - start)
+    return latencies, engine.llm_client.usage.snapshot()
+
+
+def main():
+    users_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    if len(sys.argv) > 3:
+        server_bin, model_path = sys.argv[2], sys.argv[3]
+    else:
+        os.environ.setdefault("STUB_LLAMA_PROMPT_SECONDS", "0.002")
+        server_bin = f"{sys.executable} {os.path.join(ROOT, 'benchmarks', 'stub_llama_server.py')}"
+        model_path = tempfile.NamedTemporaryFile(suffix=".gguf", delete=False).name
+
+    with open(os.path.join(ROOT, "data", "whiskey_data_set.json")) as f:
+        bottles = json.load(f)
+    users = make_users(bottles, users_count)
+    worker = LlamaServerWorker(model_path, server_bin=server_bin, parallel=1, log_path="", health_interval=0)
+    engine = RecommendationEngine()
+    engine.llm_client = LocalLLMClient(model_path, worker=worker)
+    worker.warm_up(background=False)
+
+    print(f"users: {users_count}, server: {server_bin}")
+    try:
+        latencies, usage = run(engine, users, bottles)
+        latencies.sort()
+        print(f"median first rec {latencies[len(latencies) // 2] * 1000:7.0f} ms   "
+              f"max {latencies[-1] * 1000:7.0f} ms   "
+              f"uncached input {usage['uncached_input_tokens']:6d}   "
+              f"cache reads {usage['cache_read_tokens']:6d} ({usage['cache_read_ratio']:.0%})")
+    finally:
+        worker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""LLM and BAXUS calls for a burst of identical /recommendations requests
+
+Fires `burst` concurrent GET /recommendations/<username> requests at the
+Flask app, with the stub BAXUS server behind BaxusClient and a slow fake LLM
+(sleeping `llm_seconds` per call) behind the engine, and counts how many
+fetches and LLM calls the burst caused with and without coalescing.
+
+Usage: python benchmarks/bench_single_flight.py [burst] [llm_seconds]
+"""
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+config.LLM_CACHE_ENABLED = False
+
+import api
+from benchmarks.stub_baxus import StubBaxusServer
+from src.baxus_client import BaxusClient
+from src.single_flight import SingleFlight
+
+
+class SlowLLM:
+    """Answers after a fixed delay and counts its calls"""
+    provider = "anthropic"
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.seconds)
+        return '{"recommendations":[{"i":0,"r":"S"},{"i":1,"r":"Q"},{"i":2,"r":"V"}]}'
+
+
+class Uncoalesced:
+    """SingleFlight stand-in that runs every call (the old behaviour)"""
+
+    def do(self, key, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    def stats(self):
+        return {}
+
+
+def burst(url, count):
+    client = api.app.test_client()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(count) as pool:
+        statuses = list(pool.map(lambda _: client.get(url).status_code, range(count)))
+    return time.perf_counter() - start, statuses
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    llm_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+
+    with StubBaxusServer(latency=0.05, connect_latency=0.01) as stub:
+        print(f"burst: {count} identical requests, LLM {llm_seconds * 1000:.0f} ms/call, BAXUS 50 ms/request")
+        for label, coalesce in (("uncoalesced", False), ("single-flight", True)):
+            api.baxus_client = BaxusClient(api_url=stub.url, cache_ttl=0, pool_size=2 * count)
+            if not coalesce:
+                api.baxus_client._flights = Uncoalesced()
+            api.recommendation_flights = SingleFlight() if coalesce else Uncoalesced()
+            llm = api.recommendation_engine.llm_client = SlowLLM(llm_seconds)
+            requests_before = stub.requests
+
+            wall, statuses = burst("/recommendations/heisjoel0x", count)
+            ok = sum(status == 200 for status in statuses)
+            print(f"{label:<14} {wall * 1000:6.0f} ms   {ok}/{count} ok   LLM calls {llm.calls:3d}   "
+                  f"BAXUS requests {stub.requests - requests_before:3d}   {api.recommendation_flights.stats()}")
+            api.baxus_client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Parse throughput of the streaming structured-output parser over recorded responses
+
+Each recorded answer is fed in token-sized chunks, the way it streams from
+a provider, and compared against json.loads on the complete text. Malformed
+answers report how many characters were read before the parser aborted.
+
+Usage: python benchmarks/bench_structured_parser.py [iterations] [chunk_size]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.structured_output import MalformedOutputError, StructuredResponseParser
+
+MODES = ["general", "similar-price", "complementary"]
+
+# (label, response text, parser kwargs); candidate_count=None means name-keyed items
+RECORDED = [
+    ("index", '{"recommendations":[{"i":4,"r":"S"},{"i":11,"r":"V"},{"i":2,"r":"C"},{"i":17,"r":"Q"},{"i":0,"r":"S"}]}',
+     {"candidate_count": 25, "index_only": True}),
+    ("index, fenced", '```json\n{"recommendations":[{"i":4,"r":"S"},{"i":11,"r":"V"},{"i":2,"r":"C"}]}\n```',
+     {"candidate_count": 25, "index_only": True}),
+    ("index, sections", json.dumps({
+        "general": [{"i": 1, "r": "S"}, {"i": 7, "r": "Q"}, {"i": 3, "r": "S"}],
+        "similar-price": [{"i": 12, "r": "P"}, {"i": 9, "r": "V"}, {"i": 14, "r": "P"}],
+        "complementary": [{"i": 20, "r": "C"}, {"i": 22, "r": "C"}, {"i": 5, "r": "C"}],
+    }), {"candidate_count": 25, "index_only": True, "sections": MODES}),
+    ("full, indexed", json.dumps({"recommendations": [
+        {"i": 3, "reasoning": "Eagle Rare 10 Year shares the soft caramel and cherry notes of your Buffalo Trace.",
+         "relationship": "A step up from Buffalo Trace, same mash bill"},
+        {"i": 8, "reasoning": "A wheated bourbon at 107 proof with a rich, bready palate.",
+         "relationship": "Similar to Weller Special Reserve in your bar"},
+        {"i": 15, "reasoning": "Toasted barrel finish adds dessert-like sweetness.",
+         "relationship": "Complements your Elijah Craig Small Batch"},
+        {"i": 19, "reasoning": "High-rye spice and a long, dry finish.",
+         "relationship": "Diversifies a wheated-heavy collection"},
+        {"i": 21, "reasoning": "Bottled in bond, seven years old, strong value.",
+         "relationship": "Similar to Henry McKenna 10 Year"},
+    ]}), {"candidate_count": 25}),
+    ("full, by name", json.dumps({"recommendations": [
+        {"name": "Eagle Rare 10 Year", "reasoning": "Soft caramel and cherry.", "relationship": "Like Buffalo Trace"},
+        {"name": "Weller Antique 107", "reasoning": "Rich wheated bourbon.", "relationship": "Like Weller SR"},
+        {"name": "Old Forester 1920 Prohibition Style", "reasoning": "Big and chocolatey.", "relationship": "New profile"},
+    ]}), {}),
+    ("truncated", '{"recommendations":[{"i":4,"r":"S"},{"i":11,"r":"V"},{"i":2,',
+     {"candidate_count": 25, "index_only": True}),
+    # What analysis.json recorded: the client's error string in place of an answer
+    ("error sentinel", "Error generating recommendations. Please try again later.",
+     {"candidate_count": 25, "index_only": True}),
+    ("prose", "Here are five bottles you might enjoy:\n1. Eagle Rare 10 Year - a great pick\n2. Weller",
+     {"candidate_count": 25}),
+    ("bad index", '{"recommendations":[{"i":4,"r":"S"},{"i":99,"r":"V"},{"i":2,"r":"C"},{"i":17,"r":"Q"}]}',
+     {"candidate_count": 25, "index_only": True}),
+]
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def parse_streaming(chunks, kwargs):
+    """Feed chunks until done or aborted; return (items, characters read, error)"""
+    parser = StructuredResponseParser(max_items=5, **kwargs)
+    items = []
+    read = 0
+    try:
+        for chunk in chunks:
+            read += len(chunk)
+            items += parser.feed(chunk)
+            if parser.done:
+                break
+        else:
+            parser.finish()
+    except MalformedOutputError as e:
+        return items, read, str(e)
+    return items, read, None
+
+
+def parse_whole(text):
+    """Baseline: wait for the full text, then json.loads it"""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return None
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 4  # ~1 token
+
+    print(f"{'response':<16} {'chars':>6} {'items':>6} {'read':>6}  {'stream':>10} {'json.loads':>11}  result")
+    total_chars = 0
+    total_stream = 0.0
+    for label, text, kwargs in RECORDED:
+        chunks = chunked(text, chunk_size)
+        items, read, error = parse_streaming(chunks, kwargs)
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            parse_streaming(chunks, kwargs)
+        stream_us = (time.perf_counter() - start) / iterations * 1e6
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            parse_whole(text)
+        whole_us = (time.perf_counter() - start) / iterations * 1e6
+
+        total_chars += read
+        total_stream += stream_us
+        result = f"abort: {error}" if error else "ok"
+        print(f"{label:<16} {len(text):>6} {len(items):>6} {read:>6}  {stream_us:>8.1f}us {whole_us:>9.1f}us  {result[:60]}")
+
+    print(f"\nchunk size:        {chunk_size} chars")
+    print(f"stream throughput: {total_chars / total_stream:,.1f} chars/us ({total_chars / total_stream * 1e6 / 4:,.0f} tokens/s at ~4 chars/token)")
+
+
+if __name__ == "__main__":
+    main()
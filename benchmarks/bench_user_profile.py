@@ -0,0 +1,86 @@
+"""Per-request profile and prompt preparation time by bar size
+
+For synthetic BAXUS bars of each size, times getting the user's profile
+plus building the general-mode prompt (candidate retrieval, collection
+ranking, compilation) three ways: rebuilding the profile from the whole
+bar, syncing an unchanged bar against the profile store, and syncing a bar
+with one item added and one updated. A cold load from the SQLite store is
+timed once per size.
+
+Usage: python benchmarks/bench_user_profile.py [sizes] [repeats]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+config.LLM_CACHE_ENABLED = False
+config.USER_PROFILE_STORE_ENABLED = False
+
+from src.catalog import Catalog
+from src.recommendation_engine import RecommendationEngine
+from src.user_profile import ProfileStore, UserProfile, bar_items
+
+DATASET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'whiskey_data_set.json')
+
+
+def bar_item(item_id, bottle, updated_at="2024-01-01T00:00:00Z"):
+    return {
+        "id": item_id, "release_id": bottle["id"], "updated_at": updated_at,
+        "product": {"id": bottle["id"], "name": bottle["name"], "spirit": bottle.get("spirit_type")},
+    }
+
+
+def timed(fn, repeats):
+    """Median milliseconds per call"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2] * 1000
+
+
+def main():
+    sizes = [int(s) for s in sys.argv[1].split(',')] if len(sys.argv) > 1 else [10, 100, 1000, 5000]
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    with open(DATASET) as f:
+        catalog = Catalog(json.load(f))
+    rng = random.Random(0)
+    engine = RecommendationEngine()
+
+    print(f"{'bar items':>9}  {'rebuild':>9}  {'unchanged':>9}  {'1 changed':>9}  {'cold load':>9}   (ms/request, median)")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            bar = [bar_item(i, rng.choice(catalog.bottles)) for i in range(size)]
+            path = os.path.join(tmp, f"profiles-{size}.sqlite3")
+            store = ProfileStore(path)
+            store.sync("user", bar, catalog)
+
+            def prepare(profile):
+                engine._build_mode_prompt('general', profile, catalog)
+
+            rebuild = timed(lambda: prepare(UserProfile.ensure(bar_items(bar), catalog)), repeats)
+            unchanged = timed(lambda: prepare(store.sync("user", bar, catalog)), repeats)
+
+            edits = iter(range(repeats))
+
+            def one_changed():
+                step = next(edits)
+                bar.append(bar_item(size + step, rng.choice(catalog.bottles)))
+                bar[step] = bar_item(bar[step]["id"], rng.choice(catalog.bottles), f"2024-02-{step + 1:02d}")
+                prepare(store.sync("user", bar, catalog))
+
+            changed = timed(one_changed, repeats)
+            cold = timed(lambda: prepare(ProfileStore(path).sync("user", bar, catalog)), 1)
+            print(f"{size:>9}  {rebuild:>9.2f}  {unchanged:>9.2f}  {changed:>9.2f}  {cold:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
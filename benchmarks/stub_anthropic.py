@@ -0,0 +1,108 @@
+"""Local stand-in for the Anthropic Messages API used by the benchmarks
+
+Serves POST /v1/messages, blocking or as the SSE event stream the SDK
+expects (message_start, content block deltas, message_delta, message_stop).
+With a forced tool call the answer is streamed as input_json deltas that
+satisfy the tool's input schema. STUB_ANTHROPIC_FIRST_TOKEN_SECONDS delays
+the first token and STUB_ANTHROPIC_TOKEN_SECONDS each one after it. Point
+the SDK at it with ANTHROPIC_BASE_URL=http://127.0.0.1:<port>.
+
+Usage: python benchmarks/stub_anthropic.py [port]
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from stub_llama_server import answer_for, tokens
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # Bursts of hundreds of connections
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8090
+    first_token_seconds = float(os.environ.get("STUB_ANTHROPIC_FIRST_TOKEN_SECONDS", 2.0))
+    token_seconds = float(os.environ.get("STUB_ANTHROPIC_TOKEN_SECONDS", 0.02))
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            if self.path.split("?")[0] != "/v1/messages":
+                self.send_error(404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            tools = body.get("tools") or []
+            schema = tools[0]["input_schema"] if tools else None
+            pieces = tokens(answer_for(schema), body.get("max_tokens"))
+            usage = {"input_tokens": 600, "output_tokens": 1,
+                     "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+            if tools:
+                block = {"type": "tool_use", "id": "toolu_stub", "name": tools[0]["name"], "input": {}}
+                delta = lambda piece: {"type": "input_json_delta", "partial_json": piece}
+            else:
+                block = {"type": "text", "text": ""}
+                delta = lambda piece: {"type": "text_delta", "text": piece}
+            message = {"id": "msg_stub", "type": "message", "role": "assistant", "model": body.get("model"),
+                       "content": [], "stop_reason": None, "stop_sequence": None, "usage": usage}
+            stop_reason = "tool_use" if tools else "end_turn"
+
+            if not body.get("stream"):
+                time.sleep(first_token_seconds + token_seconds * len(pieces))
+                text = "".join(pieces)
+                block = {**block, "input": json.loads(text)} if tools else {**block, "text": text}
+                self._json({**message, "content": [block], "stop_reason": stop_reason,
+                            "usage": {**usage, "output_tokens": len(pieces)}})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            try:
+                self._event("message_start", {"message": message})
+                self._event("content_block_start", {"index": 0, "content_block": block})
+                time.sleep(first_token_seconds)
+                for piece in pieces:
+                    self._event("content_block_delta", {"index": 0, "delta": delta(piece)})
+                    time.sleep(token_seconds)
+                self._event("content_block_stop", {"index": 0})
+                self._event("message_delta", {"delta": {"stop_reason": stop_reason, "stop_sequence": None},
+                                              "usage": {"output_tokens": len(pieces)}})
+                self._event("message_stop", {})
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # Client cancelled
+            self.close_connection = True
+
+        def _event(self, name, data):
+            self.wfile.write(f"event: {name}\ndata: {json.dumps({'type': name, **data})}\n\n".encode())
+            self.wfile.flush()
+
+        def _json(self, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = Server(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"stub Anthropic API: listening on 127.0.0.1:{port}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
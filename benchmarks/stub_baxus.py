@@ -0,0 +1,93 @@
+"""Local stand-in for the BAXUS API used by the benchmarks
+
+Serves data/sample_user_bar.json for /bar/user/<name> and an empty list for
+/wishlist/user/<name>, with an ETag honouring If-None-Match. `latency` delays every response and
+`connect_latency` delays each new connection, approximating a TCP+TLS
+handshake to the real service.
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         "data", "sample_user_bar.json")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # Bursts of concurrent connections
+
+
+class StubBaxusServer:
+    """Threaded HTTP server that mimics the BAXUS bar/wishlist endpoints"""
+
+    def __init__(self, latency=0.05, connect_latency=0.05, port=0):
+        with open(DATA_FILE, "rb") as f:
+            bar_body = f.read()
+        stub = self
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.requests = 0
+        self.connections = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                stub.connections += 1
+                time.sleep(stub.connect_latency)
+
+            def do_GET(self):
+                stub.requests += 1
+                time.sleep(stub.latency)
+                if self.path.startswith("/bar/user/"):
+                    body = bar_body
+                elif self.path.startswith("/wishlist/user/"):
+                    body = b"[]"
+                else:
+                    self.send_error(404)
+                    return
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = _Server(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    with StubBaxusServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 0) as stub:
+        print(f"Stub BAXUS API listening on {stub.url} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,181 @@
+"""Local stand-in for llama.cpp's llama-server used by the benchmarks
+
+Accepts the llama-server flags LlamaServerWorker passes and serves /health
+and /completion (blocking or SSE streaming). STUB_LLAMA_LOAD_SECONDS
+simulates loading the model before /health turns 200,
+STUB_LLAMA_PROMPT_SECONDS the time to evaluate one prompt token and
+STUB_LLAMA_TOKEN_SECONDS the per-token generation time. At most --parallel
+requests generate at once; the rest wait, as they do for llama-server slots.
+Like llama-server with cache_prompt, each slot keeps its last prompt, a
+request goes to the free slot sharing the longest prefix with it, and only
+the tokens after that prefix are evaluated. Answers follow the request's
+json_schema when one is given, and report tokens_evaluated and timings
+(on every streamed event with timings_per_token).
+
+Usage: python benchmarks/stub_llama_server.py -m <model> --port 8080 [--parallel 2]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def answer_for(schema):
+    """Smallest answer that satisfies a recommendation schema"""
+    if not schema:
+        return "Eagle Rare 10 Year would suit your collection."
+    answer = {}
+    for section in schema.get("required", []):
+        array = schema["properties"][section]
+        item_properties = array["items"]["properties"]
+        items = []
+        for i in range(array.get("maxItems", 3)):
+            item = {}
+            for key, spec in item_properties.items():
+                if spec.get("type") == "integer":
+                    item[key] = spec["enum"][i % len(spec["enum"])] if spec.get("enum") else i
+                elif spec.get("enum"):
+                    item[key] = spec["enum"][0]
+                else:
+                    item[key] = "Stub answer"
+            items.append(item)
+        answer[section] = items
+    return json.dumps(answer)
+
+
+def tokens(text, n_predict=None):
+    """~4 characters per token, capped at n_predict"""
+    pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+    return pieces[:n_predict] if n_predict and n_predict > 0 else pieces
+
+
+def common_prefix(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class Slots:
+    """Server slots, each remembering the prompt tokens in its KV cache"""
+
+    def __init__(self, count):
+        self.cached = [[] for _ in range(count)]
+        self.busy = [False] * count
+        self.condition = threading.Condition()
+
+    def acquire(self, prompt_tokens, cache_prompt):
+        with self.condition:
+            while all(self.busy):
+                self.condition.wait()
+            free = [i for i, busy in enumerate(self.busy) if not busy]
+            slot = max(free, key=lambda i: common_prefix(self.cached[i], prompt_tokens))
+            self.busy[slot] = True
+            reused = common_prefix(self.cached[slot], prompt_tokens) if cache_prompt else 0
+            return slot, reused
+
+    def release(self, slot, prompt_tokens):
+        with self.condition:
+            self.cached[slot] = prompt_tokens
+            self.busy[slot] = False
+            self.condition.notify()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model", required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--parallel", type=int, default=1)
+    args, _ = parser.parse_known_args()
+
+    load_seconds = float(os.environ.get("STUB_LLAMA_LOAD_SECONDS", 1.0))
+    prompt_seconds = float(os.environ.get("STUB_LLAMA_PROMPT_SECONDS", 0.0))
+    token_seconds = float(os.environ.get("STUB_LLAMA_TOKEN_SECONDS", 0.005))
+    slots = Slots(args.parallel)
+    loaded = threading.Event()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if self.path != "/health":
+                self.send_error(404)
+                return
+            ok = loaded.is_set()
+            self._json(200 if ok else 503, {"status": "ok" if ok else "loading model"})
+
+        def do_POST(self):
+            if self.path != "/completion":
+                self.send_error(404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not loaded.is_set():
+                self._json(503, {"error": "Loading model"})
+                return
+            pieces = tokens(answer_for(body.get("json_schema")), body.get("n_predict"))
+            prompt_tokens = tokens(body.get("prompt", ""))
+            slot, reused = slots.acquire(prompt_tokens, body.get("cache_prompt", False))
+            try:
+                # Only the tokens after the cached prefix are evaluated
+                time.sleep(prompt_seconds * (len(prompt_tokens) - reused))
+                evaluated = len(prompt_tokens)
+
+                def usage(predicted):
+                    timings = {"prompt_n": evaluated - reused, "cache_n": reused, "predicted_n": predicted}
+                    return {"tokens_evaluated": evaluated, "tokens_cached": reused, "timings": timings}
+
+                if not body.get("stream"):
+                    time.sleep(token_seconds * len(pieces))
+                    self._json(200, {"content": "".join(pieces), "stop": True, **usage(len(pieces))})
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                try:
+                    for n, piece in enumerate(pieces, 1):
+                        time.sleep(token_seconds)
+                        event = {"content": piece, "stop": False}
+                        if body.get("timings_per_token"):
+                            event.update(usage(n))
+                        self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+                        self.wfile.flush()
+                    self.wfile.write(f"data: {json.dumps({'content': '', 'stop': True, **usage(len(pieces))})}\n\n".encode())
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # Client cancelled; the slot is released
+                self.close_connection = True
+            finally:
+                slots.release(slot, prompt_tokens)
+
+        def _json(self, status, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"stub llama-server: loading {args.model}", flush=True)
+    time.sleep(load_seconds)
+    loaded.set()
+    print(f"stub llama-server: listening on {args.host}:{args.port} ({args.parallel} slots)", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""In-process stand-ins for LLM provider clients, with injected latency and faults
+
+A StubProvider has the generate/stream/astream methods of the real
+clients. Each call waits for a first-chunk latency (a base plus jitter,
+and now and then a slow tail), fails with the configured error rate, and
+otherwise streams a fixed answer. `down` makes every call fail at once,
+as during an outage. Streams closed before their answer is finished are
+counted as cancelled. Finished answers record token usage (about four
+characters per token) like the real clients.
+"""
+import asyncio
+import random
+import threading
+import time
+
+from src.llm_client import LLMError
+from src.llm_usage import TokenUsageLog
+
+ANSWER = '{"recommendations": [{"id": 1, "reason": "stub"}]}'
+
+
+class StubProvider:
+    """A fake LLM provider with configurable latency, slow tail and error rate"""
+
+    def __init__(self, provider, latency=0.05, jitter=0.01, error_rate=0.0,
+                 slow_rate=0.0, slow_latency=1.0, chunks=4, seed=0, answer=ANSWER):
+        self.provider = provider
+        self.model = f"{provider}-stub"
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.chunks = chunks
+        self.answer = answer
+        self.usage = TokenUsageLog()
+        self.down = False
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {"calls": 0, "errors": 0, "completed": 0, "cancelled": 0}
+
+    def _plan(self):
+        """(first chunk delay, whether the call fails) for a new call"""
+        with self._lock:
+            self.counts["calls"] += 1
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            if self._rng.random() < self.slow_rate:
+                delay = self.slow_latency
+            fails = self.down or self._rng.random() < self.error_rate
+            if fails:
+                self.counts["errors"] += 1
+        return (0.0 if self.down else delay), fails
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _pieces(self):
+        size = -(-len(self.answer) // self.chunks)
+        return [self.answer[i:i + size] for i in range(0, len(self.answer), size)]
+
+    def _finished(self, prompt):
+        self._count("completed")
+        self.usage.record(uncached_input_tokens=len(prompt) // 4, output_tokens=len(self.answer) // 4,
+                          provider=self.provider)
+
+    def generate_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None):
+        return "".join(self.stream_recommendation(prompt, max_tokens, schema, cached_prefix))
+
+    def stream_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None):
+        delay, fails = self._plan()
+        time.sleep(delay)
+        if fails:
+            raise LLMError(f"{self.provider} stub failure", self.provider)
+        finished = False
+        try:
+            for piece in self._pieces():
+                yield piece
+            finished = True
+            self._finished(prompt)
+        finally:
+            if not finished:
+                self._count("cancelled")
+
+    async def astream_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None):
+        delay, fails = self._plan()
+        finished = False
+        try:
+            await asyncio.sleep(delay)
+            if fails:
+                raise LLMError(f"{self.provider} stub failure", self.provider)
+            for piece in self._pieces():
+                yield piece
+            finished = True
+            self._finished(prompt)
+        finally:
+            if not finished and not fails:
+                self._count("cancelled")
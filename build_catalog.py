@@ -0,0 +1,32 @@
+"""Compile the whisky dataset into a memory-mapped catalog file
+
+Run it whenever the JSON dataset changes; the API and workers then map the
+compiled file instead of parsing the JSON (a stale one is ignored):
+
+    python build_catalog.py
+    python build_catalog.py data/whiskey_data_set.json --output /srv/catalog.bxcat
+"""
+import argparse
+import os
+import time
+
+from src.catalog import Catalog, compile_catalog, compiled_path
+
+
+def main():
+    default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'whiskey_data_set.json')
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('dataset', nargs='?', default=default, help="JSON dataset to compile")
+    parser.add_argument('--output', help="Compiled file to write (default: next to the dataset, .bxcat)")
+    args = parser.parse_args()
+
+    output = args.output or compiled_path(args.dataset)
+    start = time.perf_counter()
+    compile_catalog(args.dataset, output)
+    catalog = Catalog.open(output)
+    print(f"Compiled {len(catalog)} bottles into {output} ({os.path.getsize(output) / 1e6:.1f} MB, "
+          f"catalog version {catalog.version}) in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
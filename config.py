@@ -10,15 +10,143 @@ ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
 BAXUS_API_URL = os.getenv('BAXUS_API_URL', 'http://services.baxus.co/api')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
+# BAXUS client settings
+BAXUS_CONNECT_TIMEOUT = float(os.getenv('BAXUS_CONNECT_TIMEOUT', 3.05))  # seconds
+BAXUS_READ_TIMEOUT = float(os.getenv('BAXUS_READ_TIMEOUT', 10))  # seconds
+BAXUS_MAX_RETRIES = 2  # Retries after the first attempt, for timeouts/connection errors/5xx/429
+BAXUS_RETRY_BACKOFF = 0.25  # Base backoff in seconds, doubled per attempt with full jitter
+BAXUS_POOL_SIZE = 16  # Keep-alive connections and concurrent fetch threads
+BAXUS_CACHE_TTL_SECONDS = 30  # Serve cached bar/wishlist data without revalidating; 0 disables the cache
+BAXUS_CACHE_STALE_SECONDS = 300  # After the TTL, serve stale data while refreshing in the background
+BAXUS_CACHE_MAX_ENTRIES = 1024
+
 # LLM settings
 LLM_PROVIDER = 'anthropic'  # options: 'openai', 'anthropic', 'gemini'
 OPENAI_MODEL = 'gpt-4'  # or 'gpt-3.5-turbo' for faster, cheaper responses
 ANTHROPIC_MODEL = 'claude-3-opus-20240229'
 GEMINI_MODEL = "gemini-1.5-pro-latest"  # or another valid Gemini model
+LLM_MAX_TOKENS = 2000  # Default output cap for free-text answers
+# Providers in order of preference ('openai', 'anthropic', 'gemini', 'huggingface',
+# 'local'); with more than one, calls go through LLMRouter
+LLM_PROVIDERS = [p.strip() for p in os.getenv('LLM_PROVIDERS', LLM_PROVIDER).split(',') if p.strip()]
+LLM_ROUTER_WINDOW = 100  # Recent calls per provider behind its latency percentiles and error rate
+LLM_HEDGE_PERCENTILE = 95  # Also ask the next provider once the first is slower than this percentile of its latency
+LLM_HEDGE_MIN_SAMPLES = 20  # With fewer latency samples, hedge after LLM_HEDGE_DEFAULT_SECONDS
+LLM_HEDGE_DEFAULT_SECONDS = 10.0
+LLM_HEDGE_MIN_SECONDS = 0.2  # Never hedge sooner than this
+LLM_BREAKER_CONSECUTIVE_FAILURES = 5  # Failures in a row that open a provider's circuit
+LLM_BREAKER_ERROR_RATE = 0.5  # Or this share of failures over the window...
+LLM_BREAKER_MIN_CALLS = 10  # ...once it holds this many calls
+LLM_BREAKER_COOLDOWN_SECONDS = 30  # An open circuit lets one probe call through after this long
 
 # Recommendation settings
 MAX_RECOMMENDATIONS = 5
-MAX_POTENTIAL_BOTTLES = 100  # Maximum bottles to include in the LLM prompt
+MAX_POTENTIAL_BOTTLES = 25  # Retrieved candidate bottles offered to the LLM per prompt
+PRICE_BAND_PERCENTILE_SPREAD = 15  # Default price band: ±15 percentile points around the collection median
+EXPLAIN_PROFILE_RECOMMENDATIONS = False  # Let the LLM rewrite reasoning for vector-ranked similar-profile picks
+NAME_MATCH_MIN_CONFIDENCE = 0.6  # Minimum fuzzy-match score to attach catalog data to an LLM bottle name
+
+# 'index': the LLM answers with candidate numbers and reason codes only, and
+# names/reasoning are filled in locally; 'text': the LLM writes full explanations
+LLM_RESPONSE_MODE = os.getenv('LLM_RESPONSE_MODE', 'index')
+INDEX_MODE_MAX_TOKENS = {
+    'general': 64,
+    'similar-price': 64,
+    'similar-profile': 64,
+    'complementary': 64,
+    'all': 200,  # One JSON array per mode
+}
+STRUCTURED_OUTPUT_RETRIES = 1  # Fresh generations after an answer fails JSON validation
+
+# Prompt input token budgets per provider; the least relevant collection rows
+# and candidates are trimmed to fit
+PROMPT_TOKEN_BUDGETS = {
+    'openai': 1500,
+    'anthropic': 1500,
+    'gemini': 1500,
+    'huggingface': 900,
+    'local': 600,  # CPU prompt processing is the bottleneck
+    'default': 1200,
+}
+# Providers that reuse a shared prompt prefix (Anthropic cache_control, OpenAI's
+# automatic prefix cache, llama.cpp's per-slot KV cache). Their prompts mark the
+# static persona and answer format as the cached prefix; the answer schema is
+# the same for every user, so the tool definition caches with it.
+PROMPT_PREFIX_CACHE_PROVIDERS = ('anthropic', 'openai', 'local')
+
+# Collection rows listed in a prompt at most (most representative first), so
+# prompt size stays flat for very large bars; the token budget may trim further
+PROMPT_MAX_COLLECTION_ROWS = 100
+
+# Per-user collection profiles, kept in step with bar item changes
+USER_PROFILE_STORE_ENABLED = os.getenv('USER_PROFILE_STORE_ENABLED', 'true').lower() == 'true'
+USER_PROFILE_STORE_PATH = os.getenv('USER_PROFILE_STORE_PATH', 'cache/user_profiles.sqlite3')  # None/'' keeps profiles in memory only
+USER_PROFILE_CACHE_ENTRIES = 1000  # In-process LRU size
+
+# Use the compiled catalog (build_catalog.py) next to the JSON dataset when it
+# was built from the current JSON; it is memory-mapped instead of parsed
+CATALOG_USE_COMPILED = os.getenv('CATALOG_USE_COMPILED', 'true').lower() == 'true'
+# How often the API checks the dataset (and its compiled file) for changes and
+# swaps in a reloaded catalog; 0 disables the watcher (POST /admin/catalog/reload still works)
+CATALOG_RELOAD_INTERVAL_SECONDS = float(os.getenv('CATALOG_RELOAD_INTERVAL_SECONDS', 30))
+# Bearer token for the /admin routes; they are disabled while it is unset
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+# Prometheus metrics on GET /metrics: request and per-stage latency histograms,
+# LLM token counts and dropped recommendations
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+)  # Seconds
+
+# ASGI serving (python asgi.py)
+# Event-loop processes; the per-request CPU (SDK serialisation, stream parsing, prompt builds)
+# shares one GIL per process, so use about one per core. Queued jobs live in the process
+# that accepted them, so job polling needs sticky routing with more than one
+ASGI_WORKERS = int(os.getenv('ASGI_WORKERS', 1))
+
+# Batch recommendation settings
+BATCH_MAX_USERNAMES = 500
+BATCH_FETCH_CONCURRENCY = 8  # Concurrent BAXUS bar/wishlist fetches per batch
+BATCH_LLM_CONCURRENCY = 4  # Concurrent LLM generations per batch
+
+# Background recommendation jobs (POST /jobs/recommendations)
+JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', 4))  # Concurrent generations
+JOBS_MAX_QUEUED = 1000  # Further submissions are refused with 503
+JOBS_RETRY_AFTER_SECONDS = 5  # Retry-After sent with that 503
+JOBS_RESULT_TTL_SECONDS = 3600  # How long a finished job can be fetched
+JOBS_MAX_STORED = 10000  # Finished jobs kept in memory
+JOBS_STORE_PATH = os.getenv('JOBS_STORE_PATH', 'cache/jobs.sqlite3')  # None/'' keeps finished jobs in memory only
+
+# Precomputed recommendations (precompute.py writes them, the API serves them)
+RECOMMENDATION_STORE_ENABLED = os.getenv('RECOMMENDATION_STORE_ENABLED', 'true').lower() == 'true'
+RECOMMENDATION_STORE_PATH = os.getenv('RECOMMENDATION_STORE_PATH', 'cache/recommendations.sqlite3')
+RECOMMENDATION_STORE_MAX_AGE_SECONDS = 36 * 3600  # Daily runs, with slack for a late one
+PRECOMPUTE_FETCH_CONCURRENCY = 8  # Concurrent BAXUS bar/wishlist fetches
+PRECOMPUTE_LLM_CONCURRENCY = 4  # Concurrent LLM generations
+
+# LLM response cache settings
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', 'cache/llm_responses.sqlite3')  # None/'' keeps the cache in memory only
+LLM_CACHE_TTL_SECONDS = 24 * 3600
+LLM_CACHE_MAX_ENTRIES = 256  # In-process LRU size
+LLM_CACHE_MAX_DISK_ENTRIES = 10000
+
+# Local llama.cpp worker settings (LocalLLMClient)
+LOCAL_LLM_SERVER_BIN = os.getenv('LOCAL_LLM_SERVER_BIN', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'llama.cpp', 'build', 'bin', 'llama-server'
+))  # May include arguments, e.g. "python benchmarks/stub_llama_server.py"
+LOCAL_LLM_PARALLEL = int(os.getenv('LOCAL_LLM_PARALLEL', 2))  # Server slots, i.e. concurrent generations
+LOCAL_LLM_CTX_SIZE = 4500  # Context window per slot
+LOCAL_LLM_GPU_LAYERS = None  # None: llama-server default; falls back to 0 (CPU) on GPU memory errors
+LOCAL_LLM_PRELOAD = os.getenv('LOCAL_LLM_PRELOAD', 'true').lower() == 'true'  # Load the model when the client is created
+LOCAL_LLM_STARTUP_TIMEOUT = 120  # Seconds to wait for the model to load
+LOCAL_LLM_QUEUE_TIMEOUT = 60  # Seconds a request may wait for a free slot
+LOCAL_LLM_CONNECT_TIMEOUT = 2
+LOCAL_LLM_READ_TIMEOUT = 300
+LOCAL_LLM_HEALTH_INTERVAL = 10  # Seconds between watchdog health checks; 0 disables the watchdog
+LOCAL_LLM_HEALTH_FAILURES = 3  # Consecutive failed checks before a restart
+LOCAL_LLM_LOG_PATH = os.getenv('LOCAL_LLM_LOG_PATH', 'cache/llama-server.log')
 
 HF_API_TOKEN = os.getenv('HUGGINGFACE_API_KEY')
 HUGGINGFACE_MODEL = "mistralai/Mistral-7B-Instruct-v0.3" 
\ No newline at end of file
@@ -0,0 +1,51 @@
+"""Precompute recommendations for active users into the store the API serves from
+
+Run it periodically (e.g. nightly from cron) with the active users, given as
+arguments or one per line in a file:
+
+    python precompute.py --users-file active_users.txt
+    python precompute.py heisjoel0x someoneelse --force
+"""
+import argparse
+import sys
+import time
+from collections import Counter
+
+import config
+from api import baxus_client, catalogs, filter_modes, recommendation_engine, recommendation_store
+from src.precompute import Precomputer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('usernames', nargs='*', help="Users to precompute")
+    parser.add_argument('--users-file', help="File with one username per line")
+    parser.add_argument('--force', action='store_true', help="Regenerate even when bar and catalog are unchanged")
+    args = parser.parse_args()
+
+    usernames = list(args.usernames)
+    if args.users_file:
+        with open(args.users_file) as f:
+            usernames += [line.strip() for line in f if line.strip()]
+    if not usernames:
+        parser.error("no usernames given")
+    if recommendation_store is None:
+        sys.exit("RECOMMENDATION_STORE_ENABLED is false; nothing would serve the results")
+
+    catalog = catalogs.current
+    precomputer = Precomputer(baxus_client, recommendation_engine, catalog, recommendation_store,
+                              postprocess=lambda results: filter_modes(results, catalog))
+    print(f"Precomputing {len(usernames)} users into {config.RECOMMENDATION_STORE_PATH} "
+          f"(catalog version {catalog.version})")
+    start = time.perf_counter()
+    counts = Counter()
+    for result in precomputer.run(usernames, force=args.force):
+        counts[result['status']] += 1
+        if result['status'] == 'error':
+            print(f"  {result['username']}: {result['error']}")
+    print(f"Done in {time.perf_counter() - start:.1f} s: " +
+          ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+
+
+if __name__ == '__main__':
+    main()
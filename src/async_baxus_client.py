@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import random
+import time
+
+import httpx
+import config
+from config import BAXUS_API_URL
+from src import metrics
+from src.baxus_client import RETRY_STATUSES, BarDataCache
+from src.single_flight import AsyncSingleFlight
+
+# Errors that mean the fetch failed, as opposed to a bug
+FETCH_ERRORS = (httpx.HTTPError, ValueError)
+
+
+class _RetryableStatus(Exception):
+    """A retryable status code, raised to reuse the transport-error retry path"""
+
+
+class AsyncBaxusClient:
+    """Asyncio counterpart of BaxusClient for the ASGI app
+
+    Same timeouts, jittered retries, per-user cache (stale-while-revalidate,
+    stale-if-error, conditional revalidation) and coalescing of concurrent
+    misses, but waiting on BAXUS holds no thread.
+    """
+
+    def __init__(self, api_url=BAXUS_API_URL, connect_timeout=None, read_timeout=None,
+                 max_retries=None, backoff=None, pool_size=None, cache_ttl=None):
+        self.api_url = api_url
+        connect_timeout = config.BAXUS_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout
+        read_timeout = config.BAXUS_READ_TIMEOUT if read_timeout is None else read_timeout
+        self.max_retries = config.BAXUS_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = config.BAXUS_RETRY_BACKOFF if backoff is None else backoff
+        pool_size = pool_size or config.BAXUS_POOL_SIZE
+
+        # One keep-alive connection pool shared by every request on the event loop
+        self.session = httpx.AsyncClient(
+            headers={"Content-Type": "application/json"},
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        # Callers beyond the pool size wait here rather than in httpcore's queue, which is
+        # rescanned against every connection each time a request finishes
+        self._slots = asyncio.Semaphore(pool_size)
+
+        cache_ttl = config.BAXUS_CACHE_TTL_SECONDS if cache_ttl is None else cache_ttl
+        self.cache = BarDataCache(
+            ttl=cache_ttl,
+            stale_ttl=config.BAXUS_CACHE_STALE_SECONDS,
+            max_entries=config.BAXUS_CACHE_MAX_ENTRIES,
+        ) if cache_ttl > 0 else None
+        self._flights = AsyncSingleFlight()
+        self._refreshes = set()
+
+    async def _request(self, path, headers=None):
+        """GET a BAXUS endpoint with timeouts and jittered, bounded retries"""
+        url = f"{self.api_url}{path}"
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._slots:
+                    response = await self.session.get(url, headers=headers)
+                if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                    raise _RetryableStatus(f"{response.status_code} from {url}")
+                # Unlike requests, httpx treats 304 Not Modified as an error
+                if response.status_code != 304:
+                    response.raise_for_status()
+                return response
+            except (httpx.TransportError, _RetryableStatus):
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    async def _fetch(self, path):
+        return (await self._request(path)).json()
+
+    async def _get_cached(self, source, path, username):
+        """Serve from the per-user cache, revalidating or refreshing as needed"""
+        if self.cache is None:
+            return await self._flights.do(path, self._fetch, path)
+
+        key = (source, username)
+        entry = self.cache.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry.fetched_at
+            if age < self.cache.ttl:
+                self.cache.record(source, "hits")
+                return entry.data
+            if age < self.cache.ttl + self.cache.stale_ttl:
+                self.cache.record(source, "stale_hits")
+                self._schedule_refresh(source, path, key)
+                return entry.data
+
+        self.cache.record(source, "misses")
+        try:
+            return await self._flights.do(key, self._refresh, source, path, key)
+        except FETCH_ERRORS:
+            if entry is not None:
+                self.cache.record(source, "stale_errors")
+                return entry.data
+            raise
+
+    async def _refresh(self, source, path, key):
+        """Fetch (conditionally, when validators are known) and update the cache"""
+        entry = self.cache.get(key)
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        response = await self._request(path, headers=headers)
+        self.cache.record(source, "refreshes")
+        if response.status_code == 304 and entry is not None:
+            self.cache.record(source, "not_modified")
+            return self.cache.touch(key).data
+
+        content_hash = hashlib.sha1(response.content).hexdigest()
+        if entry is not None and entry.content_hash == content_hash:
+            self.cache.record(source, "unchanged")
+            return self.cache.touch(key).data
+
+        entry = self.cache.put(
+            key, response.json(), content_hash,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+        return entry.data
+
+    def _schedule_refresh(self, source, path, key):
+        """Start at most one background refresh per cache key"""
+        if not self.cache.begin_refresh(key):
+            return
+
+        async def refresh():
+            try:
+                await self._refresh(source, path, key)
+            except FETCH_ERRORS as e:
+                self.cache.record(source, "refresh_errors")
+                print(f"Error refreshing {source} for {key[1]}: {e}")
+            finally:
+                self.cache.end_refresh(key)
+
+        # Keep a reference so the task is not garbage collected mid-flight
+        task = asyncio.ensure_future(refresh())
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
+
+    async def get_user_bar(self, username):
+        """Get user's bar data from BAXUS API"""
+        try:
+            with metrics.stage("bar_fetch"):
+                return await self._get_cached("bar", f"/bar/user/{username}", username)
+        except FETCH_ERRORS as e:
+            print(f"Error fetching user bar: {e}")
+            return None
+
+    async def get_user_wishlist(self, username):
+        """Get user's wishlist data from BAXUS API (if available)"""
+        try:
+            with metrics.stage("wishlist_fetch"):
+                return await self._get_cached("wishlist", f"/wishlist/user/{username}", username)
+        except FETCH_ERRORS as e:
+            print(f"Error fetching user wishlist: {e}")
+            return None
+
+    async def get_user_bar_and_wishlist(self, username):
+        """Fetch bar and wishlist concurrently; returns (bar, wishlist)"""
+        return tuple(await asyncio.gather(self.get_user_bar(username), self.get_user_wishlist(username)))
+
+    def cache_stats(self):
+        """Per-source hit/miss/refresh counters for the bar and wishlist cache, plus coalesced fetches"""
+        stats = self.cache.stats() if self.cache is not None else {}
+        stats["fetches"] = self._flights.stats()
+        return stats
+
+    async def close(self):
+        """Release pooled connections"""
+        await self.session.aclose()
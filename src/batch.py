@@ -0,0 +1,114 @@
+import asyncio
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+import config
+from src import metrics
+
+
+class BatchRecommender:
+    """Generate recommendations for many users with bounded, two-stage fan-out
+
+    BAXUS fetches and LLM generations run in separate thread pools, so slow
+    generations never starve the fetch stage (and vice versa). Results are
+    yielded per user in completion order; a failure only affects its user.
+    """
+
+    def __init__(self, baxus_client, engine, bottles,
+                 fetch_concurrency: Optional[int] = None,
+                 llm_concurrency: Optional[int] = None,
+                 postprocess: Optional[Callable[[List[Dict], str], List[Dict]]] = None):
+        self.baxus_client = baxus_client
+        self.engine = engine
+        self.bottles = bottles
+        self.fetch_concurrency = fetch_concurrency or config.BATCH_FETCH_CONCURRENCY
+        self.llm_concurrency = llm_concurrency or config.BATCH_LLM_CONCURRENCY
+        self.postprocess = postprocess
+
+    def run(self, usernames: List[str], mode: str = 'general', **params) -> Iterator[Dict]:
+        """Yield one result dict per (unique) username as soon as it is ready"""
+        if mode not in self.engine.MODES:
+            raise ValueError(f"Unsupported recommendation mode: {mode}")
+        usernames = list(dict.fromkeys(usernames))
+        route = metrics.current_labels()[0]
+        results: "queue.Queue[Dict]" = queue.Queue()
+        fetch_pool = ThreadPoolExecutor(self.fetch_concurrency, thread_name_prefix="batch-fetch")
+        llm_pool = ThreadPoolExecutor(self.llm_concurrency, thread_name_prefix="batch-llm")
+
+        def generate(username, user_bar, user_wishlist):
+            # Each user's generation gets its own labels (its provider may differ)
+            metrics.begin_request(route, mode)
+            try:
+                recommendations = self.engine.generate_for_mode(
+                    mode, username, user_bar, self.bottles, user_wishlist=user_wishlist, **params
+                )
+                if self.postprocess:
+                    recommendations = self.postprocess(recommendations, mode)
+                results.put({"username": username, "status": "ok", "recommendations": recommendations})
+            except Exception as e:
+                results.put({"username": username, "status": "error", "error": str(e)})
+
+        def fetch(username):
+            metrics.begin_request(route, mode)
+            try:
+                if mode == 'general':
+                    user_bar, user_wishlist = self.baxus_client.get_user_bar_and_wishlist(username)
+                else:
+                    user_bar, user_wishlist = self.baxus_client.get_user_bar(username), None
+                if not user_bar:
+                    results.put({"username": username, "status": "error",
+                                 "error": "Could not fetch user bar data"})
+                    return
+                # Hand off to the LLM stage; this fetch slot is free immediately
+                llm_pool.submit(generate, username, user_bar, user_wishlist)
+            except Exception as e:
+                results.put({"username": username, "status": "error", "error": str(e)})
+
+        try:
+            for username in usernames:
+                fetch_pool.submit(fetch, username)
+            for _ in usernames:
+                yield results.get()
+        finally:
+            # Drop queued work if the consumer goes away early
+            fetch_pool.shutdown(wait=False, cancel_futures=True)
+            llm_pool.shutdown(wait=False, cancel_futures=True)
+
+    async def arun(self, usernames: List[str], mode: str = 'general', **params) -> AsyncIterator[Dict]:
+        """Async counterpart of run, for an AsyncBaxusClient; stages are bounded by semaphores instead of pools"""
+        if mode not in self.engine.MODES:
+            raise ValueError(f"Unsupported recommendation mode: {mode}")
+        usernames = list(dict.fromkeys(usernames))
+        route = metrics.current_labels()[0]
+        fetch_slots = asyncio.Semaphore(self.fetch_concurrency)
+        llm_slots = asyncio.Semaphore(self.llm_concurrency)
+
+        async def one(username):
+            metrics.begin_request(route, mode)
+            try:
+                async with fetch_slots:
+                    if mode == 'general':
+                        user_bar, user_wishlist = await self.baxus_client.get_user_bar_and_wishlist(username)
+                    else:
+                        user_bar, user_wishlist = await self.baxus_client.get_user_bar(username), None
+                if not user_bar:
+                    return {"username": username, "status": "error", "error": "Could not fetch user bar data"}
+                async with llm_slots:
+                    recommendations = await self.engine.agenerate_for_mode(
+                        mode, username, user_bar, self.bottles, user_wishlist=user_wishlist, **params
+                    )
+                if self.postprocess:
+                    recommendations = self.postprocess(recommendations, mode)
+                return {"username": username, "status": "ok", "recommendations": recommendations}
+            except Exception as e:
+                return {"username": username, "status": "error", "error": str(e)}
+
+        tasks = [asyncio.ensure_future(one(username)) for username in usernames]
+        try:
+            for result in asyncio.as_completed(tasks):
+                yield await result
+        finally:
+            # Drop unfinished work if the consumer goes away early
+            for task in tasks:
+                task.cancel()
@@ -1,37 +1,252 @@
+import contextvars
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import requests # type: ignore
-import json
+from requests.adapters import HTTPAdapter # type: ignore
+import config
 from config import BAXUS_API_URL
+from src import metrics
+from src.single_flight import SingleFlight
+
+# Status codes worth retrying; everything else in 4xx is final
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class _CacheEntry:
+    """Cached BAXUS payload plus the validators needed to revalidate it"""
+    __slots__ = ("data", "content_hash", "etag", "last_modified", "fetched_at")
+
+    def __init__(self, data, content_hash, etag=None, last_modified=None):
+        self.data = data
+        self.content_hash = content_hash
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = time.monotonic()
+
+
+class BarDataCache:
+    """Bounded per-user cache of bar/wishlist payloads with per-source metrics
+
+    The per-source event counts are kept for stats() and exported in
+    /metrics as bob_baxus_cache_events_total.
+    """
+
+    def __init__(self, ttl, stale_ttl, max_entries):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, data, content_hash, etag=None, last_modified=None):
+        entry = _CacheEntry(data, content_hash, etag, last_modified)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def touch(self, key):
+        """Mark an entry as freshly revalidated"""
+        with self._lock:
+            entry = self._entries[key]
+            entry.fetched_at = time.monotonic()
+            return entry
+
+    def begin_refresh(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def record(self, source, event):
+        with self._lock:
+            counters = self._metrics.setdefault(source, {})
+            counters[event] = counters.get(event, 0) + 1
+        metrics.count_baxus_cache(source, event)
+
+    def stats(self):
+        with self._lock:
+            stats = {source: dict(counters) for source, counters in self._metrics.items()}
+            stats["entries"] = len(self._entries)
+            return stats
+
 
 class BaxusClient:
     """Client for fetching user data from BAXUS API"""
-    
-    def __init__(self, api_url=BAXUS_API_URL):
+
+    def __init__(self, api_url=BAXUS_API_URL, connect_timeout=None, read_timeout=None,
+                 max_retries=None, backoff=None, pool_size=None, cache_ttl=None):
         self.api_url = api_url
-        
+        self.timeout = (
+            config.BAXUS_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout,
+            config.BAXUS_READ_TIMEOUT if read_timeout is None else read_timeout,
+        )
+        self.max_retries = config.BAXUS_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = config.BAXUS_RETRY_BACKOFF if backoff is None else backoff
+        pool_size = pool_size or config.BAXUS_POOL_SIZE
+
+        # One keep-alive session per client, shared by all request threads
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="baxus")
+
+        # Short-lived per-user cache; a page load hits several routes at once
+        cache_ttl = config.BAXUS_CACHE_TTL_SECONDS if cache_ttl is None else cache_ttl
+        self.cache = BarDataCache(
+            ttl=cache_ttl,
+            stale_ttl=config.BAXUS_CACHE_STALE_SECONDS,
+            max_entries=config.BAXUS_CACHE_MAX_ENTRIES,
+        ) if cache_ttl > 0 else None
+        # Concurrent misses for the same user share one fetch
+        self._flights = SingleFlight()
+
+    def _request(self, path, headers=None):
+        """GET a BAXUS endpoint with timeouts and jittered, bounded retries"""
+        url = f"{self.api_url}{path}"
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+                if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                    raise requests.exceptions.RetryError(f"{response.status_code} from {url}")
+                response.raise_for_status()  # Raise exception for HTTP errors
+                return response
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.RetryError):
+                if attempt >= self.max_retries:
+                    raise
+                # Full jitter: sleep a random slice of the exponential backoff
+                time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def _get_cached(self, source, path, username):
+        """Serve from the per-user cache, revalidating or refreshing as needed"""
+        if self.cache is None:
+            return self._flights.do(path, lambda: self._request(path).json())
+
+        key = (source, username)
+        entry = self.cache.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry.fetched_at
+            if age < self.cache.ttl:
+                self.cache.record(source, "hits")
+                return entry.data
+            if age < self.cache.ttl + self.cache.stale_ttl:
+                # Stale-while-revalidate: answer now, refresh off the request path
+                self.cache.record(source, "stale_hits")
+                self._schedule_refresh(source, path, key)
+                return entry.data
+
+        self.cache.record(source, "misses")
+        try:
+            return self._flights.do(key, self._refresh, source, path, key)
+        except (requests.exceptions.RequestException, ValueError):
+            # Stale-if-error: an old answer beats no answer
+            if entry is not None:
+                self.cache.record(source, "stale_errors")
+                return entry.data
+            raise
+
+    def _refresh(self, source, path, key):
+        """Fetch (conditionally, when validators are known) and update the cache"""
+        entry = self.cache.get(key)
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        response = self._request(path, headers=headers)
+        self.cache.record(source, "refreshes")
+        if response.status_code == 304 and entry is not None:
+            self.cache.record(source, "not_modified")
+            return self.cache.touch(key).data
+
+        content_hash = hashlib.sha1(response.content).hexdigest()
+        if entry is not None and entry.content_hash == content_hash:
+            # No validators from the API, but the payload is unchanged
+            self.cache.record(source, "unchanged")
+            return self.cache.touch(key).data
+
+        entry = self.cache.put(
+            key, response.json(), content_hash,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+        return entry.data
+
+    def _schedule_refresh(self, source, path, key):
+        """Start at most one background refresh per cache key"""
+        if not self.cache.begin_refresh(key):
+            return
+
+        def refresh():
+            try:
+                self._refresh(source, path, key)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self.cache.record(source, "refresh_errors")
+                print(f"Error refreshing {source} for {key[1]}: {e}")
+            finally:
+                self.cache.end_refresh(key)
+
+        self._executor.submit(refresh)
+
     def get_user_bar(self, username):
         """Get user's bar data from BAXUS API"""
         try:
-            response = requests.get(
-                f"{self.api_url}/bar/user/{username}",
-                headers={"Content-Type": "application/json"}
-            )
-            response.raise_for_status()  # Raise exception for HTTP errors
-            return response.json()
-        except requests.exceptions.RequestException as e:
+            with metrics.stage("bar_fetch"):
+                return self._get_cached("bar", f"/bar/user/{username}", username)
+        except (requests.exceptions.RequestException, ValueError) as e:
             print(f"Error fetching user bar: {e}")
             return None
-            
+
     def get_user_wishlist(self, username):
         """Get user's wishlist data from BAXUS API (if available)"""
         try:
-            response = requests.get(
-                f"{self.api_url}/wishlist/user/{username}",
-                headers={"Content-Type": "application/json"}
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
+            with metrics.stage("wishlist_fetch"):
+                return self._get_cached("wishlist", f"/wishlist/user/{username}", username)
+        except (requests.exceptions.RequestException, ValueError) as e:
             print(f"Error fetching user wishlist: {e}")
             return None
-        
-        
\ No newline at end of file
+
+    def cache_stats(self):
+        """Per-source hit/miss/refresh counters for the bar and wishlist cache, plus coalesced fetches"""
+        stats = self.cache.stats() if self.cache is not None else {}
+        stats["fetches"] = self._flights.stats()
+        return stats
+
+    def get_user_bar_and_wishlist(self, username):
+        """Fetch bar and wishlist concurrently; returns (bar, wishlist)"""
+        # In this request's context, so the fetch is timed under its labels
+        wishlist_future = self._executor.submit(contextvars.copy_context().run, self.get_user_wishlist, username)
+        user_bar = self.get_user_bar(username)
+        return user_bar, wishlist_future.result()
+
+    def close(self):
+        """Release pooled connections and worker threads"""
+        self._executor.shutdown(wait=False)
+        self.session.close()
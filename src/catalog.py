@@ -0,0 +1,434 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+import config
+from src.catalog_file import (
+    INT, STR, CatalogFile, GroupIndex, MappedBottles, encode_columns, group_rows, is_catalog_file,
+    write_catalog_file
+)
+from src.features import FeatureMatrix
+from src.name_resolver import NameMatch, NameResolver
+from src.price_index import PriceIndex
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """Normalize a bottle name for exact-match lookups"""
+    if not name:
+        return ""
+    # Lowercase, unify curly apostrophes and collapse whitespace
+    name = name.lower().replace("’", "'")
+    return re.sub(r"\s+", " ", name).strip()
+
+
+class Catalog:
+    """Immutable, indexed view over the whisky bottle dataset
+
+    Built from bottle dicts (a JSON dataset), or opened from a compiled
+    catalog file (see compile_catalog), whose columns, feature matrix, price
+    index and lookup indexes are memory-mapped and whose bottles are decoded
+    on first access.
+    """
+
+    def __init__(self, bottles: Iterable[Dict], version: Optional[str] = None, source: Optional[str] = None):
+        self._bottles: Sequence[Dict] = tuple(bottles)
+        self.source = source
+        self.version = version or self._compute_version(self._bottles)
+
+        by_id: Dict = {}
+        by_ranking: Dict = {}
+        by_name: Dict = {}
+        by_spirit_type: Dict = {}
+        ids_by_name: Dict = {}
+        name_codes: Dict[str, int] = {}
+        spirit_codes: Dict[str, int] = {}
+        rows = len(self._bottles)
+        self._name_codes = np.empty(rows, dtype=np.int64)
+        self._spirit_codes = np.empty(rows, dtype=np.int64)
+
+        for row, bottle in enumerate(self._bottles):
+            if bottle.get("id") is not None:
+                by_id.setdefault(bottle["id"], bottle)
+            if bottle.get("ranking") is not None:
+                by_ranking.setdefault(bottle["ranking"], []).append(bottle)
+            key = normalize_name(bottle.get("name"))
+            if key:
+                by_name.setdefault(key, bottle)
+                if bottle.get("id") is not None:
+                    ids_by_name.setdefault(key, []).append(bottle["id"])
+            spirit_type = bottle.get("spirit_type") or ""
+            by_spirit_type.setdefault(spirit_type, []).append(bottle)
+            # Per-row codes let retrieval filter the whole catalog with array operations
+            self._name_codes[row] = name_codes.setdefault(key, len(name_codes))
+            self._spirit_codes[row] = spirit_codes.setdefault(spirit_type, len(spirit_codes))
+        self._name_code = name_codes.get
+        self._spirit_type_list: List[str] = list(spirit_codes)
+
+        # Freeze the indexes so the catalog can be shared across requests
+        self._by_id = MappingProxyType(by_id)
+        self._by_ranking = MappingProxyType({k: tuple(v) for k, v in by_ranking.items()})
+        self._by_name = MappingProxyType(by_name)
+        self._ids_by_name = MappingProxyType({k: tuple(v) for k, v in ids_by_name.items()})
+        self._by_spirit_type = MappingProxyType({k: tuple(v) for k, v in by_spirit_type.items()})
+
+        # Fuzzy name index for LLM-generated bottle names
+        self._name_resolver: Optional[NameResolver] = NameResolver(self._bottles)
+        self._data: Optional[CatalogFile] = None
+
+        # Dense feature matrix for vectorized similarity scoring
+        self.features = FeatureMatrix(self._bottles)
+
+        # Sorted price arrays, percentiles and histograms for price bands
+        self.prices = PriceIndex(self._bottles)
+
+    @classmethod
+    def open(cls, path: str) -> "Catalog":
+        """Memory-map a compiled catalog file; nothing is decoded up front"""
+        data = CatalogFile(path)
+        arrays = data.arrays
+        catalog = cls.__new__(cls)
+        catalog._data = data
+        catalog._bottles = bottles = MappedBottles(data)
+        catalog.source = path
+        catalog.version = data.header["version"]
+
+        def index(name, value, encode=None):
+            return GroupIndex(arrays[f"index.{name}.keys"], arrays[f"index.{name}.starts"],
+                              arrays[f"index.{name}.rows"], value, encode)
+
+        def first(rows):
+            return bottles[int(rows[0])]
+
+        def every(rows):
+            return tuple(bottles[int(row)] for row in rows)
+
+        def name_key(key):
+            return data.string_id(key) if isinstance(key, str) and key else None
+
+        id_tags = arrays.get("col.id.tag")
+        ids = arrays.get("col.id.num")
+
+        def ids_of(rows):
+            return tuple(int(ids[row]) for row in rows if id_tags[row] == INT)
+
+        spirit_types = data.header["spirit_types"]
+        spirit_codes = {spirit_type: code for code, spirit_type in enumerate(spirit_types)}
+        catalog._by_id = index("id", first)
+        catalog._by_ranking = index("ranking", every)
+        catalog._by_name = index("name", first, name_key)
+        catalog._ids_by_name = index("name", ids_of, name_key)
+        catalog._by_spirit_type = index("spirit_type", every, spirit_codes.get)
+        catalog._name_codes = arrays["rows.name_key"]
+        catalog._spirit_codes = arrays["rows.spirit_code"]
+        catalog._name_code = data.string_id
+        catalog._spirit_type_list = spirit_types
+        # Needs every name, so opening leaves it out; warm() builds it off the request path
+        catalog._name_resolver = None
+        catalog._name_resolver_lock = threading.Lock()
+
+        features = data.header["features"]
+        catalog.features = FeatureMatrix.from_arrays(
+            arrays["features.matrix"], arrays["features.quality"], features["spirit_types"],
+            features["brand_buckets"], index("id", lambda rows: int(rows[0]))
+        )
+        catalog.prices = PriceIndex.from_arrays({
+            tuple(key): (arrays[f"prices.{i}.prices"], arrays[f"prices.{i}.rows"])
+            for i, key in enumerate(data.header["price_keys"])
+        })
+        return catalog
+
+    @classmethod
+    def load(cls, path: str) -> "Catalog":
+        """Load a catalog from a JSON dataset file (or a compiled catalog file)"""
+        if is_catalog_file(path):
+            return cls.open(path)
+        with open(path, 'rb') as f:
+            raw = f.read()
+        bottles = json.loads(raw)
+        if not isinstance(bottles, list):
+            raise ValueError(f"Expected a list of bottles in {path}")
+        version = hashlib.sha1(raw).hexdigest()[:12]
+        return cls(bottles, version=version, source=path)
+
+    @classmethod
+    def ensure(cls, bottles) -> Optional["Catalog"]:
+        """Return `bottles` as a Catalog, indexing a plain list once and reusing it
+
+        A list is matched by identity and then row by row, so one with rows
+        added, removed or replaced since is indexed again.
+        """
+        if bottles is None or isinstance(bottles, Catalog):
+            return bottles
+        key = id(bottles)
+        with _ensured_lock:
+            entry = _ensured.get(key)
+        if entry is not None:
+            source, catalog = entry
+            if (source is bottles and len(bottles) == len(catalog)
+                    and all(a is b for a, b in zip(bottles, catalog.bottles))):
+                return catalog
+        catalog = cls(bottles)
+        if isinstance(bottles, list):
+            with _ensured_lock:
+                # Keeping the list alive keeps its id from being reused by another one
+                _ensured[key] = (bottles, catalog)
+                while len(_ensured) > _MAX_ENSURED:
+                    del _ensured[next(iter(_ensured))]
+        return catalog
+
+    @staticmethod
+    def _compute_version(bottles: Tuple[Dict, ...]) -> str:
+        """Stable content hash for catalogs built from in-memory data"""
+        payload = json.dumps(bottles, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha1(payload).hexdigest()[:12]
+
+    # Sequence protocol so existing list-based callers keep working
+    def __len__(self) -> int:
+        return len(self._bottles)
+
+    def __iter__(self):
+        return iter(self._bottles)
+
+    def __getitem__(self, index):
+        return self._bottles[index]
+
+    def __bool__(self) -> bool:
+        return bool(self._bottles)
+
+    def __repr__(self) -> str:
+        return f"Catalog(bottles={len(self._bottles)}, version={self.version!r})"
+
+    @property
+    def bottles(self) -> Sequence[Dict]:
+        return self._bottles
+
+    @property
+    def name_resolver(self) -> NameResolver:
+        if self._name_resolver is None:
+            with self._name_resolver_lock:
+                if self._name_resolver is None:
+                    tags = self._data.arrays["col.name.tag"]
+                    string_ids = self._data.arrays["col.name.str"]
+                    names = (
+                        self._data.string(int(string_id)) if tag == STR else None
+                        for tag, string_id in zip(tags, string_ids)
+                    )
+                    self._name_resolver = NameResolver(self._bottles, names=names)
+        return self._name_resolver
+
+    def warm(self) -> "Catalog":
+        """Build the indexes a compiled catalog leaves out when opened (the name resolver)
+
+        Loaders call this before sharing the catalog, so no request pays
+        for the build on its first fuzzy lookup.
+        """
+        self.name_resolver
+        return self
+
+    @property
+    def spirit_types(self) -> List[str]:
+        return list(self._spirit_type_list)
+
+    def is_current_for(self, source: str) -> bool:
+        """Whether this compiled catalog was built from `source` as it is now on disk"""
+        if self._data is None:
+            return False
+        stat = os.stat(source)
+        header = self._data.header
+        return (header.get("source_size"), header.get("source_mtime_ns")) == (stat.st_size, stat.st_mtime_ns)
+
+    def get_by_id(self, bottle_id) -> Optional[Dict]:
+        """Look up a bottle by its catalog id"""
+        return self._by_id.get(bottle_id)
+
+    def get_by_ranking(self, ranking) -> Optional[Dict]:
+        """Look up the first bottle with the given ranking"""
+        matches = self._by_ranking.get(ranking)
+        return matches[0] if matches else None
+
+    def has_ranking(self, ranking) -> bool:
+        """Check whether any bottle in the catalog carries this ranking"""
+        return ranking in self._by_ranking
+
+    def find_by_name(self, name: Optional[str]) -> Optional[Dict]:
+        """Look up a bottle by its (normalized) name"""
+        return self._by_name.get(normalize_name(name))
+
+    def resolve_name(self, name: Optional[str], min_confidence: float = 0.0) -> Optional[NameMatch]:
+        """Fuzzy-match a free-text bottle name against the catalog"""
+        return self.name_resolver.resolve(name, min_confidence)
+
+    def by_spirit_type(self, spirit_type: Optional[str]) -> Tuple[Dict, ...]:
+        """All bottles of the given spirit type"""
+        return self._by_spirit_type.get(spirit_type or "", ())
+
+    def match_bar_item(self, item: Dict) -> Optional[Dict]:
+        """Find the catalog bottle behind a BAXUS bar/wishlist item"""
+        product = item.get("product") or {}
+        if product or "release_id" in item:
+            # BAXUS bar items: the item id is the bar entry, not the product
+            bottle_ids = (product.get("id"), item.get("release_id"))
+        else:
+            bottle_ids = (item.get("id"),)
+        for bottle_id in bottle_ids:
+            if bottle_id is not None and bottle_id in self._by_id:
+                return self._by_id[bottle_id]
+        return self.find_by_name(product.get("name") or item.get("name"))
+
+    def owned_bottles(self, bar_items: Iterable[Dict]) -> List[Dict]:
+        """Catalog bottles for the items in a user's bar (duplicates kept)"""
+        owned = []
+        for item in bar_items:
+            bottle = self.match_bar_item(item)
+            if bottle:
+                owned.append(bottle)
+        return owned
+
+    def similar_bottles(self, owned: List[Dict], k: int, spirit_type: Optional[str] = None,
+                        vector: Optional[np.ndarray] = None) -> List[Tuple[Dict, float]]:
+        """Top-k catalog bottles closest to the taste vector of `owned` (or a precomputed `vector`)"""
+        owned_ids = [b["id"] for b in owned if b.get("id") is not None]
+        if vector is None:
+            vector = self.features.taste_vector(owned_ids)
+        if vector is None:
+            return []
+        # Also skip other listings (sizes, editions) of bottles the user owns
+        exclude_ids = set(owned_ids)
+        for bottle in owned:
+            exclude_ids.update(self._ids_by_name.get(normalize_name(bottle.get("name")), ()))
+        mask = self.spirit_type_mask([spirit_type], ignore_case=True) if spirit_type else None
+        return [
+            (self._bottles[row], score)
+            for row, score in self.features.top_k(vector, k, exclude_ids=exclude_ids, mask=mask)
+        ]
+
+    def id_mask(self, ids) -> np.ndarray:
+        """Boolean row mask of bottles whose id is in `ids`"""
+        if self._data is None:
+            return np.fromiter((b.get("id") in ids for b in self._bottles), dtype=bool, count=len(self._bottles))
+        tags = self._data.arrays.get("col.id.tag")
+        if tags is None:
+            return np.zeros(len(self), dtype=bool)
+        wanted = [i for i in ids if isinstance(i, int) and not isinstance(i, bool)]
+        return (tags == INT) & np.isin(self._data.arrays["col.id.num"], wanted)
+
+    def name_mask(self, names: Iterable[str]) -> np.ndarray:
+        """Boolean row mask of bottles whose normalized name is in `names`"""
+        codes = [code for code in (self._name_code(name) for name in names) if code is not None]
+        return np.isin(self._name_codes, codes)
+
+    def spirit_type_mask(self, spirit_types: Iterable[Optional[str]], ignore_case: bool = False) -> np.ndarray:
+        """Boolean row mask of bottles whose spirit type is one of `spirit_types`"""
+        if ignore_case:
+            wanted = {(s or "").strip().lower() for s in spirit_types}
+            codes = [code for code, s in enumerate(self._spirit_type_list) if s.lower() in wanted]
+        else:
+            wanted = {s or "" for s in spirit_types}
+            codes = [code for code, s in enumerate(self._spirit_type_list) if s in wanted]
+        return np.isin(self._spirit_codes, codes)
+
+
+def compiled_path(path: str) -> str:
+    """Where compile_catalog puts the compiled form of a JSON dataset"""
+    return os.path.splitext(path)[0] + ".bxcat"
+
+
+def compile_catalog(path: str, out_path: Optional[str] = None) -> str:
+    """Compile a JSON dataset into a memory-mappable catalog file; returns its path
+
+    The file holds every column (fixed-width numbers plus ids into an
+    interned string table), the feature matrix, the price index and the id,
+    name, ranking and spirit type indexes, all computed here by the same
+    code that indexes a JSON catalog. Integer ids and rankings are required.
+    """
+    out_path = out_path or compiled_path(path)
+    stat = os.stat(path)
+    catalog = Catalog.load(path)
+    bottles = catalog.bottles
+
+    for field in ("id", "ranking"):
+        if any(b.get(field) is not None and (not isinstance(b[field], int) or isinstance(b[field], bool))
+               for b in bottles):
+            raise ValueError(f"Compiled catalogs need integer {field}s; {path} has others")
+
+    name_keys = [normalize_name(b.get("name")) for b in bottles]
+    columns, arrays, string_ids = encode_columns(bottles, extra_strings=name_keys)
+    arrays["rows.name_key"] = np.array([string_ids[key] for key in name_keys], dtype=np.uint32)
+    arrays["rows.spirit_code"] = catalog._spirit_codes.astype(np.int32)
+    indexes = {
+        "id": [b.get("id") for b in bottles],
+        "ranking": [b.get("ranking") for b in bottles],
+        "name": [string_ids[key] if key else None for key in name_keys],
+        "spirit_type": catalog._spirit_codes.tolist(),
+    }
+    for name, keys in indexes.items():
+        for part, array in group_rows(keys).items():
+            arrays[f"index.{name}.{part}"] = array
+
+    arrays["features.matrix"] = catalog.features.matrix
+    arrays["features.quality"] = catalog.features.quality
+    price_keys = []
+    for i, (key, (prices, rows)) in enumerate(catalog.prices.sorted_arrays().items()):
+        price_keys.append(list(key))
+        arrays[f"prices.{i}.prices"] = np.array(prices, dtype=np.float64)
+        arrays[f"prices.{i}.rows"] = np.array(rows, dtype=np.int32)
+
+    header = {
+        "version": catalog.version,
+        "source": os.path.abspath(path),
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "rows": len(catalog),
+        "columns": columns,
+        "spirit_types": catalog.spirit_types,
+        "features": {"spirit_types": catalog.features.spirit_types, "brand_buckets": catalog.features.brand_buckets},
+        "price_keys": price_keys,
+    }
+    write_catalog_file(out_path, header, arrays)
+    return out_path
+
+
+_catalogs: Dict[str, Catalog] = {}
+_catalogs_lock = threading.Lock()
+
+# Catalogs built by Catalog.ensure, by the id of the list they index
+_ensured: Dict[int, Tuple[List[Dict], Catalog]] = {}
+_ensured_lock = threading.Lock()
+# Lists kept at most; the oldest drops out first
+_MAX_ENSURED = 4
+
+
+def load_catalog(path: str) -> Catalog:
+    """Load a catalog once per process and share it between callers"""
+    key = os.path.abspath(path)
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            catalog = read_catalog(key).warm()
+            _catalogs[key] = catalog
+        return catalog
+
+
+def read_catalog(path: str) -> Catalog:
+    """Load a JSON dataset afresh, from its compiled form when that is current"""
+    return _load_compiled(path) or Catalog.load(path)
+
+
+def _load_compiled(path: str) -> Optional[Catalog]:
+    """The compiled form of a JSON dataset, if it exists and was built from the current file"""
+    compiled = compiled_path(path)
+    if not config.CATALOG_USE_COMPILED or compiled == path or not is_catalog_file(compiled):
+        return None
+    try:
+        catalog = Catalog.open(compiled)
+    except ValueError as e:
+        print(f"Ignoring compiled catalog: {e}")
+        return None
+    if not catalog.is_current_for(path):
+        print(f"Compiled catalog {compiled} is older than {path}; loading the JSON (rerun build_catalog.py)")
+        return None
+    return catalog
@@ -0,0 +1,303 @@
+import json
+import mmap
+import os
+import struct
+from collections.abc import Mapping, Sequence
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+MAGIC = b"BXCATLG\x00"
+FORMAT_VERSION = 1
+_PREFIX = struct.Struct("<8sII")  # magic, format version, header length
+_ALIGN = 64
+
+# Type tag of each cell; a column keeps one tag per row next to its values
+ABSENT, NULL, INT, FLOAT, STR, BOOL, JSON = range(7)
+
+
+def is_catalog_file(path: str) -> bool:
+    """Whether `path` starts like a compiled catalog file"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def encode_columns(rows: Sequence[Dict], extra_strings: Iterable[str] = ()) -> Tuple[List[Dict], Dict[str, np.ndarray], Dict[str, int]]:
+    """Columnar arrays for a list of flat dicts
+
+    Returns the column list (name, value dtype), the arrays (per column a
+    uint8 tag array plus a numeric and/or string-id array, and the interned
+    string table) and the string -> id map, which also covers
+    `extra_strings`. Numbers are stored as int64, or float64 when a column
+    holds any float; strings and nested values (as JSON) go to the string
+    table, sorted so lookups can bisect it.
+    """
+    names: Dict[str, None] = {}
+    for row in rows:
+        names.update(dict.fromkeys(row))
+
+    strings = set(extra_strings)
+    cells: Dict[str, List[Tuple[int, Any]]] = {}
+    for name in names:
+        column = []
+        for row in rows:
+            if name not in row:
+                column.append((ABSENT, None))
+                continue
+            value = row[name]
+            if value is None:
+                column.append((NULL, None))
+            elif isinstance(value, bool):
+                column.append((BOOL, int(value)))
+            elif isinstance(value, int):
+                column.append((INT, value))
+            elif isinstance(value, float):
+                column.append((FLOAT, value))
+            elif isinstance(value, str):
+                column.append((STR, value))
+                strings.add(value)
+            else:
+                text = json.dumps(value, sort_keys=True)
+                column.append((JSON, text))
+                strings.add(text)
+        cells[name] = column
+
+    table = sorted(strings, key=lambda s: s.encode("utf-8"))
+    string_ids = {s: i for i, s in enumerate(table)}
+    encoded = [s.encode("utf-8") for s in table]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    arrays = {
+        "strings.offsets": offsets,
+        "strings.data": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+    }
+
+    columns = []
+    for name, column in cells.items():
+        tags = np.array([tag for tag, _ in column], dtype=np.uint8)
+        arrays[f"col.{name}.tag"] = tags
+        spec = {"name": name}
+        if np.isin(tags, (INT, FLOAT, BOOL)).any():
+            dtype = np.float64 if (tags == FLOAT).any() else np.int64
+            arrays[f"col.{name}.num"] = np.array(
+                [value if tag in (INT, FLOAT, BOOL) else 0 for tag, value in column], dtype=dtype
+            )
+            spec["num"] = np.dtype(dtype).name
+        if np.isin(tags, (STR, JSON)).any():
+            arrays[f"col.{name}.str"] = np.array(
+                [string_ids[value] if tag in (STR, JSON) else 0 for tag, value in column], dtype=np.uint32
+            )
+            spec["str"] = True
+        columns.append(spec)
+    return columns, arrays, string_ids
+
+
+def group_rows(keys: Sequence[Optional[int]]) -> Dict[str, np.ndarray]:
+    """Arrays for a GroupIndex over one integer key per row (None: not indexed)"""
+    pairs = sorted((key, row) for row, key in enumerate(keys) if key is not None)
+    unique, starts = [], []
+    for i, (key, _) in enumerate(pairs):
+        if not unique or unique[-1] != key:
+            unique.append(key)
+            starts.append(i)
+    starts.append(len(pairs))
+    return {
+        "keys": np.array(unique, dtype=np.int64),
+        "starts": np.array(starts, dtype=np.int64),
+        "rows": np.array([row for _, row in pairs], dtype=np.int32),
+    }
+
+
+def write_catalog_file(path: str, header: Dict, arrays: Dict[str, np.ndarray]):
+    """Write the header and arrays (each 64-byte aligned), replacing `path` atomically"""
+    header = dict(header, arrays={})
+    # Array offsets depend on the header size, which depends on the offsets;
+    # reserve a header block with some slack and lay out again if it overflows
+    header_block = 0
+    while True:
+        layout = []
+        offset = _align(_PREFIX.size + header_block)
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            layout.append((offset, array))
+            offset = _align(offset + array.nbytes)
+        encoded = json.dumps(header, sort_keys=True).encode("utf-8")
+        if len(encoded) <= header_block:
+            break
+        header_block = _align(len(encoded) + 1024)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(encoded)))
+        f.write(encoded)
+        for offset, array in layout:
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class CatalogFile:
+    """Read-only memory map of a compiled catalog file
+
+    Arrays are numpy views straight onto the mapped pages, so processes
+    mapping the same file share one copy in the page cache and opening it
+    costs only the header parse.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_length = _PREFIX.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a compiled catalog file")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{path} has catalog format version {version}, expected {FORMAT_VERSION}; rebuild it")
+        self.header: Dict = json.loads(self._mmap[_PREFIX.size:_PREFIX.size + header_length])
+        self.arrays: Dict[str, np.ndarray] = {}
+        for name, spec in self.header["arrays"].items():
+            shape = tuple(spec["shape"])
+            count = int(np.prod(shape)) if shape else 1
+            if count == 0:
+                array = np.empty(shape, dtype=spec["dtype"])
+            else:
+                array = np.frombuffer(self._mmap, dtype=spec["dtype"], count=count, offset=spec["offset"])
+            self.arrays[name] = array.reshape(shape)
+        self.rows: int = self.header["rows"]
+        self.columns: List[Dict] = self.header["columns"]
+        self._offsets = self.arrays["strings.offsets"]
+        self._data_offset = self.header["arrays"]["strings.data"]["offset"]
+
+    def string(self, string_id: int) -> str:
+        start = self._data_offset + int(self._offsets[string_id])
+        end = self._data_offset + int(self._offsets[string_id + 1])
+        return self._mmap[start:end].decode("utf-8")
+
+    def string_id(self, value: str) -> Optional[int]:
+        """Id of an interned string, by bisecting the sorted table"""
+        target = value.encode("utf-8")
+        lo, hi = 0, len(self._offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self._data_offset + int(self._offsets[mid])
+            if self._mmap[start:self._data_offset + int(self._offsets[mid + 1])] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._offsets) - 1 and self.string(lo) == value:
+            return lo
+        return None
+
+    def row(self, index: int) -> Dict:
+        """Decode one row back into the dict it was compiled from"""
+        row = {}
+        for column in self.columns:
+            name = column["name"]
+            tag = self.arrays[f"col.{name}.tag"][index]
+            if tag == ABSENT:
+                continue
+            if tag == NULL:
+                row[name] = None
+            elif tag == INT:
+                row[name] = int(self.arrays[f"col.{name}.num"][index])
+            elif tag == FLOAT:
+                row[name] = float(self.arrays[f"col.{name}.num"][index])
+            elif tag == BOOL:
+                row[name] = bool(self.arrays[f"col.{name}.num"][index])
+            elif tag == STR:
+                row[name] = self.string(int(self.arrays[f"col.{name}.str"][index]))
+            else:
+                row[name] = json.loads(self.string(int(self.arrays[f"col.{name}.str"][index])))
+        return row
+
+    def strings(self, string_ids: Iterable[int]) -> Iterable[str]:
+        return (self.string(int(i)) for i in string_ids)
+
+
+class MappedBottles(Sequence):
+    """Bottle dicts decoded on first access from a CatalogFile
+
+    Decoded rows are kept, so a bottle is the same dict object every time
+    it is looked up (callers de-duplicate by identity) and only bottles that
+    requests actually touch take up heap.
+    """
+
+    def __init__(self, data: CatalogFile):
+        self._data = data
+        self._rows: Dict[int, Dict] = {}
+
+    def __len__(self) -> int:
+        return self._data.rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("catalog row out of range")
+        bottle = self._rows.get(index)
+        if bottle is None:
+            bottle = self._rows.setdefault(index, self._data.row(index))
+        return bottle
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+class GroupIndex(Mapping):
+    """Read-only key -> value mapping over rows grouped by a sorted key array
+
+    `value` turns a key's rows (ascending) into the mapped value; `encode`
+    turns a lookup key into the stored key (None: not present).
+    """
+
+    def __init__(self, keys: np.ndarray, starts: np.ndarray, rows: np.ndarray,
+                 value: Callable[[np.ndarray], Any], encode: Optional[Callable[[Any], Any]] = None):
+        self._keys = keys
+        self._starts = starts
+        self._rows = rows
+        self._value = value
+        self._encode = encode or _integer_key
+
+    def _find(self, key) -> Optional[int]:
+        key = self._encode(key)
+        if key is None:
+            return None
+        i = int(np.searchsorted(self._keys, key))
+        if i < len(self._keys) and self._keys[i] == key:
+            return i
+        return None
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        if i is None:
+            raise KeyError(key)
+        return self._value(self._rows[self._starts[i]:self._starts[i + 1]])
+
+    def __contains__(self, key) -> bool:
+        return self._find(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys.tolist())
+
+
+def _integer_key(key) -> Optional[int]:
+    if isinstance(key, (int, np.integer)) and not isinstance(key, bool):
+        return key
+    return None
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from src.catalog import Catalog, compiled_path, read_catalog
+
+
+class CatalogReloader:
+    """The current catalog snapshot for a dataset, replaced when the dataset changes
+
+    Requests read `current` once and use that snapshot to the end, so a
+    reload never changes the catalog under an in-flight generation. A reload
+    builds the new catalog and all its indexes on the calling thread (the
+    file watcher or an admin request, never a recommendation request) and
+    then swaps the reference in one assignment. A file that fails to load,
+    or has no bottles, leaves the current snapshot in place; one with the
+    same content (same version) keeps it too.
+    """
+
+    def __init__(self, path: str, catalog: Optional[Catalog] = None):
+        self.path = path
+        self.current: Catalog = catalog if catalog is not None else Catalog([])
+        self.loaded_at: Optional[float] = None
+        self._signature: Optional[Tuple] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"reloads": 0, "unchanged": 0, "failed": 0}
+
+    def _file_signature(self) -> Tuple:
+        """Size and mtime of the dataset and of its compiled file; rewriting either changes it"""
+        signature = []
+        for path in (self.path, compiled_path(self.path)):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def reload(self, force: bool = False) -> Dict[str, Any]:
+        """Load the dataset again if its files changed (always with force) and swap it in"""
+        with self._lock:
+            signature = self._file_signature()
+            if not force and signature == self._signature:
+                return self.status("unchanged")
+            previous = self.current
+            try:
+                catalog = read_catalog(self.path)
+                if not catalog:
+                    raise ValueError(f"no bottles in {self.path}")
+                # A compiled catalog opens without its name resolver; build it before the swap
+                catalog.warm()
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"Catalog reload failed, keeping version {previous.version}: {e}")
+                return self.status("error", error=str(e))
+            # Taken before the read, so a write during it triggers another reload
+            self._signature = signature
+            if (catalog.version, catalog.source) == (previous.version, previous.source):
+                self.stats["unchanged"] += 1
+                return self.status("unchanged")
+            self.current = catalog
+            self.loaded_at = time.time()
+            self.stats["reloads"] += 1
+            print(f"Catalog reloaded from {catalog.source}: version {previous.version} -> {catalog.version} "
+                  f"({len(catalog)} bottles)")
+            return self.status("reloaded", previous_version=previous.version)
+
+    def status(self, result: Optional[str] = None, **extra) -> Dict[str, Any]:
+        catalog = self.current
+        status = {
+            "version": catalog.version,
+            "bottles": len(catalog),
+            "source": catalog.source,
+            "loaded_at": self.loaded_at,
+            "stats": dict(self.stats),
+        }
+        if result:
+            status["result"] = result
+        status.update(extra)
+        return status
+
+    def watch(self, interval: float):
+        """Check the dataset files every `interval` seconds from a background thread"""
+        if self._thread is not None or interval <= 0:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.reload()
+                except Exception as e:
+                    print(f"Catalog watcher error: {e}")
+
+        self._thread = threading.Thread(target=loop, name="catalog-watcher", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the watcher thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,137 @@
+import warnings
+import zlib
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class FeatureMatrix:
+    """Normalized float32 feature representation of the catalog
+
+    Each bottle becomes one L2-normalized row made of standardized numeric
+    fields, a one-hot spirit type block and a hashed brand block, so cosine
+    similarity against a taste vector is a single matrix-vector product.
+    """
+
+    NUMERIC_FIELDS = (
+        "abv", "proof", "avg_msrp", "fair_price", "shelf_price",
+        "popularity", "total_score", "bar_count", "wishlist_count",
+    )
+    # Heavy-tailed fields are compared on a log scale
+    LOG_FIELDS = frozenset({
+        "avg_msrp", "fair_price", "shelf_price", "popularity",
+        "total_score", "bar_count", "wishlist_count",
+    })
+
+    def __init__(self, bottles: Sequence[Dict], brand_buckets: int = 32,
+                 spirit_weight: float = 1.5, brand_weight: float = 1.0):
+        self.brand_buckets = brand_buckets
+        self.spirit_types: List[str] = sorted({b.get("spirit_type") or "" for b in bottles})
+        spirit_columns = {spirit: i for i, spirit in enumerate(self.spirit_types)}
+
+        n = len(bottles)
+        numeric = np.full((n, len(self.NUMERIC_FIELDS)), np.nan, dtype=np.float64)
+        spirit = np.zeros((n, len(self.spirit_types)), dtype=np.float32)
+        brand = np.zeros((n, brand_buckets), dtype=np.float32)
+        self._row_by_id: Mapping = {}
+
+        for row, bottle in enumerate(bottles):
+            for col, field in enumerate(self.NUMERIC_FIELDS):
+                value = bottle.get(field)
+                if isinstance(value, (int, float)):
+                    numeric[row, col] = np.log1p(max(value, 0)) if field in self.LOG_FIELDS else value
+            spirit[row, spirit_columns[bottle.get("spirit_type") or ""]] = spirit_weight
+            if bottle.get("brand_id") is not None:
+                brand[row, self._brand_bucket(bottle["brand_id"])] = brand_weight
+            if bottle.get("id") is not None:
+                self._row_by_id.setdefault(bottle["id"], row)
+
+        # Standardize numeric columns; missing values (and all-missing
+        # columns in tiny catalogs) land on the mean, i.e. 0
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            mean = np.nanmean(numeric, axis=0) if n else np.zeros(len(self.NUMERIC_FIELDS))
+            std = np.nanstd(numeric, axis=0) if n else np.ones(len(self.NUMERIC_FIELDS))
+        mean = np.nan_to_num(mean)
+        std = np.where(np.nan_to_num(std) > 0, std, 1.0)
+        standardized = np.nan_to_num((numeric - mean) / std).astype(np.float32)
+
+        matrix = np.hstack([standardized, spirit, brand]).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms > 0, norms, 1.0)
+        matrix.setflags(write=False)
+
+        self.matrix: np.ndarray = matrix
+
+        # Popularity/score prior in [0, 1], used to rank bottles independent of taste
+        prior = np.nan_to_num(numeric[:, [self.NUMERIC_FIELDS.index("popularity"),
+                                           self.NUMERIC_FIELDS.index("total_score")]]).mean(axis=1)
+        span = prior.max() - prior.min() if n else 0
+        self.quality: np.ndarray = ((prior - prior.min()) / span if span > 0 else np.zeros(n)).astype(np.float32)
+        self.quality.setflags(write=False)
+        self.columns: List[str] = (
+            list(self.NUMERIC_FIELDS)
+            + [f"spirit_type={s}" for s in self.spirit_types]
+            + [f"brand_bucket={i}" for i in range(brand_buckets)]
+        )
+
+    @classmethod
+    def from_arrays(cls, matrix: np.ndarray, quality: np.ndarray, spirit_types: List[str],
+                    brand_buckets: int, row_by_id: Mapping) -> "FeatureMatrix":
+        """Wrap precomputed arrays (e.g. memory-mapped from a compiled catalog)"""
+        features = cls.__new__(cls)
+        features.brand_buckets = brand_buckets
+        features.spirit_types = list(spirit_types)
+        features.matrix = matrix
+        features.quality = quality
+        features._row_by_id = row_by_id
+        features.columns = (
+            list(cls.NUMERIC_FIELDS)
+            + [f"spirit_type={s}" for s in features.spirit_types]
+            + [f"brand_bucket={i}" for i in range(brand_buckets)]
+        )
+        return features
+
+    def _brand_bucket(self, brand_id) -> int:
+        """Stable hash bucket for a brand id"""
+        return zlib.crc32(str(brand_id).encode("utf-8")) % self.brand_buckets
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def row_for(self, bottle_id) -> Optional[int]:
+        """Matrix row for a catalog bottle id"""
+        return self._row_by_id.get(bottle_id)
+
+    def taste_vector(self, bottle_ids: Iterable) -> Optional[np.ndarray]:
+        """Unit-length mean of the rows for the given (owned) bottle ids"""
+        rows = [r for r in (self.row_for(i) for i in bottle_ids) if r is not None]
+        if not rows:
+            return None
+        # Repeated ids (duplicate bottles in a bar) weight the vector
+        vector = self.matrix[rows].mean(axis=0)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def scores(self, vector: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every catalog row against a unit vector"""
+        return self.matrix @ vector
+
+    def top_k(self, vector: np.ndarray, k: int, exclude_ids: Iterable = (),
+              mask: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Deterministic top-k (row, score) pairs using argpartition"""
+        scores = self.scores(vector).astype(np.float64)
+        excluded = [r for r in (self.row_for(i) for i in exclude_ids) if r is not None]
+        if excluded:
+            scores[excluded] = -np.inf
+        if mask is not None:
+            scores[~mask] = -np.inf
+
+        available = int(np.isfinite(scores).sum())
+        k = min(k, available)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        # Sort by score, breaking ties on row index for stable output
+        order = np.lexsort((top, -scores[top]))
+        return [(int(top[i]), float(scores[top[i]])) for i in order]
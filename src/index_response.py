@@ -0,0 +1,102 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from src.catalog import Catalog
+from src.price_index import bottle_price
+
+# One-letter reasons the model attaches to each picked candidate index
+REASON_CODES = {
+    "S": "similar to my bottles",
+    "C": "complements my collection",
+    "P": "fits my price range",
+    "V": "good value",
+    "Q": "highly rated",
+    "F": "fits the requested focus",
+}
+
+# Reason assumed when the model's pick has no valid code
+DEFAULT_REASONS = {
+    "general": "S",
+    "similar-price": "P",
+    "similar-profile": "S",
+    "complementary": "C",
+}
+
+# (candidate index, reason code or None) as read from the model's answer
+Pick = Tuple[int, Optional[str]]
+
+
+class PickExpander:
+    """Expand candidate picks into full recommendations from catalog data and templates"""
+
+    def __init__(self, catalog: Optional[Catalog], owned: Sequence[Dict]):
+        self.catalog = catalog
+        self.owned = list(owned)
+        features = catalog.features if catalog else None
+        self._owned_rows = [
+            r for r in (features.row_for(b.get("id")) for b in self.owned) if r is not None
+        ] if features else []
+        self._owned_types = sorted({b["spirit_type"] for b in self.owned if b.get("spirit_type")})
+
+    def nearest_owned(self, bottle: Dict) -> Optional[Dict]:
+        """The user's bottle closest to `bottle` in feature space"""
+        if not self.owned:
+            return None
+        features = self.catalog.features if self.catalog else None
+        row = features.row_for(bottle.get("id")) if features else None
+        if row is None or not self._owned_rows:
+            return self.owned[0]
+        closeness = features.matrix[self._owned_rows] @ features.matrix[row]
+        return self.catalog[self._owned_rows[int(closeness.argmax())]]
+
+    def expand(self, picks: Sequence[Pick], candidates: Sequence[Dict], mode: str = "general",
+               profile_focus: Optional[str] = None) -> List[Dict]:
+        """Recommendation dicts for (candidate index, reason code) picks"""
+        recommendations = []
+        for index, code in picks:
+            bottle = candidates[index]
+            code = code or DEFAULT_REASONS.get(mode, "S")
+            recommendations.append({
+                "name": bottle.get("name"),
+                "reasoning": self._reasoning(bottle, code, profile_focus),
+                "relationship": self._relationship(bottle, code),
+                "reason_code": code,
+                "bottle_id": index,
+                "bottle_data": bottle,
+            })
+        return recommendations
+
+    def _details(self, bottle: Dict) -> str:
+        details = [bottle.get("spirit_type") or "Whiskey"]
+        if bottle.get("abv"):
+            details.append(f"{bottle['abv']}% ABV")
+        price = bottle_price(bottle)
+        if price:
+            details.append(f"around ${price:.0f}")
+        return ", ".join(details)
+
+    def _reasoning(self, bottle: Dict, code: str, profile_focus: Optional[str]) -> str:
+        spirit_type = bottle.get("spirit_type") or "whiskey"
+        price = bottle_price(bottle)
+        if code == "C":
+            return f"Brings a new style to your collection ({self._details(bottle)})."
+        if code == "P" and price:
+            return f"Sits within your usual price range at around ${price:.0f} ({spirit_type})."
+        if code == "V" and price and self.catalog:
+            percentile = self.catalog.prices.percentile_of(price, spirit_type=bottle.get("spirit_type"))
+            return f"Strong value: priced below {100 - percentile:.0f}% of {spirit_type} bottles, at around ${price:.0f}."
+        if code == "Q":
+            ranking = f" (ranked #{bottle['ranking']})" if bottle.get("ranking") else ""
+            return f"One of the most highly rated {spirit_type} bottles{ranking} ({self._details(bottle)})."
+        if code == "F" and profile_focus:
+            return f"Fits your interest in {profile_focus} ({self._details(bottle)})."
+        return f"Matches the profile of your collection ({self._details(bottle)})."
+
+    def _relationship(self, bottle: Dict, code: str) -> str:
+        if code == "C":
+            if self._owned_types and bottle.get("spirit_type") not in self._owned_types:
+                return f"Adds {bottle.get('spirit_type') or 'a new style'} alongside your {', '.join(self._owned_types)}"
+            return "Complementary addition to your collection"
+        nearest = self.nearest_owned(bottle)
+        if nearest is None:
+            return "New addition to your collection"
+        return f"Similar to {nearest.get('name')} in your bar"
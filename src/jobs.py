@@ -0,0 +1,211 @@
+import itertools
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import config
+
+# Lower runs first
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "error"
+
+
+class JobQueueFullError(RuntimeError):
+    """Raised when a submission would exceed the queued-job limit"""
+
+
+class Job:
+    """One submitted unit of work and, once finished, its result or error"""
+
+    def __init__(self, key: Hashable, params: Dict[str, Any], priority: int):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.params = params
+        self.priority = priority
+        self.status = QUEUED
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.expires_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        job = {
+            "id": self.id,
+            "status": self.status,
+            "params": self.params,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "expires_at": self.expires_at,
+        }
+        if self.status == DONE:
+            job["result"] = self.result
+        elif self.status == FAILED:
+            job["error"] = self.error
+        return job
+
+
+class JobStore:
+    """Jobs by id: live jobs in memory, finished ones kept until their TTL (optionally in SQLite too)
+
+    With a path, finished jobs survive a restart, so a client can still
+    collect a result it was polling for.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: float = 3600, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._db = None
+
+        if path:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, job TEXT, expires_at REAL)")
+            self._db.commit()
+
+    def add(self, job: Job):
+        with self._lock:
+            self._jobs[job.id] = job
+
+    def finish(self, job: Job, status: str, result: Any = None, error: Optional[str] = None):
+        """Record the outcome, start the job's TTL and persist it"""
+        now = time.time()
+        with self._lock:
+            job.result, job.error = result, error
+            job.finished_at = now
+            job.expires_at = now + self.ttl
+            job.status = status
+            self._prune(now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?)",
+                    (job.id, json.dumps(job.to_dict(), default=str), job.expires_at),
+                )
+                self._db.commit()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job as a dict, or None when unknown or expired"""
+        now = time.time()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                if job.expires_at is None or job.expires_at > now:
+                    return job.to_dict()
+                del self._jobs[job_id]
+                return None
+            if self._db is not None:
+                row = self._db.execute("SELECT job, expires_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if row and row[1] > now:
+                    return json.loads(row[0])
+        return None
+
+    def _prune(self, now: float):
+        """Drop expired jobs and keep memory under its cap, oldest finished first"""
+        finished = sorted((job for job in self._jobs.values() if job.expires_at is not None),
+                          key=lambda job: job.expires_at)
+        excess = len(self._jobs) - self.max_entries
+        for job in finished:
+            if job.expires_at > now and excess <= 0:
+                break
+            del self._jobs[job.id]
+            excess -= 1
+        if self._db is not None:
+            self._db.execute("DELETE FROM jobs WHERE expires_at <= ?", (now,))
+
+class JobQueue:
+    """Priority queue of jobs served by a bounded pool of background worker threads
+
+    Submitting a job whose key matches one that is still queued or running
+    returns that job instead (raising its priority if needed), so a user
+    retrying or reconnecting never starts a second generation.
+    """
+
+    def __init__(self, run: Callable[[Dict[str, Any]], Any], store: Optional[JobStore] = None,
+                 workers: Optional[int] = None, max_queued: Optional[int] = None):
+        self.run = run
+        self.store = store or JobStore(
+            path=config.JOBS_STORE_PATH,
+            ttl=config.JOBS_RESULT_TTL_SECONDS,
+            max_entries=config.JOBS_MAX_STORED,
+        )
+        self.workers = workers or config.JOBS_WORKERS
+        self.max_queued = config.JOBS_MAX_QUEUED if max_queued is None else max_queued
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._active: Dict[Hashable, Job] = {}
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self.stats = {"submitted": 0, "deduplicated": 0, "rejected": 0, "completed": 0, "failed": 0}
+
+    def submit(self, key: Hashable, params: Dict[str, Any], priority: str = "normal") -> Dict[str, Any]:
+        """Enqueue run(params) unless a job with the same key is pending; returns the job's dict"""
+        rank = PRIORITIES[priority]
+        with self._lock:
+            job = self._active.get(key)
+            if job is not None:
+                self.stats["deduplicated"] += 1
+                if job.status == QUEUED and rank < job.priority:
+                    # Re-queue ahead; the stale entry is skipped when popped
+                    job.priority = rank
+                    self._queue.put((rank, next(self._order), job))
+                return job.to_dict()
+            if self._queued >= self.max_queued:
+                self.stats["rejected"] += 1
+                raise JobQueueFullError(f"{self._queued} jobs already queued")
+
+            job = Job(key, params, rank)
+            self._active[key] = job
+            self._queued += 1
+            self.stats["submitted"] += 1
+            self.store.add(job)
+            self._queue.put((rank, next(self._order), job))
+            self._start_workers()
+            return job.to_dict()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id)
+
+    def _start_workers(self):
+        # Started on first use so importing the app spawns no threads
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"jobs-worker-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _work(self):
+        while True:
+            _, _, job = self._queue.get()
+            with self._lock:
+                if job.status != QUEUED:
+                    continue
+                job.status = RUNNING
+                job.started_at = time.time()
+                self._queued -= 1
+
+            try:
+                self.store.finish(job, DONE, result=self.run(job.params))
+            except Exception as e:
+                self.store.finish(job, FAILED, error=str(e))
+            with self._lock:
+                del self._active[job.key]
+                self.stats["completed" if job.status == DONE else "failed"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["queued"] = self._queued
+            stats["running"] = len(self._active) - self._queued
+        stats["workers"] = self.workers
+        return stats
@@ -0,0 +1,324 @@
+import atexit
+import json
+import os
+import shlex
+import socket
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+import requests # type: ignore
+import config
+
+# llama-server log lines that mean the model did not fit on the GPU
+GPU_MEMORY_ERRORS = ("Insufficient Memory", "out of memory", "failed to allocate")
+
+
+class WorkerUnavailableError(RuntimeError):
+    """The local inference worker could not be started or reached"""
+
+
+class WorkerBusyError(RuntimeError):
+    """Every slot stayed busy for longer than the queue timeout"""
+
+
+def _free_port(host):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+class LlamaServerWorker:
+    """Long-lived llama-server process that keeps the model resident
+
+    The server is started on first use (or by warm_up) and answers
+    /completion requests over local HTTP. At most `parallel` requests run
+    at once, one per server slot; the rest wait in a queue for up to
+    `queue_timeout` seconds. A watchdog polls /health and restarts the
+    process when it dies or stops answering. If the model does not fit on
+    the GPU, the worker restarts on CPU and stays there.
+    """
+
+    def __init__(self, model_path, server_bin=None, host="127.0.0.1", port=0,
+                 parallel=None, ctx_size=None, gpu_layers=None, log_path=None,
+                 startup_timeout=None, queue_timeout=None, health_interval=None):
+        self.model_path = model_path
+        self.server_cmd = shlex.split(server_bin or config.LOCAL_LLM_SERVER_BIN)
+        self.host = host
+        self.port = port
+        self.parallel = parallel or config.LOCAL_LLM_PARALLEL
+        self.ctx_size = ctx_size or config.LOCAL_LLM_CTX_SIZE
+        self.gpu_layers = config.LOCAL_LLM_GPU_LAYERS if gpu_layers is None else gpu_layers
+        self.log_path = log_path if log_path is not None else config.LOCAL_LLM_LOG_PATH
+        self.startup_timeout = startup_timeout or config.LOCAL_LLM_STARTUP_TIMEOUT
+        self.queue_timeout = config.LOCAL_LLM_QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+        self.health_interval = config.LOCAL_LLM_HEALTH_INTERVAL if health_interval is None else health_interval
+
+        self.session = requests.Session()
+        self._process = None
+        self._url = None
+        self._log_offset = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.parallel)
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "errors": 0, "restarts": 0, "queued": 0, "active": 0, "busy_rejections": 0}
+        self._watchdog = None
+        self._stopped = threading.Event()
+        atexit.register(self.stop)
+
+    @property
+    def url(self):
+        return self._url
+
+    def warm_up(self, background=True):
+        """Start the server (and load the model) ahead of the first request"""
+        if background:
+            threading.Thread(target=self._warm_up_quietly, daemon=True).start()
+        else:
+            self.ensure_running()
+
+    def _warm_up_quietly(self):
+        try:
+            self.ensure_running()
+        except WorkerUnavailableError as e:
+            print(f"Local LLM worker failed to start: {e}")
+
+    def ensure_running(self):
+        """Start the server if it is not running"""
+        with self._lock:
+            if self._process is None or self._process.poll() is not None:
+                if self._process is not None:
+                    print(f"Local LLM worker exited with code {self._process.returncode}, restarting")
+                    self._record("restarts")
+                self._start()
+        if self.health_interval and self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watch, daemon=True)
+            self._watchdog.start()
+
+    def restart(self):
+        """Replace the server process"""
+        with self._lock:
+            self._terminate()
+            self._record("restarts")
+            self._start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            self._terminate()
+
+    def healthy(self):
+        """Whether the server answers /health with its model loaded"""
+        if not self._url:
+            return False
+        try:
+            return self.session.get(f"{self._url}/health", timeout=2).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["running"] = self._process is not None and self._process.poll() is None
+        stats["parallel"] = self.parallel
+        stats["gpu_layers"] = self.gpu_layers
+        return stats
+
+    def complete(self, prompt, n_predict, json_schema=None, on_usage=None):
+        """Blocking completion; returns the generated text
+
+        on_usage, if given, receives the prompt-cache token counts.
+        """
+        with self._slot():
+            response = self._post(self._payload(prompt, n_predict, json_schema, stream=False))
+            result = response.json()
+            if on_usage:
+                on_usage(self.usage_of(result))
+            return result.get("content", "")
+
+    def stream(self, prompt, n_predict, json_schema=None, on_usage=None):
+        """Yield generated text chunks; closing the generator cancels the request"""
+        with self._slot():
+            start = time.perf_counter()
+            first_token = None
+            last = None
+            response = self._post(self._payload(prompt, n_predict, json_schema, stream=True), stream=True)
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data: "):
+                        continue
+                    event = json.loads(line[len("data: "):])
+                    if event.get("timings"):
+                        last = event
+                    if event.get("content"):
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                        yield event["content"]
+                    if event.get("stop"):
+                        break
+            finally:
+                # Dropping the connection frees the server slot
+                response.close()
+                # Every event carries timings, so a cancelled stream still reports its usage
+                if on_usage and last:
+                    on_usage(self.usage_of(last, first_token))
+
+    @staticmethod
+    def usage_of(result, first_token_seconds=None):
+        """Token counts from a /completion result; prompt tokens found in the slot's KV cache are cache reads"""
+        timings = result.get("timings") or {}
+        uncached = timings.get("prompt_n", result.get("tokens_evaluated") or 0)
+        cached = timings.get("cache_n")
+        if cached is None:
+            cached = max((result.get("tokens_evaluated") or 0) - uncached, 0)
+        return {
+            "uncached_input_tokens": uncached,
+            "cache_read_tokens": cached,
+            "output_tokens": timings.get("predicted_n", result.get("tokens_predicted", 0)),
+            "first_token_seconds": first_token_seconds,
+        }
+
+    def _payload(self, prompt, n_predict, json_schema, stream):
+        payload = {
+            "prompt": prompt,
+            "n_predict": n_predict,
+            "temperature": 0.7,
+            "cache_prompt": True,  # Reuse the slot's KV cache for a shared prompt prefix
+            "stream": stream,
+            "timings_per_token": stream,
+        }
+        if json_schema:
+            # Grammar-constrained sampling keeps the answer valid JSON
+            payload["json_schema"] = json_schema
+        return payload
+
+    def _post(self, payload, stream=False):
+        """POST /completion, restarting a dead server and retrying once"""
+        self._record("requests")
+        for attempt in range(2):
+            self.ensure_running()
+            try:
+                response = self.session.post(
+                    f"{self._url}/completion", json=payload, stream=stream,
+                    timeout=(config.LOCAL_LLM_CONNECT_TIMEOUT, config.LOCAL_LLM_READ_TIMEOUT),
+                )
+                response.raise_for_status()
+                return response
+            except requests.ConnectionError as e:
+                if attempt:
+                    self._record("errors")
+                    raise WorkerUnavailableError(f"local LLM worker unreachable: {e}") from e
+            except requests.RequestException:
+                self._record("errors")
+                raise
+
+    @contextmanager
+    def _slot(self):
+        """Hold one server slot, waiting in the queue for up to queue_timeout"""
+        self._record("queued")
+        acquired = self._slots.acquire(timeout=self.queue_timeout)
+        self._record("queued", -1)
+        if not acquired:
+            self._record("busy_rejections")
+            raise WorkerBusyError(f"all {self.parallel} local LLM slots busy")
+        self._record("active")
+        try:
+            yield
+        finally:
+            self._record("active", -1)
+            self._slots.release()
+
+    def _record(self, key, delta=1):
+        with self._stats_lock:
+            self._stats[key] += delta
+
+    def _start(self):
+        """Launch the server and wait until the model is loaded (caller holds the lock)"""
+        if self._stopped.is_set():
+            raise WorkerUnavailableError("local LLM worker stopped")
+        if not os.path.exists(self.model_path):
+            raise WorkerUnavailableError(f"model not found at {self.model_path}")
+
+        port = self.port or _free_port(self.host)
+        cmd = self.server_cmd + [
+            "-m", self.model_path,
+            "--host", self.host,
+            "--port", str(port),
+            "--parallel", str(self.parallel),
+            # The context is split evenly between slots
+            "--ctx-size", str(self.ctx_size * self.parallel),
+            "-b", "512",
+        ]
+        if self.gpu_layers is not None:
+            cmd += ["--n-gpu-layers", str(self.gpu_layers)]
+
+        log = subprocess.DEVNULL
+        if self.log_path:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            log = open(self.log_path, "ab")
+            # Only this run's output is checked for GPU memory errors
+            self._log_offset = log.tell()
+        try:
+            self._process = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+        except OSError as e:
+            raise WorkerUnavailableError(f"cannot launch {cmd[0]}: {e}") from e
+        finally:
+            if log is not subprocess.DEVNULL:
+                log.close()
+        self._url = f"http://{self.host}:{port}"
+
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                if self.gpu_layers != 0 and self._gpu_memory_error():
+                    print("GPU memory insufficient, restarting local LLM worker on CPU...")
+                    self.gpu_layers = 0
+                    return self._start()
+                raise WorkerUnavailableError(
+                    f"llama-server exited with code {self._process.returncode}"
+                    + (f", see {self.log_path}" if self.log_path else "")
+                )
+            if self.healthy():
+                print(f"Local LLM worker ready at {self._url} ({self.parallel} slots)")
+                return
+            time.sleep(0.1)
+        self._terminate()
+        raise WorkerUnavailableError(f"llama-server not ready after {self.startup_timeout}s")
+
+    def _gpu_memory_error(self):
+        if not self.log_path or not os.path.exists(self.log_path):
+            return False
+        with open(self.log_path, "rb") as f:
+            f.seek(max(self._log_offset, os.path.getsize(self.log_path) - 16384))
+            tail = f.read().decode("utf-8", "replace")
+        return any(error in tail for error in GPU_MEMORY_ERRORS)
+
+    def _terminate(self):
+        process, self._process = self._process, None
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def _watch(self):
+        """Restart the server after consecutive failed health checks"""
+        failures = 0
+        while not self._stopped.wait(self.health_interval):
+            if self._process is None:
+                continue
+            if self.healthy():
+                failures = 0
+                continue
+            failures += 1
+            if self._process.poll() is not None or failures >= config.LOCAL_LLM_HEALTH_FAILURES:
+                print(f"Local LLM worker failed {failures} health check(s), restarting")
+                failures = 0
+                try:
+                    self.restart()
+                except WorkerUnavailableError as e:
+                    print(f"Local LLM worker restart failed: {e}")
@@ -0,0 +1,300 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import config
+from src import metrics
+from src.llm_client import answered_by, astream_from, provider_request, stream_from
+
+
+def is_error_response(response) -> bool:
+    """True for empty responses; clients raise LLMError for failed calls"""
+    return not isinstance(response, str) or not response.strip()
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse insignificant whitespace so equivalent prompts share a key"""
+    lines = (re.sub(r"[ \t]+", " ", line).strip() for line in prompt.strip().splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+class LLMResponseCache:
+    """In-process LRU in front of an optional SQLite store, with per-entry TTL"""
+
+    def __init__(self, path: Optional[str] = None, ttl: float = 24 * 3600,
+                 max_entries: int = 256, max_disk_entries: int = 10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.stats: Dict[str, int] = {
+            "memory_hits": 0, "disk_hits": 0, "misses": 0,
+            "stores": 0, "skipped_errors": 0, "evictions": 0,
+        }
+
+        if path:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_responses ("
+                " key TEXT PRIMARY KEY, provider TEXT, model TEXT, response TEXT,"
+                " expires_at REAL, last_access REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS llm_responses_access ON llm_responses (last_access)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(provider: Optional[str], model: Optional[str], prompt: str,
+                 max_tokens: Optional[int] = None, schema: Optional[Dict] = None) -> str:
+        """Cache key from provider, model, output cap, schema and the normalized prompt"""
+        material = normalize_prompt(prompt)
+        if schema:
+            material += "\n" + json.dumps(schema, sort_keys=True)
+        digest = hashlib.sha256(material.encode("utf-8")).hexdigest()
+        if max_tokens:
+            # A capped answer must not be served for an uncapped request
+            digest = f"{max_tokens}:{digest}"
+        return f"{provider}:{model}:{digest}"
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a fresh cached response or None"""
+        found = self.get_any([key])
+        return found[1] if found else None
+
+    def get_any(self, keys: Sequence[str]) -> Optional[Tuple[str, str]]:
+        """(key, response) for the first key with a fresh cached response, or None (one miss)"""
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                response = self._lookup(key, now)
+                if response is not None:
+                    return key, response
+            self.stats["misses"] += 1
+            return None
+
+    def _lookup(self, key: str, now: float) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            response, expires_at = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return response
+            del self._memory[key]
+
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT response, expires_at FROM llm_responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row and row[1] > now:
+                self._db.execute("UPDATE llm_responses SET last_access = ? WHERE key = ?", (now, key))
+                self._db.commit()
+                self._remember(key, row[0], row[1])
+                self.stats["disk_hits"] += 1
+                return row[0]
+            if row:
+                self._db.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                self._db.commit()
+        return None
+
+    def holds(self, key: str, response: str) -> bool:
+        """Whether the in-process LRU already has this fresh response for the key"""
+        with self._lock:
+            entry = self._memory.get(key)
+            return entry is not None and entry[0] == response and entry[1] > time.time()
+
+    def set(self, key: str, response: str, provider: Optional[str] = None,
+            model: Optional[str] = None, ttl: Optional[float] = None):
+        """Store a response unless it is empty"""
+        if is_error_response(response):
+            with self._lock:
+                self.stats["skipped_errors"] += 1
+            return
+
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remember(key, response, expires_at)
+            self.stats["stores"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, provider, model, response, expires_at, now),
+                )
+                self._prune_disk(now)
+                self._db.commit()
+
+    def _remember(self, key: str, response: str, expires_at: float):
+        """Insert into the in-memory LRU, evicting the least recently used"""
+        self._memory[key] = (response, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _prune_disk(self, now: float):
+        """Drop expired rows and keep the on-disk store under its size cap"""
+        self._db.execute("DELETE FROM llm_responses WHERE expires_at <= ?", (now,))
+        self._db.execute(
+            "DELETE FROM llm_responses WHERE key IN ("
+            " SELECT key FROM llm_responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+
+    def delete(self, key: str):
+        """Drop one cached response"""
+        with self._lock:
+            self._memory.pop(key, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                self._db.commit()
+    
+    def clear(self):
+        """Remove every cached response"""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_responses")
+                self._db.commit()
+
+
+class CachedLLMClient:
+    """Wrap any client exposing generate_recommendation(prompt) with a response cache
+
+    Answers are keyed on the provider that gave them. In front of a router,
+    a lookup tries each of its providers' keys in preference order, with
+    the prompt and schema built for that provider when `variants` has one.
+    """
+
+    def __init__(self, client, cache: Optional[LLMResponseCache] = None):
+        self.client = client
+        self.cache = cache or LLMResponseCache(
+            path=config.LLM_CACHE_PATH,
+            ttl=config.LLM_CACHE_TTL_SECONDS,
+            max_entries=config.LLM_CACHE_MAX_ENTRIES,
+            max_disk_entries=config.LLM_CACHE_MAX_DISK_ENTRIES,
+        )
+
+    def __getattr__(self, name):
+        # Expose the wrapped client's attributes (provider, model, ...)
+        return getattr(self.client, name)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return dict(self.cache.stats)
+
+    def _keys(self, prompt, max_tokens=None, schema=None, variants=None) -> List[Tuple[str, str, Optional[str]]]:
+        """(key, provider, model) for each provider that may answer, in preference order"""
+        clients = getattr(self.client, "clients", None) or [self.client]
+        keys = []
+        for client in clients:
+            provider = getattr(client, "provider", type(client).__name__)
+            model = getattr(client, "model", None)
+            text, options, _ = provider_request(provider, prompt, schema, None, variants)
+            keys.append((self.cache.make_key(provider, model, text, max_tokens, options), provider, model))
+        return keys
+
+    def _lookup(self, keys) -> Optional[str]:
+        return self._hit(keys, self.cache.get_any([key for key, _, _ in keys]))
+
+    async def _alookup(self, keys) -> Optional[str]:
+        # SQLite reads stay off the event loop
+        return self._hit(keys, await asyncio.to_thread(self.cache.get_any, [key for key, _, _ in keys]))
+
+    def _hit(self, keys, found: Optional[Tuple[str, str]]) -> Optional[str]:
+        # A hit counts as answered by the provider it was cached for; otherwise the router says
+        provider = next((provider for key, provider, _ in keys if found and key == found[0]), None)
+        answered_by.set(provider)
+        # A miss is counted against the provider the request would try first
+        metrics.count_cache_lookup(provider or keys[0][1], found is not None)
+        if found is None:
+            return None
+        metrics.set_labels(provider="cache")
+        return found[1]
+
+    def _answered(self, keys) -> Tuple[str, str, Optional[str]]:
+        """The key of the provider that just answered (the only one, without a router)"""
+        if len(keys) > 1:
+            provider = answered_by.get()
+            for entry in keys:
+                if entry[1] == provider:
+                    return entry
+        return keys[0]
+
+    def _options(self, variants, cached_prefix):
+        # The prefix only marks part of the prompt for provider caching; it is not part of the key
+        options = {"cached_prefix": cached_prefix} if cached_prefix else {}
+        if variants:
+            options["variants"] = variants
+        return options
+
+    def generate_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None, variants=None):
+        """Return a cached response, or call the wrapped client and cache it"""
+        keys = self._keys(prompt, max_tokens, schema, variants)
+        cached = self._lookup(keys)
+        if cached is not None:
+            return cached
+
+        if variants and not getattr(self.client, "routes_variants", False):
+            prompt, schema, cached_prefix = provider_request(keys[0][1], prompt, schema, cached_prefix, variants)
+            variants = None
+        response = self.client.generate_recommendation(
+            prompt, max_tokens=max_tokens, schema=schema, **self._options(variants, cached_prefix)
+        )
+        key, provider, model = self._answered(keys)
+        self.cache.set(key, response, provider=provider, model=model)
+        return response
+
+    def store(self, prompt, response, max_tokens=None, schema=None, variants=None):
+        """Cache an answer the caller stopped reading once it was complete"""
+        key, provider, model = self._answered(self._keys(prompt, max_tokens, schema, variants))
+        # A replayed cache hit is already stored
+        if not self.cache.holds(key, response):
+            self.cache.set(key, response, provider=provider, model=model)
+
+    def invalidate(self, prompt, max_tokens=None, schema=None, variants=None):
+        """Forget the cached responses for a request (e.g. it failed validation)"""
+        for key, _, _ in self._keys(prompt, max_tokens, schema, variants):
+            self.cache.delete(key)
+    
+    def stream_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None, variants=None):
+        """Stream from the wrapped client, replaying cached responses in one chunk"""
+        keys = self._keys(prompt, max_tokens, schema, variants)
+        cached = self._lookup(keys)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        for chunk in stream_from(self.client, prompt, max_tokens, schema, cached_prefix, variants):
+            chunks.append(chunk)
+            yield chunk
+        # Only a fully consumed stream is worth caching
+        key, provider, model = self._answered(keys)
+        self.cache.set(key, "".join(chunks), provider=provider, model=model)
+    
+    async def astream_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None, variants=None):
+        """Async counterpart of stream_recommendation; cache reads and writes run in a worker thread"""
+        keys = self._keys(prompt, max_tokens, schema, variants)
+        cached = await self._alookup(keys)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        async for chunk in astream_from(self.client, prompt, max_tokens, schema, cached_prefix, variants):
+            chunks.append(chunk)
+            yield chunk
+        key, provider, model = self._answered(keys)
+        await asyncio.to_thread(self.cache.set, key, "".join(chunks), provider=provider, model=model)
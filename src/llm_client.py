@@ -1,19 +1,134 @@
+import asyncio
+import json
+import time
+from contextvars import ContextVar
+import httpx
 import openai
 import config
+from src.llm_usage import TokenUsageLog
+
+# Returned by next() when a stream read in a worker thread is exhausted
+_END = object()
+
+
+class LLMError(RuntimeError):
+    """Raised when an LLM provider fails to produce a response"""
+
+    def __init__(self, message, provider=None):
+        super().__init__(message)
+        self.provider = provider
+
+
+class LLMUnavailableError(LLMError):
+    """Raised when no provider may be called, e.g. every circuit breaker is open"""
+
+
+# The provider whose answer a router picked last in this context, so a
+# wrapper around the router can tell who answered (e.g. for its cache key)
+answered_by: ContextVar = ContextVar("llm_answered_by", default=None)
+
+
+def _stream_options(max_tokens, schema, cached_prefix):
+    # Only pass the options that are set, so minimal clients keep working
+    options = {}
+    if max_tokens:
+        options["max_tokens"] = max_tokens
+    if schema:
+        options["schema"] = schema
+    if cached_prefix:
+        options["cached_prefix"] = cached_prefix
+    return options
+
+
+def provider_request(provider, prompt, schema=None, cached_prefix=None, variants=None):
+    """(prompt, schema, cached_prefix) built for a provider, from `variants` when it has its own"""
+    variant = (variants or {}).get(provider)
+    if not variant:
+        return prompt, schema, cached_prefix
+    return variant["prompt"], variant.get("schema"), variant.get("cached_prefix")
+
+
+def _request(client, prompt, max_tokens, schema, cached_prefix, variants):
+    """The prompt and options to send a client: a router gets every variant, others their own"""
+    if variants and getattr(client, "routes_variants", False):
+        options = _stream_options(max_tokens, schema, cached_prefix)
+        options["variants"] = variants
+        return prompt, options
+    prompt, schema, cached_prefix = provider_request(
+        getattr(client, "provider", None), prompt, schema, cached_prefix, variants
+    )
+    return prompt, _stream_options(max_tokens, schema, cached_prefix)
+
+
+def stream_from(client, prompt, max_tokens=None, schema=None, cached_prefix=None, variants=None):
+    """Stream a response from any client, falling back to one blocking call
+
+    `variants` maps provider names to the prompt, schema and cached_prefix
+    built for that provider, for when a router may send the request to
+    more than one.
+    """
+    prompt, options = _request(client, prompt, max_tokens, schema, cached_prefix, variants)
+    if hasattr(client, "stream_recommendation"):
+        return client.stream_recommendation(prompt, **options)
+    return iter([client.generate_recommendation(prompt, **options)])
+
+
+async def astream_from(client, prompt, max_tokens=None, schema=None, cached_prefix=None, variants=None):
+    """Async stream from any client; clients without async support are read in a worker thread"""
+    if hasattr(client, "astream_recommendation"):
+        prompt, options = _request(client, prompt, max_tokens, schema, cached_prefix, variants)
+        stream = client.astream_recommendation(prompt, **options)
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            # Closing the stream stops the provider from generating further
+            await stream.aclose()
+        return
+    stream = stream_from(client, prompt, max_tokens, schema, cached_prefix, variants)
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, stream, _END)
+            if chunk is _END:
+                break
+            yield chunk
+    finally:
+        close = getattr(stream, "close", None)
+        if close:
+            close()
+
+
+def _usage_field(usage, name):
+    """A usage field; those the pinned OpenAI SDK does not model yet arrive as plain dicts"""
+    return usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+
 
 class LLMClient:
     """Interface for LLM API interactions"""
     
+    TOOL_NAME = "recommend"  # Forced tool/function call used for structured output
+    
+    MODELS = {
+        'openai': config.OPENAI_MODEL,
+        'anthropic': config.ANTHROPIC_MODEL,
+        'gemini': config.GEMINI_MODEL,
+    }
+    
     def __init__(self, provider=config.LLM_PROVIDER):
         self.provider = provider
+        self.openai_client = None
+        self.async_openai_client = None
         self.anthropic_client = None
+        self.async_anthropic_client = None
+        self.usage = TokenUsageLog()
         
         if provider == 'openai':
-            openai.api_key = config.OPENAI_API_KEY
+            pass  # Clients are created on first use, see _openai_clients
         elif provider == 'anthropic':
             try:
                 import anthropic
                 self.anthropic_client = anthropic.Anthropic(api_key=config.ANTHROPIC_API_KEY)
+                self.async_anthropic_client = anthropic.AsyncAnthropic(api_key=config.ANTHROPIC_API_KEY)
             except ImportError:
                 print("Anthropic library not installed. Install with: pip install anthropic")
                 print("Falling back to OpenAI provider.")
@@ -32,52 +147,375 @@ class LLMClient:
         else:
             raise ValueError(f"Unsupported LLM provider: {provider}")
     
-    def generate_recommendation(self, prompt):
-        """Generate recommendations using the configured LLM"""
+    @property
+    def model(self):
+        """Model name for the active provider (it may have fallen back)"""
+        return self.MODELS.get(self.provider)
+    
+    def generate_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None):
+        """Generate recommendations using the configured LLM
+
+        max_tokens caps the answer; with a JSON schema, the provider's
+        structured-output mechanism constrains it and JSON text is returned.
+        cached_prefix is the static start of the prompt, marked for the
+        provider's prompt cache. Token usage is recorded in self.usage.
+        """
         if self.provider == 'openai':
-            return self._generate_with_openai(prompt)
+            return self._generate_with_openai(prompt, max_tokens, schema)
         elif self.provider == 'anthropic':
-            return self._generate_with_anthropic(prompt)
+            return self._generate_with_anthropic(prompt, max_tokens, schema, cached_prefix)
         elif self.provider == 'gemini':
-            return self._generate_with_gemini(prompt)
+            return self._generate_with_gemini(prompt, max_tokens, schema)
     
-    def _generate_with_openai(self, prompt):
+    def stream_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None):
+        """Yield the configured LLM's response as text chunks while it is generated"""
+        # OpenAI and Gemini cache long shared prefixes automatically
+        if self.provider == 'openai':
+            return self._stream_with_openai(prompt, max_tokens, schema)
+        elif self.provider == 'anthropic':
+            return self._stream_with_anthropic(prompt, max_tokens, schema, cached_prefix)
+        elif self.provider == 'gemini':
+            return self._stream_with_gemini(prompt, max_tokens, schema)
+    
+    def astream_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None):
+        """Async counterpart of stream_recommendation; waiting on the provider holds no thread"""
+        if self.provider == 'openai':
+            return self._astream_with_openai(prompt, max_tokens, schema)
+        elif self.provider == 'anthropic':
+            return self._astream_with_anthropic(prompt, max_tokens, schema, cached_prefix)
+        elif self.provider == 'gemini':
+            return self._astream_with_gemini(prompt, max_tokens, schema)
+    
+    def _anthropic_prompt(self, prompt, cached_prefix):
+        """System and messages arguments; the static prefix becomes a cache-marked system block
+
+        The user message stays a plain string: the SDK checks content blocks
+        against every block type on each request, system blocks only as text.
+        """
+        system_prompt = "You are Bob, a whisky expert who specializes in personalized recommendations."
+        if cached_prefix and prompt.startswith(cached_prefix) and len(prompt) > len(cached_prefix):
+            system = [
+                {"type": "text", "text": system_prompt},
+                {"type": "text", "text": cached_prefix, "cache_control": {"type": "ephemeral"}},
+            ]
+            prompt = prompt[len(cached_prefix):]
+        else:
+            system = system_prompt
+        return {"system": system, "messages": [{"role": "user", "content": prompt}]}
+    
+    def _record_anthropic_usage(self, usage, output_tokens=None, first_token_seconds=None):
+        self.usage.record(
+            uncached_input_tokens=usage.input_tokens,
+            cache_read_tokens=getattr(usage, "cache_read_input_tokens", 0),
+            cache_write_tokens=getattr(usage, "cache_creation_input_tokens", 0),
+            output_tokens=usage.output_tokens if output_tokens is None else output_tokens,
+            first_token_seconds=first_token_seconds,
+            provider=self.provider,
+        )
+    
+    def _openai_clients(self):
+        """(sync, async) OpenAI clients, created on first use so a missing key fails the request, not startup"""
+        if self.openai_client is None:
+            # Explicit httpx clients: the pinned SDK's defaults pass an argument httpx 0.28 dropped
+            self.openai_client = openai.OpenAI(api_key=config.OPENAI_API_KEY, http_client=httpx.Client())
+            self.async_openai_client = openai.AsyncOpenAI(api_key=config.OPENAI_API_KEY, http_client=httpx.AsyncClient())
+        return self.openai_client, self.async_openai_client
+    
+    def _openai_request(self, prompt, max_tokens, schema, stream=False):
+        """Keyword arguments for chat.completions.create"""
+        request = dict(
+            model=config.OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": "You are Bob, a whisky expert who specializes in personalized recommendations."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7,
+            **self._openai_options(max_tokens, schema)
+        )
+        if stream:
+            # Usage then arrives in a final chunk with no choices; passed as
+            # extra_body since the pinned SDK predates the stream_options argument
+            request["stream"] = True
+            request["extra_body"] = {"stream_options": {"include_usage": True}}
+        return request
+    
+    def _record_openai_usage(self, usage, first_token_seconds=None):
+        details = _usage_field(usage, "prompt_tokens_details") or {}
+        cached = _usage_field(details, "cached_tokens") or 0
+        self.usage.record(
+            uncached_input_tokens=(_usage_field(usage, "prompt_tokens") or 0) - cached,
+            cache_read_tokens=cached,
+            output_tokens=_usage_field(usage, "completion_tokens") or 0,
+            first_token_seconds=first_token_seconds,
+            provider=self.provider,
+        )
+    
+    def _record_gemini_usage(self, metadata, first_token_seconds=None):
+        cached = getattr(metadata, "cached_content_token_count", 0) or 0
+        self.usage.record(
+            uncached_input_tokens=(getattr(metadata, "prompt_token_count", 0) or 0) - cached,
+            cache_read_tokens=cached,
+            output_tokens=getattr(metadata, "candidates_token_count", 0),
+            first_token_seconds=first_token_seconds,
+            provider=self.provider,
+        )
+    
+    def _anthropic_event_text(self, event, schema):
+        """Answer text carried by one raw stream event, if any"""
+        if event.type != "content_block_delta":
+            return None
+        # With a schema, the tool input arrives as partial JSON deltas
+        if schema and event.delta.type == "input_json_delta":
+            return event.delta.partial_json
+        if not schema and event.delta.type == "text_delta":
+            return event.delta.text
+        return None
+    
+    def _openai_chunk_text(self, chunk, schema):
+        """Answer text carried by one stream chunk, if any"""
+        if not chunk.choices:
+            return None
+        delta = chunk.choices[0].delta
+        if schema:
+            return delta.tool_calls[0].function.arguments if delta.tool_calls else None
+        return delta.content
+    
+    def _openai_options(self, max_tokens, schema):
+        """Request options; a schema becomes a forced function tool call"""
+        options = {"max_tokens": max_tokens or config.LLM_MAX_TOKENS}
+        if schema:
+            options["tools"] = [{"type": "function", "function": {
+                "name": self.TOOL_NAME, "description": "Return the recommendations", "parameters": schema}}]
+            options["tool_choice"] = {"type": "function", "function": {"name": self.TOOL_NAME}}
+        return options
+    
+    def _anthropic_options(self, max_tokens, schema):
+        """Request options; a schema becomes a forced tool call"""
+        options = {"max_tokens": max_tokens or config.LLM_MAX_TOKENS}
+        if schema:
+            # Sent as extra_body, which the SDK serialises as is; as typed arguments it walks
+            # the whole schema against its TypedDicts on every request
+            options["extra_body"] = {
+                "tools": [{"name": self.TOOL_NAME, "description": "Return the recommendations", "input_schema": schema}],
+                "tool_choice": {"type": "tool", "name": self.TOOL_NAME},
+            }
+        return options
+    
+    def _gemini_config(self, max_tokens, schema):
+        """Generation config; a schema switches on JSON mode"""
+        generation_config = {"max_output_tokens": max_tokens or config.LLM_MAX_TOKENS}
+        if schema:
+            generation_config["response_mime_type"] = "application/json"
+            generation_config["response_schema"] = schema
+        return generation_config
+    
+    def _generate_with_openai(self, prompt, max_tokens=None, schema=None):
         """Generate recommendations using OpenAI API"""
         try:
-            response = openai.ChatCompletion.create(
-                model=config.OPENAI_MODEL,
-                messages=[
-                    {"role": "system", "content": "You are Bob, a whisky expert who specializes in personalized recommendations."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7
-            )
-            return response.choices[0].message.content
+            client, _ = self._openai_clients()
+            response = client.chat.completions.create(**self._openai_request(prompt, max_tokens, schema))
+            message = response.choices[0].message
+            text = message.tool_calls[0].function.arguments if schema else message.content
+            if response.usage:
+                self._record_openai_usage(response.usage)
+            else:
+                self.usage.record_estimate(prompt, text, provider=self.provider)
+            return text
         except Exception as e:
-            print(f"Error generating recommendations with OpenAI: {e}")
-            return "Error generating recommendations. Please try again later."
+            raise LLMError(f"Error generating recommendations with OpenAI: {e}", self.provider) from e
     
-    def _generate_with_anthropic(self, prompt):
+    def _generate_with_anthropic(self, prompt, max_tokens=None, schema=None, cached_prefix=None):
         """Generate recommendations using Anthropic API"""
         try:
-            system_prompt = "You are Bob, a whisky expert who specializes in personalized recommendations."
             response = self.anthropic_client.messages.create(
                 model=config.ANTHROPIC_MODEL,
-                system=system_prompt,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=2000
+                **self._anthropic_prompt(prompt, cached_prefix),
+                **self._anthropic_options(max_tokens, schema)
             )
+            self._record_anthropic_usage(response.usage)
+            if schema:
+                tool_use = next(block for block in response.content if block.type == "tool_use")
+                return json.dumps(tool_use.input)
             return response.content[0].text
         except Exception as e:
-            print(f"Error generating recommendations with Anthropic: {e}")
-            return "Error generating recommendations. Please try again later."
+            raise LLMError(f"Error generating recommendations with Anthropic: {e}", self.provider) from e
     
-    def _generate_with_gemini(self, prompt):
+    def _generate_with_gemini(self, prompt, max_tokens=None, schema=None):
         """Generate recommendations using Gemini API"""
         try:
             full_prompt = "You are Bob, a whisky expert who specializes in personalized recommendations.\n\n" + prompt
-            response = self.gemini_model.generate_content(full_prompt)
+            response = self.gemini_model.generate_content(
+                full_prompt, generation_config=self._gemini_config(max_tokens, schema)
+            )
+            if getattr(response, "usage_metadata", None):
+                self._record_gemini_usage(response.usage_metadata)
+            else:
+                self.usage.record_estimate(full_prompt, response.text, provider=self.provider)
             return response.text
         except Exception as e:
-            print(f"Error generating recommendations with Gemini: {e}")
-            return "Error generating recommendations. Please try again later."
+            raise LLMError(f"Error generating recommendations with Gemini: {e}", self.provider) from e
+    
+    def _stream_with_openai(self, prompt, max_tokens=None, schema=None):
+        """Stream recommendations from OpenAI API"""
+        try:
+            client, _ = self._openai_clients()
+            response = client.chat.completions.create(**self._openai_request(prompt, max_tokens, schema, stream=True))
+            start = time.perf_counter()
+            first_token = None
+            reported = False
+            answer = []
+            for chunk in response:
+                usage = getattr(chunk, "usage", None)
+                if usage:
+                    reported = True
+                    # The final chunk carries usage and no choices
+                    self._record_openai_usage(usage, first_token)
+                text = self._openai_chunk_text(chunk, schema)
+                if text:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    answer.append(text)
+                    yield text
+            if not reported:
+                # e.g. a proxy that drops stream_options
+                self.usage.record_estimate(prompt, "".join(answer), first_token, self.provider)
+        except Exception as e:
+            raise LLMError(f"Error streaming recommendations with OpenAI: {e}", self.provider) from e
+    
+    def _stream_with_anthropic(self, prompt, max_tokens=None, schema=None, cached_prefix=None):
+        """Stream recommendations from Anthropic API"""
+        try:
+            start = time.perf_counter()
+            # Raw events: the stream() helper rebuilds a message snapshot on every event
+            with self.anthropic_client.messages.create(
+                model=config.ANTHROPIC_MODEL,
+                stream=True,
+                **self._anthropic_prompt(prompt, cached_prefix),
+                **self._anthropic_options(max_tokens, schema)
+            ) as stream:
+                usage = None
+                output_tokens = 0
+                first_token = None
+                try:
+                    for event in stream:
+                        if event.type == "message_start":
+                            # Input and cache token counts arrive up front
+                            usage = event.message.usage
+                        elif event.type == "message_delta":
+                            output_tokens = event.usage.output_tokens
+                        text = self._anthropic_event_text(event, schema)
+                        if text:
+                            if first_token is None:
+                                first_token = time.perf_counter() - start
+                            yield text
+                finally:
+                    if usage is not None:
+                        self._record_anthropic_usage(usage, output_tokens, first_token)
+        except Exception as e:
+            raise LLMError(f"Error streaming recommendations with Anthropic: {e}", self.provider) from e
+    
+    def _stream_with_gemini(self, prompt, max_tokens=None, schema=None):
+        """Stream recommendations from Gemini API"""
+        try:
+            full_prompt = "You are Bob, a whisky expert who specializes in personalized recommendations.\n\n" + prompt
+            generation_config = self._gemini_config(max_tokens, schema)
+            start = time.perf_counter()
+            first_token = None
+            metadata = None
+            answer = []
+            for chunk in self.gemini_model.generate_content(full_prompt, generation_config=generation_config, stream=True):
+                # Each chunk carries the running usage; the last one has the totals
+                metadata = getattr(chunk, "usage_metadata", None) or metadata
+                if chunk.text:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    answer.append(chunk.text)
+                    yield chunk.text
+            if metadata:
+                self._record_gemini_usage(metadata, first_token)
+            else:
+                self.usage.record_estimate(full_prompt, "".join(answer), first_token, self.provider)
+        except Exception as e:
+            raise LLMError(f"Error streaming recommendations with Gemini: {e}", self.provider) from e
+    
+    async def _astream_with_openai(self, prompt, max_tokens=None, schema=None):
+        """Stream recommendations from OpenAI API without blocking the event loop"""
+        try:
+            _, client = self._openai_clients()
+            response = await client.chat.completions.create(**self._openai_request(prompt, max_tokens, schema, stream=True))
+            start = time.perf_counter()
+            first_token = None
+            reported = False
+            answer = []
+            async for chunk in response:
+                usage = getattr(chunk, "usage", None)
+                if usage:
+                    reported = True
+                    self._record_openai_usage(usage, first_token)
+                text = self._openai_chunk_text(chunk, schema)
+                if text:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    answer.append(text)
+                    yield text
+            if not reported:
+                # e.g. a proxy that drops stream_options
+                self.usage.record_estimate(prompt, "".join(answer), first_token, self.provider)
+        except Exception as e:
+            raise LLMError(f"Error streaming recommendations with OpenAI: {e}", self.provider) from e
+    
+    async def _astream_with_anthropic(self, prompt, max_tokens=None, schema=None, cached_prefix=None):
+        """Stream recommendations from Anthropic API without blocking the event loop"""
+        try:
+            start = time.perf_counter()
+            stream = await self.async_anthropic_client.messages.create(
+                model=config.ANTHROPIC_MODEL,
+                stream=True,
+                **self._anthropic_prompt(prompt, cached_prefix),
+                **self._anthropic_options(max_tokens, schema)
+            )
+            async with stream:
+                usage = None
+                output_tokens = 0
+                first_token = None
+                try:
+                    async for event in stream:
+                        if event.type == "message_start":
+                            usage = event.message.usage
+                        elif event.type == "message_delta":
+                            output_tokens = event.usage.output_tokens
+                        text = self._anthropic_event_text(event, schema)
+                        if text:
+                            if first_token is None:
+                                first_token = time.perf_counter() - start
+                            yield text
+                finally:
+                    if usage is not None:
+                        self._record_anthropic_usage(usage, output_tokens, first_token)
+        except Exception as e:
+            raise LLMError(f"Error streaming recommendations with Anthropic: {e}", self.provider) from e
+    
+    async def _astream_with_gemini(self, prompt, max_tokens=None, schema=None):
+        """Stream recommendations from Gemini API without blocking the event loop"""
+        try:
+            full_prompt = "You are Bob, a whisky expert who specializes in personalized recommendations.\n\n" + prompt
+            response = await self.gemini_model.generate_content_async(
+                full_prompt, generation_config=self._gemini_config(max_tokens, schema), stream=True
+            )
+            start = time.perf_counter()
+            first_token = None
+            metadata = None
+            answer = []
+            async for chunk in response:
+                metadata = getattr(chunk, "usage_metadata", None) or metadata
+                if chunk.text:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    answer.append(chunk.text)
+                    yield chunk.text
+            if metadata:
+                self._record_gemini_usage(metadata, first_token)
+            else:
+                self.usage.record_estimate(full_prompt, "".join(answer), first_token, self.provider)
+        except Exception as e:
+            raise LLMError(f"Error streaming recommendations with Gemini: {e}", self.provider) from e
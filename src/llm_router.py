@@ -0,0 +1,428 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import config
+from src import metrics
+from src.llm_client import LLMClient, LLMError, LLMUnavailableError, answered_by, astream_from, stream_from
+from src.llm_usage import TokenUsageLog
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+
+def make_provider_client(name: str):
+    """The client for one provider name from config.LLM_PROVIDERS"""
+    if name in LLMClient.MODELS:
+        return LLMClient(provider=name)
+    if name == 'huggingface':
+        from src.remote_llm_client import RemoteLLMClient
+        return RemoteLLMClient()
+    if name == 'local':
+        from src.local_llm_client import LocalLLMClient
+        return LocalLLMClient()
+    raise ValueError(f"Unsupported LLM provider: {name}")
+
+
+def build_llm_client(providers: Sequence[str]):
+    """One provider's client, or an LLMRouter over several (in order of preference)"""
+    clients = [make_provider_client(name) for name in providers]
+    if not clients:
+        raise ValueError("No LLM providers configured")
+    return clients[0] if len(clients) == 1 else LLMRouter(clients)
+
+
+class ProviderHealth:
+    """Rolling latency and error rate of one provider, plus its circuit breaker
+
+    Latency is measured to the first chunk of the answer (the whole answer
+    for clients that do not stream); an attempt cancelled because another
+    provider answered first adds the time it had waited, when that is
+    already beyond the p95. The circuit opens after too many failures, in
+    a row or as a share of recent calls; once the cooldown has passed a
+    single probe call is let through, and its outcome closes or reopens
+    the circuit.
+    """
+
+    def __init__(self, name: str, window: Optional[int] = None):
+        self.name = name
+        window = window or config.LLM_ROUTER_WINDOW
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.opened_at: Optional[float] = None
+        self._probe_started: Optional[float] = None
+        self._consecutive_failures = 0
+        self.counts = {"calls": 0, "failures": 0, "trips": 0, "rejected": 0, "cancelled": 0}
+
+    def allow(self) -> bool:
+        """Whether a call may go to this provider now (claims the probe of a half-open circuit)"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN and now - self.opened_at >= config.LLM_BREAKER_COOLDOWN_SECONDS:
+                self.state = HALF_OPEN
+                self._probe_started = None
+            if self.state == HALF_OPEN:
+                # One probe at a time; an abandoned probe is replaced after a cooldown
+                if self._probe_started is None or now - self._probe_started >= config.LLM_BREAKER_COOLDOWN_SECONDS:
+                    self._probe_started = now
+                    return True
+            elif self.state == CLOSED:
+                return True
+            self.counts["rejected"] += 1
+            return False
+
+    @property
+    def available(self) -> bool:
+        """Whether allow() could succeed, without claiming anything"""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= config.LLM_BREAKER_COOLDOWN_SECONDS
+            return True
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self.counts["calls"] += 1
+            self._latencies.append(latency)
+            self._outcomes.append(True)
+            self._consecutive_failures = 0
+            # Only the probe closes an open circuit, not a call that started before it opened
+            if self.state == HALF_OPEN:
+                self.state = CLOSED
+                self._outcomes.clear()
+                self._outcomes.append(True)
+
+    def record_cancelled(self, elapsed: float):
+        """A losing attempt stopped before its first chunk: its latency was at least `elapsed`"""
+        p95 = self.percentile(config.LLM_HEDGE_PERCENTILE)
+        with self._lock:
+            self.counts["cancelled"] += 1
+            # A lower bound past the p95 says the provider is at least that slow, so it is kept
+            # and slow stretches still raise the hedge delay; a shorter wait says nothing
+            if p95 is None or elapsed >= p95:
+                self._latencies.append(elapsed)
+
+    def record_failure(self):
+        with self._lock:
+            self.counts["calls"] += 1
+            self.counts["failures"] += 1
+            self._outcomes.append(False)
+            self._consecutive_failures += 1
+            calls = len(self._outcomes)
+            error_rate = self._outcomes.count(False) / calls
+            if self.state == HALF_OPEN or (self.state == CLOSED and (
+                    self._consecutive_failures >= config.LLM_BREAKER_CONSECUTIVE_FAILURES
+                    or (calls >= config.LLM_BREAKER_MIN_CALLS and error_rate >= config.LLM_BREAKER_ERROR_RATE))):
+                if self.state == CLOSED:
+                    print(f"LLM provider {self.name}: circuit opened ({self._consecutive_failures} failures in a row, "
+                          f"error rate {error_rate:.0%})")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.counts["trips"] += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+
+    def hedge_delay(self) -> float:
+        """How long to wait for this provider before hedging to the next one"""
+        with self._lock:
+            samples = len(self._latencies)
+        if samples < config.LLM_HEDGE_MIN_SAMPLES:
+            return config.LLM_HEDGE_DEFAULT_SECONDS
+        return max(config.LLM_HEDGE_MIN_SECONDS, self.percentile(config.LLM_HEDGE_PERCENTILE))
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            outcomes = list(self._outcomes)
+            state = self.state
+            counts = dict(self.counts)
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "state": state,
+            "error_rate": round(outcomes.count(False) / len(outcomes), 4) if outcomes else 0.0,
+            "p50_seconds": round(p50, 4) if p50 is not None else None,
+            "p95_seconds": round(p95, 4) if p95 is not None else None,
+            **counts,
+        }
+
+
+class _Race:
+    """Bookkeeping for one routed request: which providers were tried, hedged and failed"""
+
+    def __init__(self, router: "LLMRouter"):
+        self.router = router
+        self._order = iter(range(len(router.clients)))
+        self.attempts: List[Dict] = []
+        self.errors: List[str] = []
+        self.hedged = False
+
+    def next_provider(self) -> Optional[int]:
+        """Index of the next provider in preference order whose circuit lets a call through"""
+        for index in self._order:
+            if self.router.health[index].allow():
+                return index
+        return None
+
+    def hedge_deadline(self) -> Optional[float]:
+        """When to hedge: the first attempt's start plus its provider's hedge delay (once per request)"""
+        if self.hedged or len(self.attempts) != 1:
+            return None
+        first = self.attempts[0]
+        return first["started"] + self.router.health[first["index"]].hedge_delay()
+
+    def started(self, index: int, hedge: bool = False) -> Dict:
+        attempt = {"index": index, "started": time.monotonic(), "done": False, "hedge": hedge}
+        if self.attempts:
+            self.router._count("hedged" if hedge else "failovers")
+        self.attempts.append(attempt)
+        return attempt
+
+    def succeeded(self, attempt: Dict):
+        self.router.health[attempt["index"]].record_success(time.monotonic() - attempt["started"])
+        answered_by.set(self.router.health[attempt["index"]].name)
+        if self.hedged and len(self.attempts) > 1:
+            self.router._count("hedge_wins" if attempt["hedge"] else "primary_wins")
+
+    def losers(self, winner: Dict) -> List[Dict]:
+        """Mark every other attempt still waiting as cancelled and return them"""
+        cancelled = []
+        for attempt in self.attempts:
+            if attempt is not winner and not attempt["done"]:
+                attempt["done"] = True
+                self.router.health[attempt["index"]].record_cancelled(time.monotonic() - attempt["started"])
+                cancelled.append(attempt)
+        return cancelled
+
+    def failed(self, attempt: Dict, error: BaseException):
+        attempt["done"] = True
+        health = self.router.health[attempt["index"]]
+        health.record_failure()
+        self.errors.append(f"{health.name}: {error}")
+
+    def running(self) -> bool:
+        return any(not attempt["done"] for attempt in self.attempts)
+
+    def exhausted(self) -> LLMError:
+        if not self.errors:
+            self.router._count("rejected")
+            return LLMUnavailableError("No LLM provider available: every circuit is open")
+        self.router._count("failed")
+        return LLMError("All LLM providers failed: " + "; ".join(self.errors))
+
+
+class LLMRouter:
+    """Route LLM calls over several providers with hedging, failover and circuit breakers
+
+    Calls go to the first provider, in preference order, whose circuit is
+    not open. If it has not answered within its recent p95 latency, the
+    same request is also sent to the next provider and whichever answers
+    first is used; the other stream is closed (a client that cannot stream
+    has its late answer dropped). A failed call moves on to the next
+    provider. When no provider is left, LLMError (LLMUnavailableError if
+    none could be tried) is raised rather than an error string returned.
+    Given `variants`, each attempt sends the prompt, schema and cached
+    prefix built for its own provider.
+    """
+
+    # stream_from hands a router the requests built for each of its providers
+    routes_variants = True
+
+    def __init__(self, clients: Sequence):
+        self.clients = list(clients)
+        self.health = [ProviderHealth(getattr(client, "provider", type(client).__name__)) for client in self.clients]
+        # One usage log for whichever providers answer
+        self.usage = TokenUsageLog()
+        for client in self.clients:
+            if hasattr(client, "usage"):
+                client.usage = self.usage
+        self._lock = threading.Lock()
+        self.counts = {
+            "requests": 0, "hedged": 0, "hedge_wins": 0, "primary_wins": 0, "failovers": 0, "failed": 0, "rejected": 0,
+        }
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _primary(self):
+        for client, health in zip(self.clients, self.health):
+            if health.available:
+                return client
+        return self.clients[0]
+
+    @property
+    def providers(self) -> List[str]:
+        """Provider names in preference order"""
+        return [health.name for health in self.health]
+
+    @property
+    def provider(self):
+        """The provider a call would go to first"""
+        return getattr(self._primary(), "provider", None)
+
+    @property
+    def model(self):
+        return getattr(self._primary(), "model", None)
+
+    def provider_stats(self) -> Dict:
+        """Router counters plus per-provider circuit state, error rate and latency percentiles"""
+        with self._lock:
+            stats = dict(self.counts)
+        stats["providers"] = {health.name: health.snapshot() for health in self.health}
+        return stats
+
+    def generate_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None, variants=None):
+        """The whole answer from the first provider to respond"""
+        return "".join(self.stream_recommendation(prompt, max_tokens, schema, cached_prefix, variants))
+
+    def stream_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None,
+                              variants=None) -> Iterator[str]:
+        """Yield the answer of the first provider to respond, hedging and failing over as needed"""
+        self._count("requests")
+        race = _Race(self)
+        events: "queue.Queue" = queue.Queue()
+        cancelled: Dict[int, threading.Event] = {}
+
+        def read(attempt, client, stop):
+            stream = stream_from(client, prompt, max_tokens, schema, cached_prefix, variants)
+            try:
+                for chunk in stream:
+                    if stop.is_set():
+                        return
+                    if chunk:
+                        events.put((attempt, "chunk", chunk))
+                events.put((attempt, "end", None))
+            except Exception as e:
+                events.put((attempt, "error", e))
+            finally:
+                close = getattr(stream, "close", None)
+                if close:
+                    close()
+
+        def launch(hedge=False) -> bool:
+            index = race.next_provider()
+            if index is None:
+                return False
+            attempt = race.started(index, hedge)
+            cancelled[id(attempt)] = stop = threading.Event()
+            # In the request's context, so token usage is counted under its labels
+            threading.Thread(target=contextvars.copy_context().run, args=(read, attempt, self.clients[index], stop),
+                             name=f"llm-{self.health[index].name}", daemon=True).start()
+            return True
+
+        if not launch():
+            raise race.exhausted()
+        winner = None
+        try:
+            while winner is None:
+                deadline = race.hedge_deadline()
+                try:
+                    timeout = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+                    attempt, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    race.hedged = True
+                    launch(hedge=True)
+                    continue
+                if attempt["done"]:
+                    continue
+                if kind == "chunk":
+                    winner = attempt
+                    race.succeeded(attempt)
+                    metrics.set_labels(provider=self.health[attempt["index"]].name)
+                    # Stop the other provider; its thread closes the stream at its next chunk
+                    for other in race.losers(winner):
+                        cancelled[id(other)].set()
+                    yield payload
+                    break
+                race.failed(attempt, payload if kind == "error" else LLMError("empty response"))
+                if not race.running() and not launch():
+                    raise race.exhausted()
+
+            while True:
+                attempt, kind, payload = events.get()
+                if attempt is not winner:
+                    continue
+                if kind == "chunk":
+                    yield payload
+                elif kind == "end":
+                    return
+                else:
+                    race.failed(attempt, payload)
+                    raise LLMError(f"{self.health[attempt['index']].name} failed mid-answer: {payload}") from payload
+        finally:
+            for stop in cancelled.values():
+                stop.set()
+
+    async def astream_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None, variants=None):
+        """Async counterpart of stream_recommendation; losing streams are cancelled outright"""
+        self._count("requests")
+        race = _Race(self)
+        events: "asyncio.Queue" = asyncio.Queue()
+        tasks: Dict[int, asyncio.Task] = {}
+
+        async def read(attempt, client):
+            try:
+                async for chunk in astream_from(client, prompt, max_tokens, schema, cached_prefix, variants):
+                    if chunk:
+                        events.put_nowait((attempt, "chunk", chunk))
+                events.put_nowait((attempt, "end", None))
+            except Exception as e:
+                events.put_nowait((attempt, "error", e))
+
+        def launch(hedge=False) -> bool:
+            index = race.next_provider()
+            if index is None:
+                return False
+            attempt = race.started(index, hedge)
+            tasks[id(attempt)] = asyncio.ensure_future(read(attempt, self.clients[index]))
+            return True
+
+        if not launch():
+            raise race.exhausted()
+        winner = None
+        try:
+            while winner is None:
+                deadline = race.hedge_deadline()
+                try:
+                    timeout = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+                    attempt, kind, payload = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    race.hedged = True
+                    launch(hedge=True)
+                    continue
+                if attempt["done"]:
+                    continue
+                if kind == "chunk":
+                    winner = attempt
+                    race.succeeded(attempt)
+                    metrics.set_labels(provider=self.health[attempt["index"]].name)
+                    for other in race.losers(winner):
+                        tasks[id(other)].cancel()
+                    yield payload
+                    break
+                race.failed(attempt, payload if kind == "error" else LLMError("empty response"))
+                if not race.running() and not launch():
+                    raise race.exhausted()
+
+            while True:
+                attempt, kind, payload = await events.get()
+                if attempt is not winner:
+                    continue
+                if kind == "chunk":
+                    yield payload
+                elif kind == "end":
+                    return
+                else:
+                    race.failed(attempt, payload)
+                    raise LLMError(f"{self.health[attempt['index']].name} failed mid-answer: {payload}") from payload
+        finally:
+            for task in tasks.values():
+                task.cancel()
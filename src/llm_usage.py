@@ -0,0 +1,98 @@
+import math
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from src import metrics
+
+_TOKEN_PIECES = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough BPE token count: ~1.3 tokens per word, one per digit run or symbol"""
+    words = digits = symbols = 0
+    for piece in _TOKEN_PIECES.findall(text or ""):
+        if piece[0].isalpha():
+            words += 1
+        elif piece[0].isdigit():
+            digits += 1
+        else:
+            symbols += 1
+    return math.ceil(words * 1.3 + digits + symbols)
+
+
+class TokenUsageLog:
+    """Per-call token counts, splitting input into prompt-cache reads, cache writes and uncached tokens
+
+    Clients record one entry per LLM call from the usage their provider
+    reports; when a provider reports none, the call is recorded from
+    estimate_tokens and marked `estimated`. `last` is the most recent call
+    and `snapshot()` adds totals, the share of input tokens served from the
+    prompt cache and the measured (provider-reported) counts per request
+    mode. Each call is also added to the /metrics token counters.
+    """
+
+    FIELDS = ("uncached_input_tokens", "cache_read_tokens", "cache_write_tokens", "output_tokens")
+
+    def __init__(self, history: int = 50):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=history)
+        self._totals = {"calls": 0, **{field: 0 for field in self.FIELDS}}
+        self._totals["estimated_calls"] = 0
+        self._measured_by_mode: Dict[str, Dict[str, int]] = {}
+        self._first_token_seconds: List[float] = []
+        self.last: Optional[Dict] = None
+
+    def record(self, uncached_input_tokens: int = 0, cache_read_tokens: int = 0,
+               cache_write_tokens: int = 0, output_tokens: int = 0,
+               first_token_seconds: Optional[float] = None, provider: Optional[str] = None,
+               estimated: bool = False) -> Dict:
+        call = {
+            "uncached_input_tokens": int(uncached_input_tokens or 0),
+            "cache_read_tokens": int(cache_read_tokens or 0),
+            "cache_write_tokens": int(cache_write_tokens or 0),
+            "output_tokens": int(output_tokens or 0),
+            "first_token_seconds": round(first_token_seconds, 4) if first_token_seconds is not None else None,
+            "estimated": estimated,
+            "at": time.time(),
+        }
+        mode = metrics.current_labels()[1] or "none"
+        with self._lock:
+            self._totals["calls"] += 1
+            self._totals["estimated_calls"] += estimated
+            for field in self.FIELDS:
+                self._totals[field] += call[field]
+            if not estimated:
+                measured = self._measured_by_mode.setdefault(mode, {"calls": 0, "input_tokens": 0, "output_tokens": 0})
+                measured["calls"] += 1
+                measured["input_tokens"] += call["uncached_input_tokens"] + call["cache_read_tokens"] + call["cache_write_tokens"]
+                measured["output_tokens"] += call["output_tokens"]
+            if first_token_seconds is not None:
+                self._first_token_seconds.append(first_token_seconds)
+                del self._first_token_seconds[:-1000]
+            self._recent.append(call)
+            self.last = call
+        metrics.count_tokens(call, provider)
+        return call
+
+    def record_estimate(self, prompt: str, answer: str = "", first_token_seconds: Optional[float] = None,
+                        provider: Optional[str] = None) -> Dict:
+        """Record a call whose provider reported no usage, from estimated prompt and answer tokens"""
+        return self.record(uncached_input_tokens=estimate_tokens(prompt), output_tokens=estimate_tokens(answer),
+                           first_token_seconds=first_token_seconds, provider=provider, estimated=True)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            stats = dict(self._totals)
+            recent = list(self._recent)
+            ttft = sorted(self._first_token_seconds)
+            measured = {mode: dict(counts) for mode, counts in self._measured_by_mode.items()}
+        input_tokens = stats["uncached_input_tokens"] + stats["cache_read_tokens"] + stats["cache_write_tokens"]
+        stats["cache_read_ratio"] = round(stats["cache_read_tokens"] / input_tokens, 4) if input_tokens else 0.0
+        stats["median_first_token_seconds"] = round(ttft[len(ttft) // 2], 4) if ttft else None
+        stats["measured_by_mode"] = measured
+        stats["recent"] = recent
+        return stats
+
@@ -1,73 +1,60 @@
-import subprocess
-import json
 import os
+import requests # type: ignore
 import config
+from src.llama_server import LlamaServerWorker, WorkerBusyError, WorkerUnavailableError
+from src.llm_client import LLMError
+from src.llm_usage import TokenUsageLog
 
 class LocalLLMClient:
-    """Interface for local LLM interactions using llama.cpp"""
+    """Interface for local LLM interactions using a resident llama.cpp server"""
     
-    def __init__(self, model_path=None, model_type="phi"):
+    def __init__(self, model_path=None, model_type="phi", worker=None):
         self.model_path = model_path or os.path.join(
             os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
             "models",
             "phi-2.Q4_K_M.gguf"
         )
-        self.llama_cpp_path = os.path.join(
-            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-            "llama.cpp"
-        )
         self.model_type = model_type
+        self.provider = "local"
+        self.model = os.path.basename(self.model_path)
+        self.usage = TokenUsageLog()
         
         # Validate model path
         if not os.path.exists(self.model_path):
             print(f"Warning: Model not found at {self.model_path}")
+        
+        # One long-lived llama-server keeps the model loaded between requests
+        self.worker = worker or LlamaServerWorker(self.model_path)
+        if config.LOCAL_LLM_PRELOAD:
+            self.worker.warm_up()
     
-    def generate_recommendation(self, prompt):
-        """Generate recommendations using the local LLM"""
+    def generate_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None):
+        """Generate recommendations using the local LLM
+
+        The server keeps each slot's KV cache, so a prompt sharing its
+        prefix with the previous one only evaluates the new tokens;
+        cached_prefix needs no special handling here.
+        """
         formatted_prompt = self._format_prompt_for_model(prompt)
-        
         try:
-            # Call llama.cpp with the prompt
-            
-            cmd = [
-                f"{self.llama_cpp_path}/build/bin/llama-cli",  # Using main which is the standard binary name
-                "-m", self.model_path,
-                "-n", "2048",  # Output token limit
-                "--temp", "0.7",
-                "--ctx-size", "4500",  # Reduced context window size
-                "-b", "512",    # Smaller batch size
-                "-p", formatted_prompt
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-                    # If GPU memory error, fall back to CPU
-            if result.returncode != 0 and "Insufficient Memory" in result.stderr:
-                print("GPU memory insufficient, falling back to CPU...")
-                cmd.append("--n-gpu-layers")
-                cmd.append("0")  # Use CPU only
-                result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            print("STDOUT:", result.stdout)
-            print("STDERR:", result.stderr)
-            
-
-            if result.returncode != 0:
-                print(f"LLM subprocess failed with return code {result.returncode}")
-                return f"Error running LLM subprocess:\n{result.stderr}"
-           
-            # Extract output from the model response
-            output = result.stdout
-            
-            # Remove the prompt from the output to get just the response
-            if output and formatted_prompt in output:
-                output = output.split(formatted_prompt)[1].strip()
-                                
-            return output
-            
-        except Exception as e:
-            print(f"Error generating recommendations with local LLM: {e}")
-            return "Error generating recommendations. Please check your local LLM setup."
+            return self.worker.complete(formatted_prompt, max_tokens or 2048, schema, self._record_usage)
+        except (WorkerUnavailableError, WorkerBusyError, requests.RequestException) as e:
+            raise LLMError(f"Error generating recommendations with local LLM: {e}", self.provider) from e
+    
+    def stream_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None):
+        """Yield the local LLM's response as it is generated"""
+        formatted_prompt = self._format_prompt_for_model(prompt)
+        try:
+            yield from self.worker.stream(formatted_prompt, max_tokens or 2048, schema, self._record_usage)
+        except (WorkerUnavailableError, WorkerBusyError, requests.RequestException) as e:
+            raise LLMError(f"Error streaming recommendations with local LLM: {e}", self.provider) from e
+    
+    def _record_usage(self, usage):
+        self.usage.record(**usage, provider=self.provider)
+    
+    def stats(self):
+        """Worker slot, queue and restart counters"""
+        return self.worker.stats()
     
     def _format_prompt_for_model(self, prompt):
         """Format prompt based on the model type"""
@@ -0,0 +1,236 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import config
+
+# Labels of the request being served: route, mode and provider. The dict is
+# shared by the threads and tasks a request starts (they copy the context),
+# so the LLM client can fill in the provider that actually answered.
+_labels: ContextVar[Optional[Dict[str, str]]] = ContextVar("metrics_labels", default=None)
+
+REQUEST_LABELS = ("route", "mode", "provider")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic count per label combination"""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(self.labels, labels)} {value:g}" for labels, value in values]
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket distribution per label combination
+
+    An observation is one bisect and a few additions under a lock; buckets
+    are only made cumulative when the exposition is rendered.
+    """
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets or config.METRICS_LATENCY_BUCKETS))
+        # Per label combination: [count per bucket (+Inf last), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: Tuple[str, ...] = ()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((labels, (list(counts), total, count))
+                            for labels, (counts, total, count) in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {total:.6g}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """The metrics a process exposes, rendered in the Prometheus text format"""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: List = []
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = ()) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "bob_request_duration_seconds", "Time to answer an HTTP request (to the first byte of streamed responses)",
+    ("route", "method", "status"),
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "bob_stage_duration_seconds", "Time spent in one stage of a recommendation request",
+    ("stage",) + REQUEST_LABELS,
+)
+LLM_TOKENS = REGISTRY.counter(
+    "bob_llm_tokens_total", "Tokens reported by the LLM provider, by type (input, cache_read, cache_write, output)",
+    REQUEST_LABELS + ("type",),
+)
+LLM_ESTIMATED_TOKENS = REGISTRY.counter(
+    "bob_llm_estimated_tokens_total",
+    "Estimated tokens for LLM calls whose provider reported no usage, by type (input, output)",
+    REQUEST_LABELS + ("type",),
+)
+RECOMMENDATIONS = REGISTRY.counter(
+    "bob_recommendations_total", "Recommendations returned, and dropped because they did not match the catalog",
+    ("route", "mode", "outcome"),
+)
+LLM_CACHE_LOOKUPS = REGISTRY.counter(
+    "bob_llm_cache_lookups_total",
+    "LLM response cache lookups, by outcome (hit, miss) and provider (the one answered for, or first preferred)",
+    ("provider", "outcome"),
+)
+BAXUS_CACHE_EVENTS = REGISTRY.counter(
+    "bob_baxus_cache_events_total",
+    "BAXUS bar/wishlist cache events by source (bar, wishlist) and event (hits, stale_hits, misses, refreshes, ...)",
+    ("source", "event"),
+)
+SINGLE_FLIGHT = REGISTRY.counter(
+    "bob_single_flight_total",
+    "Calls through a named single-flight group, by outcome (calls run, coalesced callers, errors)",
+    ("flight", "outcome"),
+)
+
+# TokenUsageLog fields and their `type` label
+_TOKEN_TYPES = (
+    ("uncached_input_tokens", "input"), ("cache_read_tokens", "cache_read"),
+    ("cache_write_tokens", "cache_write"), ("output_tokens", "output"),
+)
+
+
+def begin_request(route: str, mode: str = ""):
+    """Start a fresh set of labels for the request handled in this context"""
+    _labels.set({"route": route, "mode": mode, "provider": ""})
+
+
+def set_labels(**labels: str):
+    """Update the current request's labels (outside a request, this context's own labels)"""
+    current = _labels.get()
+    if current is None:
+        current = {"route": "", "mode": "", "provider": ""}
+        _labels.set(current)
+    current.update(labels)
+
+
+def current_labels(**overrides: str) -> Tuple[str, ...]:
+    current = _labels.get() or {}
+    return tuple(overrides.get(name, current.get(name, "")) or "" for name in REQUEST_LABELS)
+
+
+def observe_stage(stage: str, seconds: float, **labels: str):
+    if config.METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, (stage,) + current_labels(**labels))
+
+
+@contextmanager
+def stage(name: str, **labels: str):
+    """Time the enclosed block as one stage of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start, **labels)
+
+
+def observe_request(route: str, method: str, status: int, seconds: float):
+    if config.METRICS_ENABLED:
+        REQUEST_SECONDS.observe(seconds, (route, method, str(status)))
+
+
+def count_tokens(call: Dict, provider: Optional[str] = None):
+    """Add one LLM call's token usage to the reported, or for estimated calls the estimated, token counters"""
+    if not config.METRICS_ENABLED:
+        return
+    labels = current_labels(provider=provider) if provider else current_labels()
+    counter = LLM_ESTIMATED_TOKENS if call.get("estimated") else LLM_TOKENS
+    for field, kind in _TOKEN_TYPES:
+        if call.get(field):
+            counter.inc(labels + (kind,), call[field])
+
+
+def count_recommendations(outcome: str, amount: int = 1, mode: Optional[str] = None):
+    if config.METRICS_ENABLED and amount:
+        route, current_mode, _ = current_labels()
+        RECOMMENDATIONS.inc((route, mode or current_mode, outcome), amount)
+
+
+def count_cache_lookup(provider: str, hit: bool):
+    if config.METRICS_ENABLED:
+        LLM_CACHE_LOOKUPS.inc((provider, "hit" if hit else "miss"))
+
+
+def count_baxus_cache(source: str, event: str):
+    if config.METRICS_ENABLED:
+        BAXUS_CACHE_EVENTS.inc((source, event))
+
+
+def count_flight(flight: str, outcome: str):
+    if config.METRICS_ENABLED:
+        SINGLE_FLIGHT.inc((flight, outcome))
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,187 @@
+import math
+import re
+import unicodedata
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+
+class NameMatch(NamedTuple):
+    """Best catalog match for a free-text bottle name"""
+    bottle: Dict
+    confidence: float
+
+
+# Multi-word phrases collapsed to a single token before tokenizing
+_PHRASES = [
+    (re.compile(r"\bbottled[\s-]+in[\s-]+bond\b"), " bib "),
+    (re.compile(r"\bsingle[\s-]+barrel\b"), " singlebarrel "),
+    (re.compile(r"\bsmall[\s-]+batch\b"), " smallbatch "),
+    (re.compile(r"\bcask[\s-]+strength\b"), " caskstrength "),
+    (re.compile(r"\bbarrel[\s-]+proof\b"), " barrelproof "),
+]
+# "10 Year", "10-yr", "10 Years Old", "10yo" -> "10yr"
+_AGE = re.compile(r"\b(\d{1,2})\s*-?\s*(?:years?|yrs?|yo)\b(?:[\s-]*old\b)?")
+# "107 Proof", "(100 pf)" -> "107pf"
+_PROOF = re.compile(r"\b(\d{2,3}(?:\.\d)?)\s*-?\s*(?:proof|pf)\b")
+_NON_ALNUM = re.compile(r"[^a-z0-9 ]+")
+_STOPWORDS = frozenset({"the", "and", "of", "a"})
+
+
+def normalize_bottle_name(name: Optional[str]) -> str:
+    """Canonical form of a bottle name used for fuzzy matching"""
+    if not name:
+        return ""
+    # Fold accents and curly quotes, then lowercase
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    name = name.lower().replace("&", " and ")
+    # Drop apostrophes so "Blanton's" and "Blantons" agree
+    name = re.sub(r"['`]", "", name)
+    name = re.sub(r"[.]", "", name)
+    for pattern, replacement in _PHRASES:
+        name = pattern.sub(replacement, name)
+    name = _AGE.sub(r" \1yr ", name)
+    name = _PROOF.sub(lambda m: f" {m.group(1).replace('.', '')}pf ", name)
+    name = _NON_ALNUM.sub(" ", name)
+    return " ".join(token for token in name.split() if token not in _STOPWORDS)
+
+
+def _trigrams(token: str) -> List[str]:
+    """Character trigrams of a token, padded at the edges"""
+    padded = f" {token} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+class NameResolver:
+    """Resolve free-text bottle names to catalog entries via an inverted index
+
+    Names are tokenized after normalization. A token -> bottle posting index
+    generates candidates, and a trigram -> token index over the vocabulary
+    corrects misspelled or unknown tokens. Candidates are ranked by an
+    IDF-weighted blend of Dice similarity and query containment (LLMs tend
+    to shorten names), which is also the reported confidence.
+    """
+
+    def __init__(self, bottles: Iterable[Dict], max_postings: int = 1000,
+                 max_candidates: int = 25, names: Optional[Iterable[Optional[str]]] = None):
+        self.max_postings = max_postings
+        self.max_candidates = max_candidates
+
+        # Given the names up front, bottles are only looked up (by row) once matched
+        self._source: Sequence[Dict] = bottles if isinstance(bottles, Sequence) else list(bottles)
+        if names is None:
+            names = (bottle.get("name") for bottle in self._source)
+        self._rows: List[int] = []
+        self._exact: Dict[str, int] = {}
+        postings: Dict[str, List[int]] = {}
+        token_sets: List[frozenset] = []
+
+        for row, name in enumerate(names):
+            normalized = normalize_bottle_name(name)
+            if not normalized:
+                continue
+            index = len(self._rows)
+            self._rows.append(row)
+            self._exact.setdefault(normalized, index)
+            tokens = frozenset(normalized.split())
+            token_sets.append(tokens)
+            for token in tokens:
+                postings.setdefault(token, []).append(index)
+
+        count = max(len(self._rows), 1)
+        self._postings = postings
+        self._idf = {token: math.log(1 + count / len(ids)) for token, ids in postings.items()}
+        self._default_idf = math.log(1 + count)
+        self._token_sets = token_sets
+        self._weights = [sum(self._idf[t] for t in tokens) for tokens in token_sets]
+
+        # Trigram index over the vocabulary, not over names, keeps it small
+        vocab_trigrams: Dict[str, List[str]] = {}
+        for token in postings:
+            for gram in set(_trigrams(token)):
+                vocab_trigrams.setdefault(gram, []).append(token)
+        self._vocab_trigrams = vocab_trigrams
+        self._fuzzy_cache: Dict[str, Optional[tuple]] = {}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _correct_token(self, token: str) -> Optional[tuple]:
+        """Closest vocabulary token by trigram Dice similarity"""
+        if token in self._fuzzy_cache:
+            return self._fuzzy_cache[token]
+
+        grams = set(_trigrams(token))
+        overlap: Dict[str, int] = {}
+        for gram in grams:
+            for candidate in self._vocab_trigrams.get(gram, ()):
+                overlap[candidate] = overlap.get(candidate, 0) + 1
+
+        best = None
+        for candidate, shared in overlap.items():
+            similarity = 2.0 * shared / (len(grams) + len(candidate) + 2)
+            if similarity >= 0.5 and (best is None or similarity > best[1]):
+                best = (candidate, similarity)
+
+        # Bounded memo; misspellings repeat across LLM responses
+        if len(self._fuzzy_cache) < 10000:
+            self._fuzzy_cache[token] = best
+        return best
+
+    def resolve(self, name: Optional[str], min_confidence: float = 0.0) -> Optional[NameMatch]:
+        """Return the best-matching bottle and a confidence score in [0, 1]"""
+        normalized = normalize_bottle_name(name)
+        if not normalized:
+            return None
+
+        exact = self._exact.get(normalized)
+        if exact is not None:
+            return NameMatch(self._source[self._rows[exact]], 1.0)
+
+        # Map query tokens onto the vocabulary, fuzzily where needed
+        query: Dict[str, float] = {}
+        query_weight = 0.0
+        for token in set(normalized.split()):
+            # A bare "12" in "Lagavulin 12" is almost always an age statement
+            if token.isdigit() and len(token) <= 2 and f"{token}yr" in self._postings:
+                token = f"{token}yr"
+            if token in self._postings:
+                query[token] = 1.0
+                query_weight += self._idf[token]
+                continue
+            query_weight += self._default_idf
+            corrected = self._correct_token(token) if len(token) > 2 else None
+            if corrected:
+                query[corrected[0]] = max(query.get(corrected[0], 0.0), corrected[1])
+        if not query:
+            return None
+
+        # Accumulate scores from the rarest tokens first; very common tokens
+        # only re-rank candidates instead of generating them
+        scores: Dict[int, float] = {}
+        for token in sorted(query, key=lambda t: len(self._postings[t])):
+            ids = self._postings[token]
+            if scores and len(ids) > self.max_postings:
+                continue
+            gain = self._idf[token] * query[token]
+            for index in ids:
+                scores[index] = scores.get(index, 0.0) + gain
+
+        if len(scores) > self.max_candidates:
+            candidates = sorted(scores, key=scores.get, reverse=True)[:self.max_candidates]
+        else:
+            candidates = list(scores)
+
+        best_index, best_score = -1, 0.0
+        for index in candidates:
+            tokens = self._token_sets[index]
+            shared = sum(self._idf[t] * w for t, w in query.items() if t in tokens)
+            dice = 2.0 * shared / (query_weight + self._weights[index])
+            containment = shared / query_weight
+            score = 0.6 * dice + 0.4 * containment
+            # Prefer the shorter (more canonical) name on ties
+            if score > best_score or (score == best_score and best_index >= 0
+                                      and self._weights[index] < self._weights[best_index]):
+                best_index, best_score = index, score
+
+        if best_index < 0 or best_score < min_confidence:
+            return None
+        return NameMatch(self._source[self._rows[best_index]], round(min(best_score, 1.0), 4))
@@ -0,0 +1,78 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import config
+from src.recommendation_store import RecommendationStore, Results
+from src.single_flight import content_hash
+
+
+def fingerprint(catalog, user_bar, user_wishlist) -> Tuple[str, str, str]:
+    """(catalog version, bar hash, wishlist hash) a stored entry was generated from"""
+    return catalog.version, content_hash(user_bar), content_hash(user_wishlist)
+
+
+class Precomputer:
+    """Refresh the recommendation store for a list of active users
+
+    Bars and wishlists are fetched under one concurrency limit. Users whose
+    bar, wishlist and catalog version match their stored entry are only
+    re-marked fresh; the rest get every mode generated (one LLM call via
+    generate_all_modes) under a second, smaller limit.
+    """
+
+    def __init__(self, baxus_client, engine, bottles, store: RecommendationStore,
+                 fetch_concurrency: Optional[int] = None,
+                 llm_concurrency: Optional[int] = None,
+                 postprocess: Optional[Callable[[Results], Results]] = None):
+        self.baxus_client = baxus_client
+        self.engine = engine
+        self.bottles = bottles
+        self.store = store
+        self.fetch_concurrency = fetch_concurrency or config.PRECOMPUTE_FETCH_CONCURRENCY
+        self.llm_concurrency = llm_concurrency or config.PRECOMPUTE_LLM_CONCURRENCY
+        self.postprocess = postprocess
+
+    def run(self, usernames: List[str], force: bool = False) -> Iterator[Dict]:
+        """Yield {"username", "status": generated|unchanged|error} per (unique) user as each finishes"""
+        usernames = list(dict.fromkeys(usernames))
+        results: "queue.Queue[Dict]" = queue.Queue()
+        fetch_pool = ThreadPoolExecutor(self.fetch_concurrency, thread_name_prefix="precompute-fetch")
+        llm_pool = ThreadPoolExecutor(self.llm_concurrency, thread_name_prefix="precompute-llm")
+
+        def generate(username, user_bar, user_wishlist, current):
+            try:
+                recommendations = self.engine.generate_all_modes(
+                    username, user_bar, self.bottles, user_wishlist=user_wishlist
+                )
+                if self.postprocess:
+                    recommendations = self.postprocess(recommendations)
+                self.store.put(username, current, recommendations)
+                results.put({"username": username, "status": "generated"})
+            except Exception as e:
+                results.put({"username": username, "status": "error", "error": str(e)})
+
+        def fetch(username):
+            try:
+                user_bar, user_wishlist = self.baxus_client.get_user_bar_and_wishlist(username)
+                if not user_bar:
+                    results.put({"username": username, "status": "error",
+                                 "error": "Could not fetch user bar data"})
+                    return
+                current = fingerprint(self.bottles, user_bar, user_wishlist)
+                if not force and self.store.fingerprint(username) == current:
+                    self.store.touch(username)
+                    results.put({"username": username, "status": "unchanged"})
+                    return
+                llm_pool.submit(generate, username, user_bar, user_wishlist, current)
+            except Exception as e:
+                results.put({"username": username, "status": "error", "error": str(e)})
+
+        try:
+            for username in usernames:
+                fetch_pool.submit(fetch, username)
+            for _ in usernames:
+                yield results.get()
+        finally:
+            fetch_pool.shutdown(wait=False, cancel_futures=True)
+            llm_pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,178 @@
+from bisect import bisect_left, bisect_right
+from statistics import median
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Upper bin edges (USD) for the precomputed price histograms; the last bin is open
+HISTOGRAM_EDGES = (25, 50, 75, 100, 150, 200, 300, 500, 1000)
+
+
+def bottle_price(bottle: Dict) -> Optional[float]:
+    """Price used for price bands: fair price, falling back to MSRP"""
+    price = bottle.get("fair_price")
+    if price is None:
+        price = bottle.get("avg_msrp")
+    return price
+
+
+class _SortedPrices:
+    """Prices in ascending order plus the catalog row each one came from"""
+    __slots__ = ("prices", "rows", "histogram")
+
+    def __init__(self, pairs: List[Tuple[float, int]]):
+        pairs.sort()
+        self._set(tuple(price for price, _ in pairs), tuple(row for _, row in pairs))
+
+    @classmethod
+    def from_arrays(cls, prices: Sequence[float], rows: Sequence[int]) -> "_SortedPrices":
+        """Wrap already sorted prices and rows (e.g. memory-mapped arrays)"""
+        sorted_prices = cls.__new__(cls)
+        sorted_prices._set(prices, rows)
+        return sorted_prices
+
+    def _set(self, prices: Sequence[float], rows: Sequence[int]):
+        self.prices: Sequence[float] = prices
+        self.rows: Sequence[int] = rows
+        counts = []
+        start = 0
+        for edge in HISTOGRAM_EDGES:
+            end = bisect_left(self.prices, edge)
+            counts.append(end - start)
+            start = end
+        counts.append(len(self.prices) - start)
+        self.histogram: Tuple[int, ...] = tuple(counts)
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def range(self, min_price: Optional[float], max_price: Optional[float]) -> Sequence[int]:
+        """Rows priced within [min_price, max_price], cheapest first"""
+        lo = 0 if min_price is None else bisect_left(self.prices, min_price)
+        hi = len(self.prices) if max_price is None else bisect_right(self.prices, max_price)
+        return self.rows[lo:hi]
+
+    def percentile_of(self, price: float) -> float:
+        """Share of prices (0-100) at or below `price`, using the midpoint for ties"""
+        if not len(self.prices):
+            return 50.0
+        below = bisect_left(self.prices, price)
+        at_or_below = bisect_right(self.prices, price)
+        return 100.0 * (below + at_or_below) / (2 * len(self.prices))
+
+    def price_at(self, percentile: float) -> Optional[float]:
+        """Nearest-rank price at a percentile (clamped to 0-100)"""
+        if not len(self.prices):
+            return None
+        percentile = min(max(percentile, 0.0), 100.0)
+        index = min(int(percentile / 100.0 * len(self.prices)), len(self.prices) - 1)
+        return self.prices[index]
+
+
+class PriceIndex:
+    """Sorted price arrays over the catalog, overall and per spirit type
+
+    Built once at catalog load. Range queries are a pair of bisects plus a
+    slice, so pulling the k bottles in a price band is O(log n + k).
+    Field "price" is the band price (fair price, falling back to MSRP).
+    """
+
+    FIELDS = ("price", "fair_price", "avg_msrp", "shelf_price")
+
+    def __init__(self, bottles: Sequence[Dict]):
+        pairs: Dict[Tuple[str, str], List[Tuple[float, int]]] = {}
+        for row, bottle in enumerate(bottles):
+            spirit_type = bottle.get("spirit_type") or ""
+            for field in self.FIELDS:
+                value = bottle_price(bottle) if field == "price" else bottle.get(field)
+                if isinstance(value, (int, float)) and value > 0:
+                    pairs.setdefault((field, ""), []).append((value, row))
+                    if spirit_type:
+                        pairs.setdefault((field, spirit_type.lower()), []).append((value, row))
+        # Key "" holds the whole catalog; other keys are lowercased spirit types
+        self._set({key: _SortedPrices(value) for key, value in pairs.items()})
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[Tuple[str, str], Tuple[Sequence[float], Sequence[int]]]) -> "PriceIndex":
+        """Wrap sorted (prices, rows) per (field, spirit type), as sorted_arrays() returns them"""
+        index = cls.__new__(cls)
+        index._set({key: _SortedPrices.from_arrays(prices, rows) for key, (prices, rows) in arrays.items()})
+        return index
+
+    def sorted_arrays(self) -> Dict[Tuple[str, str], Tuple[Sequence[float], Sequence[int]]]:
+        """Sorted (prices, rows) per (field, lowercased spirit type or "")"""
+        return {key: (prices.prices, prices.rows) for key, prices in self._sorted.items()}
+
+    def _set(self, sorted_prices: Dict[Tuple[str, str], _SortedPrices]):
+        self._sorted: Dict[Tuple[str, str], _SortedPrices] = sorted_prices
+        self.percentiles: Dict[Tuple[str, str], Tuple[float, ...]] = {
+            key: tuple(prices.price_at(p) for p in range(0, 101, 5))
+            for key, prices in self._sorted.items()
+        }
+
+    def _get(self, field: str, spirit_type: Optional[str]) -> Optional[_SortedPrices]:
+        key = (field, (spirit_type or "").lower())
+        prices = self._sorted.get(key)
+        if prices is None and key[1]:
+            # Unknown or unpriced spirit type: use the whole catalog
+            prices = self._sorted.get((field, ""))
+        return prices
+
+    def range(self, min_price: Optional[float] = None, max_price: Optional[float] = None,
+              field: str = "price", spirit_type: Optional[str] = None) -> Sequence[int]:
+        """Catalog rows priced within the band, cheapest first"""
+        prices = self._get(field, spirit_type)
+        return prices.range(min_price, max_price) if prices else ()
+
+    def percentile_of(self, price: float, field: str = "price",
+                      spirit_type: Optional[str] = None) -> float:
+        """Percentile position (0-100) of a price within the catalog"""
+        prices = self._get(field, spirit_type)
+        return prices.percentile_of(price) if prices else 50.0
+
+    def price_at(self, percentile: float, field: str = "price",
+                 spirit_type: Optional[str] = None) -> Optional[float]:
+        """Catalog price at a percentile"""
+        prices = self._get(field, spirit_type)
+        return prices.price_at(percentile) if prices else None
+
+    def histogram(self, field: str = "price", spirit_type: Optional[str] = None) -> List[Dict]:
+        """Precomputed bottle counts per price bin"""
+        prices = self._get(field, spirit_type)
+        if not prices:
+            return []
+        lows = (0,) + HISTOGRAM_EDGES
+        highs = HISTOGRAM_EDGES + (None,)
+        return [
+            {"min": low, "max": high, "count": count}
+            for low, high, count in zip(lows, highs, prices.histogram)
+        ]
+
+    def band_for(self, owned: Iterable[Dict], spread: float,
+                 min_price: Optional[float] = None,
+                 max_price: Optional[float] = None) -> Tuple[Optional[float], Optional[float]]:
+        """Price band around the collection's percentile position
+
+        The median owned price is located within the catalog, and the band
+        spans `spread` percentile points either side of it. Explicit bounds
+        are kept as given. Without priced bottles, the band centers on the
+        catalog median.
+        """
+        owned_prices = [p for p in (bottle_price(b) for b in owned) if p]
+        return self.band_around(median(owned_prices) if owned_prices else None, spread, min_price, max_price)
+
+    def band_around(self, price: Optional[float], spread: float,
+                    min_price: Optional[float] = None,
+                    max_price: Optional[float] = None) -> Tuple[Optional[float], Optional[float]]:
+        """band_for, given the collection's median price (None: the catalog median)"""
+        if min_price is not None and max_price is not None:
+            return min_price, max_price
+        center = self.percentile_of(price) if price else 50.0
+        if min_price is None:
+            min_price = self.price_at(center - spread)
+            if max_price is not None and min_price is not None and min_price > max_price:
+                # The user asked for a band below their usual range
+                min_price = self.price_at(self.percentile_of(max_price) - 2 * spread)
+        if max_price is None:
+            max_price = self.price_at(center + spread)
+            if max_price is not None and max_price < min_price:
+                max_price = self.price_at(self.percentile_of(min_price) + 2 * spread)
+        return min_price, max_price
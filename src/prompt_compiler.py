@@ -0,0 +1,160 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import config
+from src.catalog import Catalog
+from src.llm_usage import estimate_tokens
+from src.price_index import bottle_price
+from src.user_profile import UserProfile
+
+
+def token_budget(provider: Optional[str]) -> int:
+    """Input token budget for a provider, falling back to the default"""
+    return config.PROMPT_TOKEN_BUDGETS.get(provider, config.PROMPT_TOKEN_BUDGETS["default"])
+
+
+# Compact table columns: (header, value getter); empty columns are dropped
+COLUMNS: Tuple[Tuple[str, object], ...] = (
+    ("name", lambda b: b.get("name")),
+    ("type", lambda b: b.get("spirit_type")),
+    ("price", lambda b: f"${bottle_price(b):.0f}" if bottle_price(b) is not None else None),
+    ("abv", lambda b: f"{b['abv']:g}" if isinstance(b.get("abv"), (int, float)) else None),
+)
+
+
+def compact_table(bottles: Sequence[Dict], indexed: bool = False, start: int = 0) -> List[str]:
+    """Header plus one pipe-separated row per bottle, with only populated columns"""
+    columns = [
+        (header, getter) for header, getter in COLUMNS
+        if any(getter(b) not in (None, "") for b in bottles)
+    ]
+    if not bottles or not columns:
+        return []
+    header = "|".join((["#"] if indexed else []) + [h for h, _ in columns])
+    rows = [header]
+    for i, bottle in enumerate(bottles):
+        cells = [str(getter(bottle) or "").replace("|", "/") for _, getter in columns]
+        rows.append("|".join(([str(start + i)] if indexed else []) + cells))
+    return rows
+
+
+def rank_collection(bar_items: Union[Iterable[Dict], UserProfile], catalog: Optional[Catalog],
+                    limit: Optional[int] = None) -> List[Dict]:
+    """Collection bottles ordered by relevance, most representative first
+
+    Bar items that match the catalog are replaced by their catalog bottle
+    (which carries price and ABV) and ranked by closeness to the collection's
+    taste vector; unmatched items follow in bar order. Duplicates are dropped,
+    and at most `limit` bottles are returned.
+    """
+    return UserProfile.ensure(bar_items, catalog).ranked_collection(limit)
+
+
+class CompiledPrompt:
+    """Prompt text plus what made it in and its estimated input token count
+
+    `prefix` is the cacheable static start of `text` ("" when the provider
+    has no prompt cache). `candidates` is what answer indices refer to and
+    `variants` the same prompt compiled for other providers' budgets.
+    """
+
+    def __init__(self, text: str, estimated_tokens: int, candidates: List[Dict],
+                 collection_rows: int, trimmed_rows: int, budget: int,
+                 prefix: str = "", prefix_tokens: int = 0):
+        self.text = text
+        self.estimated_tokens = estimated_tokens
+        self.candidates = candidates
+        self.collection_rows = collection_rows
+        self.trimmed_rows = trimmed_rows
+        self.budget = budget
+        self.prefix = prefix
+        self.prefix_tokens = prefix_tokens
+        self.variants: Dict[str, "CompiledPrompt"] = {}
+
+    def __str__(self) -> str:
+        return self.text
+
+
+class PromptCompiler:
+    """Assemble compact, token-budgeted recommendation prompts
+
+    Static parts (persona and answer format) come first so the prefix is
+    identical across users and can be served from the provider's prompt
+    cache; the collection, task and the user's own candidate shortlist
+    follow. The collection and candidates are encoded as pipe-separated
+    tables with only the columns that have data. When the estimate exceeds
+    the budget, the least relevant collection rows and candidates (the
+    tails of their already-ranked lists) are dropped first.
+    """
+
+    def __init__(self, budget: int, min_candidates: Optional[int] = None, min_collection: int = 3):
+        self.budget = budget
+        self.min_candidates = config.MAX_RECOMMENDATIONS if min_candidates is None else min_candidates
+        self.min_collection = min_collection
+
+    def compile(self, task: str, collection: Sequence[Dict], candidates: Sequence[Dict] = (),
+                answer_format: str = "", wishlist: Sequence[Dict] = (),
+                collection_size: Optional[int] = None, preamble: str = "",
+                cache_prefix: bool = False) -> CompiledPrompt:
+        """Build the prompt, trimming ranked rows until it fits the budget
+
+        With cache_prefix, the static start is reported as the prompt's
+        cacheable prefix.
+        """
+        collection = list(collection)
+        ranked_rows = len(collection)
+        candidates = list(candidates)
+        wishlist = list(wishlist)
+        collection_size = len(collection) if collection_size is None else collection_size
+        offered_rows = len(collection) + len(candidates) + len(wishlist)
+
+        # Static prefix, identical for every user
+        static = [preamble.strip()] if preamble else []
+        if answer_format:
+            static.append(answer_format.strip())
+        static_text = "\n".join(static) + "\n\n" if static else ""
+        prefix = static_text if cache_prefix else ""
+
+        # Trim on per-row estimates, then measure the final text once
+        fixed = estimate_tokens(static_text) + estimate_tokens(task) + 40
+        collection_cost = [estimate_tokens(row) + 1 for row in compact_table(collection)[1:]]
+        candidate_cost = [estimate_tokens(row) + 1 for row in compact_table(candidates, indexed=True)[1:]]
+        wishlist_cost = sum(estimate_tokens(b.get("name") or "") + 2 for b in wishlist)
+
+        def total():
+            return fixed + wishlist_cost + sum(collection_cost) + sum(candidate_cost)
+
+        while total() > self.budget:
+            if wishlist:
+                wishlist_cost -= estimate_tokens(wishlist.pop().get("name") or "") + 2
+            elif len(collection) > self.min_collection and len(collection) >= len(candidates):
+                collection.pop()
+                collection_cost.pop()
+            elif len(candidates) > self.min_candidates:
+                candidates.pop()
+                candidate_cost.pop()
+            elif collection:
+                collection.pop()
+                collection_cost.pop()
+            else:
+                # Already minimal; report the overrun rather than dropping the task
+                break
+
+        parts = []
+        if collection:
+            shown = f", {len(collection)} most relevant shown" if len(collection) < ranked_rows else ""
+            parts.append(f"My collection ({collection_size} bottles{shown}):")
+            parts.extend(compact_table(collection))
+        if wishlist:
+            parts.append("Wishlist: " + "; ".join(b.get("name") or "Unknown" for b in wishlist))
+        parts.append("")
+        parts.append(task.strip())
+        if candidates:
+            parts.append("Choose only from these candidates:")
+            parts.extend(compact_table(candidates, indexed=True))
+
+        text = static_text + "\n".join(parts) + "\n"
+        trimmed_rows = offered_rows - len(collection) - len(candidates) - len(wishlist)
+        return CompiledPrompt(
+            text, estimate_tokens(text), candidates, len(collection), trimmed_rows, self.budget,
+            prefix=prefix, prefix_tokens=estimate_tokens(prefix),
+        )
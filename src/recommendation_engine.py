@@ -1,36 +1,57 @@
-import json
-from typing import List, Dict, Any, Optional
-from src.llm_client import LLMClient
-from src.remote_llm_client import RemoteLLMClient
+import asyncio
+import threading
+import time
+from typing import List, Dict, AsyncIterator, Callable, Iterator, Optional, Sequence, Tuple
+from src import metrics
+from src.catalog import Catalog
+from src.llm_cache import CachedLLMClient
+from src.index_response import PickExpander
+from src.llm_router import build_llm_client
+from src.prompt_compiler import CompiledPrompt, PromptCompiler, token_budget
+from src.retrieval import CandidateRetriever
+from src.user_profile import ProfileStore, UserProfile, bar_items, flatten_bar_item
+from src.structured_output import (
+    StructuredResponseParser, agenerate_structured, astream_structured, format_instructions, generate_structured,
+    recommendation_schema, stream_structured
+)
 import config
 
 class RecommendationEngine:
     """Engine for generating whisky recommendations"""
     
+    MODES = ('general', 'similar-price', 'similar-profile', 'complementary')
+    
     def __init__(self):
-        # Initialize LLM client based on config
-        if config.LLM_PROVIDER == 'anthropic':
-            self.llm_client = LLMClient(provider='anthropic')
-        else:
-            self.llm_client = RemoteLLMClient()
+        # Initialize LLM client based on config (a router when several providers are listed)
+        self.llm_client = build_llm_client(config.LLM_PROVIDERS)
+        
+        # Serve repeated prompts from the response cache
+        if config.LLM_CACHE_ENABLED:
+            self.llm_client = CachedLLMClient(self.llm_client)
+        
+        # Per-user collection profiles, updated from bar item changes only
+        self.profiles = None
+        if config.USER_PROFILE_STORE_ENABLED:
+            self.profiles = ProfileStore(config.USER_PROFILE_STORE_PATH, config.USER_PROFILE_CACHE_ENTRIES)
+        
+        # Estimated input tokens per prompt, by mode
+        self._prompt_stats: Dict[str, Dict[str, int]] = {}
+        self._prompt_stats_lock = threading.Lock()
     
     def generate_recommendations(self, username: str, user_bar: Dict, 
                                 user_wishlist: Optional[Dict] = None, 
                                 bottles: Optional[List[Dict]] = None) -> List[Dict]:
         """Generate general recommendations based on user's collection"""
         # Process bar data
-        bottles_owned = self._process_bar_data(user_bar)
-        
-        # Extract wishlist bottles if available
-        wishlist_bottles = []
-        if user_wishlist:
-            wishlist_bottles = self._process_wishlist_data(user_wishlist)
+        profile = self._user_profile(username, user_bar, bottles)
         
-        # Build prompt
-        prompt = self._build_recommendation_prompt(bottles_owned, wishlist_bottles)
+        # Build prompt around retrieved catalog candidates
+        prompt = self._build_mode_prompt(
+            'general', profile, bottles, user_wishlist=user_wishlist
+        )
         
         # Generate recommendations using LLM
-        recommendations = self._generate_llm_recommendations(prompt, bottles)
+        recommendations = self._generate_llm_recommendations(prompt, bottles, 'general', profile)
         
         return recommendations
     
@@ -39,22 +60,15 @@ class RecommendationEngine:
                                            min_price: Optional[float] = None,
                                            max_price: Optional[float] = None) -> List[Dict]:
         """Generate recommendations within similar price ranges"""
-        bottles_owned = self._process_bar_data(user_bar)
+        profile = self._user_profile(username, user_bar, bottles)
         
-        # Calculate price range if not specified
-        if min_price is None or max_price is None:
-            avg_price = self._calculate_average_price(bottles_owned, bottles)
-            # Default to ±30% of average price if not specified
-            min_price = min_price or avg_price * 0.7
-            max_price = max_price or avg_price * 1.3
-        
-        # Build price-focused prompt
-        prompt = self._build_price_recommendation_prompt(
-            bottles_owned, min_price, max_price
+        # Build price-focused prompt (fills in a missing price band)
+        prompt = self._build_mode_prompt(
+            'similar-price', profile, bottles, min_price=min_price, max_price=max_price
         )
         
         # Generate recommendations
-        recommendations = self._generate_llm_recommendations(prompt, bottles)
+        recommendations = self._generate_llm_recommendations(prompt, bottles, 'similar-price', profile)
         
         return recommendations
     
@@ -62,304 +76,564 @@ class RecommendationEngine:
                                              bottles: List[Dict],
                                              profile_focus: Optional[str] = None) -> List[Dict]:
         """Generate recommendations similar to existing bottles"""
-        bottles_owned = self._process_bar_data(user_bar)
-        
-        # Build flavor profile focused prompt
-        prompt = self._build_profile_recommendation_prompt(
-            bottles_owned, profile_focus
+        profile = self._user_profile(username, user_bar, bottles)
+        
+        # Rank the catalog against the user's taste vector
+        catalog = Catalog.ensure(bottles)
+        recommendations = self._rank_similar_profile(profile, catalog, profile_focus)
+        if recommendations:
+            if config.EXPLAIN_PROFILE_RECOMMENDATIONS:
+                self._explain_with_llm(recommendations, profile, catalog, profile_focus)
+            return recommendations
+        
+        # Fall back to asking the LLM when the bar can't be matched to the catalog
+        prompt = self._build_mode_prompt(
+            'similar-profile', profile, bottles, profile_focus=profile_focus
         )
         
         # Generate recommendations
-        recommendations = self._generate_llm_recommendations(prompt, bottles)
+        recommendations = self._generate_llm_recommendations(
+            prompt, bottles, 'similar-profile', profile, profile_focus
+        )
         
         return recommendations
     
+    def _ranked_profile(self, username: str, user_bar: Dict, bottles: List[Dict], catalog: Optional[Catalog],
+                        profile_focus: Optional[str] = None) -> Tuple[UserProfile, List[Dict]]:
+        """The user's profile and its similar-profile ranking, in one call for a worker thread"""
+        profile = self._user_profile(username, user_bar, bottles)
+        return profile, self._rank_similar_profile(profile, catalog, profile_focus)
+    
+    def _rank_similar_profile(self, profile: UserProfile, catalog: Optional[Catalog],
+                              profile_focus: Optional[str] = None) -> List[Dict]:
+        """Vector-ranked similar-profile picks, or [] if the bar can't be matched"""
+        owned = profile.owned_bottles() if catalog else []
+        if not owned:
+            return []
+        with metrics.stage("rank", mode='similar-profile'):
+            spirit_focus = self._match_spirit_type(profile_focus, catalog)
+            candidates = catalog.similar_bottles(
+                owned, config.MAX_RECOMMENDATIONS, spirit_type=spirit_focus, vector=profile.taste_vector()
+            )
+            return self._build_similarity_recommendations(candidates, owned, catalog)
+    
+    def _match_spirit_type(self, profile_focus: Optional[str], catalog: Catalog) -> Optional[str]:
+        """Treat a focus that names a spirit type (e.g. "rye") as a filter"""
+        if not profile_focus:
+            return None
+        focus = profile_focus.strip().lower()
+        for spirit_type in catalog.spirit_types:
+            if spirit_type and spirit_type.lower() == focus:
+                return spirit_type
+        return None
+    
+    def _build_similarity_recommendations(self, candidates, owned: List[Dict], catalog: Catalog) -> List[Dict]:
+        """Turn ranked (bottle, score) pairs into templated recommendations"""
+        expander = PickExpander(catalog, owned)
+        recommendations = []
+        
+        for bottle, score in candidates:
+            # Closest bottle in the user's bar, to anchor the explanation
+            nearest = expander.nearest_owned(bottle)
+            
+            details = [bottle.get("spirit_type") or "Whiskey"]
+            if bottle.get("abv"):
+                details.append(f"{bottle['abv']}% ABV")
+            if bottle.get("fair_price"):
+                details.append(f"around ${bottle['fair_price']:.0f}")
+            
+            recommendations.append({
+                "name": bottle.get("name"),
+                "reasoning": f"Closest match to your collection's profile ({', '.join(details)}).",
+                "relationship": f"Similar to {nearest.get('name')} in your bar",
+                "similarity": round(score, 4),
+                "bottle_data": bottle,
+            })
+        
+        return recommendations
+    
+    def _explain_with_llm(self, recommendations: List[Dict], profile: UserProfile,
+                          catalog: Catalog, profile_focus: Optional[str] = None):
+        """Ask the LLM to explain pre-ranked recommendations, keeping the ranking"""
+        request = self._explanation_request(recommendations, profile, catalog, profile_focus)
+        self._apply_explanations(recommendations, generate_structured(self.llm_client, **request))
+    
+    async def _aexplain_with_llm(self, recommendations: List[Dict], profile: UserProfile,
+                                 catalog: Catalog, profile_focus: Optional[str] = None):
+        """Async counterpart of _explain_with_llm"""
+        request = await asyncio.to_thread(self._explanation_request, recommendations, profile, catalog, profile_focus)
+        self._apply_explanations(recommendations, await agenerate_structured(self.llm_client, **request))
+    
+    def _explanation_request(self, recommendations: List[Dict], profile: UserProfile,
+                             catalog: Catalog, profile_focus: Optional[str] = None) -> Dict:
+        """(a)generate_structured arguments asking for one explanation per recommendation"""
+        task = "Explain how each of these bottles matches the flavor profile of my collection"
+        if profile_focus:
+            task += f", particularly its {profile_focus} characteristics"
+        task += ":\n" + "\n".join(f"- {rec['name']}" for rec in recommendations)
+        answer_format = format_instructions(indexed=False)
+        compiled = self._compile_prompt('similar-profile', task, profile, catalog, answer_format=answer_format)
+        schema = recommendation_schema(indexed=False)
+        return {
+            "prompt": compiled.text,
+            "parser_factory": lambda: StructuredResponseParser(max_items=len(recommendations)),
+            "schema": schema,
+            "variants": self._variants(compiled, lambda provider, variant: schema),
+        }
+    
+    def _apply_explanations(self, recommendations: List[Dict], explanations: Dict[str, List[Dict]]):
+        """Only overwrite the templated text; bottle data and order stay local"""
+        by_name = {rec["name"].lower(): rec for rec in recommendations if rec.get("name")}
+        for items in explanations.values():
+            for item in items:
+                rec = by_name.get(item["name"].strip().lower())
+                if rec:
+                    rec["reasoning"] = item.get("reasoning") or rec["reasoning"]
+                    rec["relationship"] = item.get("relationship") or rec["relationship"]
+    
     def generate_complementary_recommendations(self, username: str, user_bar: Dict,
                                              bottles: List[Dict]) -> List[Dict]:
         """Generate recommendations that diversify a collection"""
-        bottles_owned = self._process_bar_data(user_bar)
+        profile = self._user_profile(username, user_bar, bottles)
         
         # Build diversity-focused prompt
-        prompt = self._build_complementary_recommendation_prompt(bottles_owned)
+        prompt = self._build_mode_prompt('complementary', profile, bottles)
         
         # Generate recommendations
-        recommendations = self._generate_llm_recommendations(prompt, bottles)
+        recommendations = self._generate_llm_recommendations(prompt, bottles, 'complementary', profile)
         
         return recommendations
 
-    def _clean_markdown_code_blocks(self, text):
-        """Remove markdown code block delimiters from text"""
-        import re
-        # Remove ```json and ``` markers
-        cleaned = re.sub(r'```(?:json)?\n', '', text)
-        cleaned = re.sub(r'```', '', cleaned)
-        return cleaned.strip()
-        def _process_bar_data(self, user_bar: Dict) -> List[Dict]:
-            """Extract and process bottles from user's bar data"""
-            bottles = []
-            if user_bar and "bottles" in user_bar:
-                bottles = user_bar["bottles"]
-            return bottles
+    def generate_all_modes(self, username: str, user_bar: Dict, bottles: List[Dict],
+                           user_wishlist: Optional[Dict] = None,
+                           min_price: Optional[float] = None, max_price: Optional[float] = None,
+                           profile_focus: Optional[str] = None) -> Dict[str, List[Dict]]:
+        """Answer every recommendation mode from one bar fetch and one LLM call"""
+        results, prompt, catalog, profile, modes = self._all_modes_prompt(
+            username, user_bar, bottles, user_wishlist, min_price, max_price, profile_focus
+        )
+        for mode, rec in self._stream_llm_recommendations('all', prompt, catalog, profile, profile_focus, modes):
+            results[mode].append(rec)
+        return {mode: results[mode] for mode in self.MODES}
     
-    def _process_wishlist_data(self, user_wishlist: Dict) -> List[Dict]:
-        """Extract and process bottles from user's wishlist data"""
-        bottles = []
-        if user_wishlist and "bottles" in user_wishlist:
-            bottles = user_wishlist["bottles"]
-        return bottles
+    async def agenerate_all_modes(self, username: str, user_bar: Dict, bottles: List[Dict],
+                                  user_wishlist: Optional[Dict] = None,
+                                  min_price: Optional[float] = None, max_price: Optional[float] = None,
+                                  profile_focus: Optional[str] = None) -> Dict[str, List[Dict]]:
+        """Async counterpart of generate_all_modes; the profile store and prompt build run in a worker thread"""
+        results, prompt, catalog, profile, modes = await asyncio.to_thread(
+            self._all_modes_prompt, username, user_bar, bottles, user_wishlist, min_price, max_price, profile_focus
+        )
+        async for mode, rec in self._astream_llm_recommendations('all', prompt, catalog, profile,
+                                                                  profile_focus, modes):
+            results[mode].append(rec)
+        return {mode: results[mode] for mode in self.MODES}
     
-    def _calculate_average_price(self, bottles_owned: List[Dict], all_bottles: List[Dict]) -> float:
-        """Calculate average price of bottles in user's collection"""
-        total_price = 0.0
-        count = 0
-        
-        # Get bottle IDs from user's collection
-        bottle_ids = [bottle.get("id") for bottle in bottles_owned]
-        
-        # Find these bottles in the complete dataset to get prices
-        for bottle in all_bottles:
-            if bottle.get("id") in bottle_ids:
-                if "fair_price" in bottle:
-                    total_price += bottle["fair_price"]
-                    count += 1
-                elif "avg_msrp" in bottle:
-                    total_price += bottle["avg_msrp"]
-                    count += 1
-        
-        # Return average or default value if no price data
-        return total_price / count if count > 0 else 50.0  # Default $50 if no data
-    
-    def _build_recommendation_prompt(self, bottles_owned: List[Dict], 
-                                    wishlist_bottles: List[Dict]) -> str:
-        """Build a general recommendation prompt based on collection"""
-        prompt = f"I have {len(bottles_owned)} bottles in my whisky collection:\n"
-        
-        # Add bottle details to the prompt
-        for bottle in bottles_owned[:20]:  # Limit to 20 bottles to keep prompt size reasonable
-            prompt += f"- {bottle.get('name', 'Unknown Bottle')}"
-            if bottle.get('spirit_type'):
-                prompt += f" ({bottle.get('spirit_type')})"
-            prompt += "\n"
-        
-        if wishlist_bottles:
-            prompt += f"\nI also have {len(wishlist_bottles)} bottles in my wishlist:\n"
-            for bottle in wishlist_bottles[:10]:
-                prompt += f"- {bottle.get('name', 'Unknown Bottle')}\n"
-        
-        prompt += "\nBased on my collection, recommend 5 whisky bottles I should try next. "
-        prompt += "Be very concise and brief. For each recommendation, provide only the bottle name and a one-sentence reasoning. "
-        prompt += "Keep the entire response under 100 words total."
-        
-        return prompt
-    
-    def _build_price_recommendation_prompt(self, bottles_owned: List[Dict],
-                                          min_price: float, max_price: float) -> str:
-        """Build a prompt for price-based recommendations"""
-        prompt = f"I have {len(bottles_owned)} bottles in my whisky collection. "
-        prompt += f"I'm looking for recommendations in the ${min_price:.2f}-${max_price:.2f} price range.\n\n"
-        
-        # Add some bottle details to the prompt
-        for bottle in bottles_owned[:15]:
-            prompt += f"- {bottle.get('name', 'Unknown Bottle')}"
-            if bottle.get('spirit_type'):
-                prompt += f" ({bottle.get('spirit_type')})"
-            prompt += "\n"
-        
-        prompt += f"\nBased on my collection, recommend 5 whisky bottles within the ${min_price:.2f}-${max_price:.2f} price range. "
-        prompt += "For each recommendation, provide the bottle name, reasoning that includes flavor profile, "
-        prompt += "and how it relates to my current collection."
-        
-        return prompt
-    
-    def _build_profile_recommendation_prompt(self, bottles_owned: List[Dict],
-                                           profile_focus: Optional[str] = None) -> str:
-        """Build a prompt for flavor profile recommendations"""
-        prompt = f"I have {len(bottles_owned)} bottles in my whisky collection:\n"
-        
-        # Add bottle details to the prompt
-        for bottle in bottles_owned[:15]:
-            prompt += f"- {bottle.get('name', 'Unknown Bottle')}"
-            if bottle.get('spirit_type'):
-                prompt += f" ({bottle.get('spirit_type')})"
-            prompt += "\n"
-        
-        prompt += "\nBased on my collection, recommend 5 whisky bottles with similar flavor profiles"
-        
-        if profile_focus:
-            prompt += f" particularly focusing on {profile_focus} characteristics"
-        
-        prompt += ". For each recommendation, provide the bottle name, detailed flavor profile description, "
-        prompt += "and how it relates to specific bottles in my current collection."
-        
-        return prompt
+    def _all_modes_prompt(self, username: str, user_bar: Dict, bottles: List[Dict], user_wishlist: Optional[Dict],
+                          min_price: Optional[float], max_price: Optional[float], profile_focus: Optional[str]):
+        """Locally answered modes, plus the shared prompt for the rest"""
+        profile = self._user_profile(username, user_bar, bottles)
+        catalog = Catalog.ensure(bottles)
+        results: Dict[str, List[Dict]] = {}
+        
+        # Similar-profile comes from the feature matrix when the bar matches the catalog
+        ranked = self._rank_similar_profile(profile, catalog, profile_focus)
+        if ranked:
+            results['similar-profile'] = ranked
+        modes = [mode for mode in self.MODES if mode not in results]
+        
+        start = time.perf_counter()
+        wishlist_bottles = self._process_wishlist_data(user_wishlist) if user_wishlist else []
+        min_price, max_price = self._resolve_price_band(profile, bottles, min_price, max_price)
+        
+        # One shared, de-duplicated candidate list indexes every section
+        candidates = []
+        seen = set()
+        for mode in modes:
+            for bottle in self._retrieve_candidates(mode, profile, catalog, min_price, max_price, profile_focus):
+                if id(bottle) not in seen:
+                    seen.add(id(bottle))
+                    candidates.append(bottle)
+        
+        compiled = self._build_all_modes_prompt(
+            modes, profile, catalog, candidates, wishlist_bottles, min_price, max_price, profile_focus
+        )
+        metrics.observe_stage("prompt_build", time.perf_counter() - start, mode='all')
+        results.update({mode: [] for mode in modes})
+        return results, compiled, catalog, profile, modes
     
-    def _build_complementary_recommendation_prompt(self, bottles_owned: List[Dict]) -> str:
-        """Build a prompt for recommendations that diversify the collection"""
-        prompt = f"I have {len(bottles_owned)} bottles in my whisky collection:\n"
-        
-        # Get types of spirits in the collection
-        spirit_types = set()
-        for bottle in bottles_owned:
-            if "spirit_type" in bottle and bottle["spirit_type"]:
-                spirit_types.add(bottle["spirit_type"])
-        
-        # Add bottle details to the prompt
-        for bottle in bottles_owned[:15]:
-            prompt += f"- {bottle.get('name', 'Unknown Bottle')}"
-            if bottle.get('spirit_type'):
-                prompt += f" ({bottle.get('spirit_type')})"
-            prompt += "\n"
-        
-        prompt += "\nBased on my collection, recommend 5 whisky bottles that would diversify my collection "
-        prompt += "and give me new flavor experiences different from what I already have. "
-        
-        if spirit_types:
-            prompt += f"I currently have {', '.join(spirit_types)} in my collection. "
-        
-        prompt += "For each recommendation, provide the bottle name, explanation of how it differs from my current collection, "
-        prompt += "and what unique characteristics it would add."
-        prompt += "Be extremely concise - limit each section to 1-2 sentences maximum."
-        
-        return prompt
+    def generate_for_mode(self, mode: str, username: str, user_bar: Dict, bottles: List[Dict],
+                          user_wishlist: Optional[Dict] = None,
+                          min_price: Optional[float] = None, max_price: Optional[float] = None,
+                          profile_focus: Optional[str] = None) -> List[Dict]:
+        """Dispatch to the generate_* method for a recommendation mode"""
+        if mode == 'general':
+            return self.generate_recommendations(username, user_bar, user_wishlist, bottles)
+        if mode == 'similar-price':
+            return self.generate_price_based_recommendations(username, user_bar, bottles, min_price, max_price)
+        if mode == 'similar-profile':
+            return self.generate_profile_based_recommendations(username, user_bar, bottles, profile_focus)
+        if mode == 'complementary':
+            return self.generate_complementary_recommendations(username, user_bar, bottles)
+        raise ValueError(f"Unsupported recommendation mode: {mode}")
     
-    def _build_analysis_prompt(self, bottles_owned: List[Dict]) -> str:
-        """Build a prompt for collection analysis"""
-        prompt = f"I have {len(bottles_owned)} bottles in my whisky collection:\n"
-        
-        # Add bottle details to the prompt
-        for bottle in bottles_owned:
-            prompt += f"- {bottle.get('name', 'Unknown Bottle')}"
-            if bottle.get('spirit_type'):
-                prompt += f" ({bottle.get('spirit_type')})"
-            prompt += "\n"
-        
-        prompt += "\nPlease analyze my whisky collection and provide:\n"
-        prompt += "1. An overall assessment of my whisky preferences\n"
-        prompt += "2. Dominant flavor profiles I seem to prefer\n"
-        prompt += "3. Any gaps or categories missing from my collection\n"
-        prompt += "4. 5 specific bottle recommendations that would complement my collection\n"
-        prompt += "Format your analysis as JSON with sections for 'preferences', 'flavor_profile', 'gaps', and 'recommendations'. "
-        prompt += "Be extremely concise - limit each section to 1-2 sentences maximum."
-        
-        return prompt
+    def stream_recommendations(self, mode: str, username: str, user_bar: Dict,
+                               bottles: List[Dict], user_wishlist: Optional[Dict] = None,
+                               min_price: Optional[float] = None, max_price: Optional[float] = None,
+                               profile_focus: Optional[str] = None) -> Iterator[Dict]:
+        """Yield catalog-matched recommendations as soon as each one is parsed"""
+        if mode not in self.MODES:
+            raise ValueError(f"Unsupported recommendation mode: {mode}")
+        profile = self._user_profile(username, user_bar, bottles)
+        catalog = Catalog.ensure(bottles)
+        
+        # Similar-profile picks come from the feature matrix, no generation needed
+        if mode == 'similar-profile':
+            ranked = self._rank_similar_profile(profile, catalog, profile_focus)
+            if ranked:
+                yield from ranked
+                return
+        
+        prompt = self._build_mode_prompt(
+            mode, profile, bottles, user_wishlist, min_price, max_price, profile_focus
+        )
+        for _, rec in self._stream_llm_recommendations(mode, prompt, catalog, profile, profile_focus):
+            yield rec
     
-    def _generate_llm_recommendations(self, prompt: str, all_bottles: List[Dict]) -> List[Dict]:
-        """Generate recommendations using LLM and match with actual bottles"""
-        # Get recommendation text from LLM
-        llm_response = self.llm_client.generate_recommendation(prompt)
-        
-        # Clean the response of markdown code blocks
-        cleaned_response = self._clean_markdown_code_blocks(llm_response)
+    async def agenerate_for_mode(self, mode: str, username: str, user_bar: Dict, bottles: List[Dict],
+                                 user_wishlist: Optional[Dict] = None,
+                                 min_price: Optional[float] = None, max_price: Optional[float] = None,
+                                 profile_focus: Optional[str] = None) -> List[Dict]:
+        """Async counterpart of generate_for_mode; the LLM wait holds no thread"""
+        if mode == 'similar-profile':
+            catalog = Catalog.ensure(bottles)
+            profile, recommendations = await asyncio.to_thread(
+                self._ranked_profile, username, user_bar, bottles, catalog, profile_focus
+            )
+            if recommendations:
+                if config.EXPLAIN_PROFILE_RECOMMENDATIONS:
+                    await self._aexplain_with_llm(recommendations, profile, catalog, profile_focus)
+                return recommendations
+        return [
+            rec async for rec in self.astream_recommendations(
+                mode, username, user_bar, bottles, user_wishlist, min_price, max_price, profile_focus
+            )
+        ]
+    
+    async def astream_recommendations(self, mode: str, username: str, user_bar: Dict,
+                                      bottles: List[Dict], user_wishlist: Optional[Dict] = None,
+                                      min_price: Optional[float] = None, max_price: Optional[float] = None,
+                                      profile_focus: Optional[str] = None) -> AsyncIterator[Dict]:
+        """Async counterpart of stream_recommendations
+
+        The profile store (SQLite) and the CPU-bound ranking and prompt
+        build run in a worker thread, so the event loop only waits.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unsupported recommendation mode: {mode}")
+        catalog = Catalog.ensure(bottles)
+        
+        if mode == 'similar-profile':
+            profile, ranked = await asyncio.to_thread(
+                self._ranked_profile, username, user_bar, bottles, catalog, profile_focus
+            )
+            if ranked:
+                for rec in ranked:
+                    yield rec
+                return
+        else:
+            profile = await asyncio.to_thread(self._user_profile, username, user_bar, bottles)
         
-        # Process LLM response into structured recommendations
+        prompt = await asyncio.to_thread(
+            self._build_mode_prompt, mode, profile, bottles, user_wishlist, min_price, max_price, profile_focus
+        )
+        async for _, rec in self._astream_llm_recommendations(mode, prompt, catalog, profile, profile_focus):
+            yield rec
+    
+    def _stream_llm_recommendations(self, mode: str, prompt: CompiledPrompt,
+                                     catalog: Optional[Catalog], profile: UserProfile,
+                                     profile_focus: Optional[str] = None,
+                                     sections: Optional[Sequence[str]] = None) -> Iterator[Tuple[str, Dict]]:
+        """Yield (section, recommendation) pairs as each JSON answer item is validated"""
+        request, link = self._llm_request(mode, prompt, catalog, profile, profile_focus, sections)
+        matching, unmatched = 0.0, 0
         try:
-            # Try to parse as JSON first
-            recommendations = json.loads(cleaned_response)
-        except json.JSONDecodeError:
-            # If not JSON, process as text and try to extract recommendations
-            recommendations = self._extract_recommendations_from_text(llm_response)
-        
-        # Match recommendations with actual bottle data if available
-        if all_bottles:
-            self._enhance_recommendations_with_bottle_data(recommendations, all_bottles)
-        
-        return recommendations
+            for section, item in stream_structured(self.llm_client, **request):
+                start = time.perf_counter()
+                section, rec = link(section, item)
+                matching += time.perf_counter() - start
+                if rec:
+                    yield section, rec
+                else:
+                    unmatched += 1
+        finally:
+            metrics.observe_stage("match", matching, mode=mode)
+            metrics.count_recommendations("dropped_unmatched", unmatched, mode)
     
-    def _extract_recommendations_from_text(self, text: str) -> List[Dict]:
-        """Extract recommendations from unstructured text response"""
-        # Simple extraction logic - look for numbered items or sections
-        recommendations = []
-        
-        # Split by numbered items like "1." or "1)"
-        import re
-        sections = re.split(r'\d+[\.\)]', text)
-        
-        # Skip first section if it's just an intro
-        sections = sections[1:] if len(sections) > 1 else sections
-        
-        for i, section in enumerate(sections[:5]):  # Limit to 5 recommendations
-            if section.strip():
-                # Try to extract bottle name from the beginning of the section
-                lines = section.strip().split('\n')
-                name = lines[0].strip()
-                
-                # If the first line contains a colon, use the text before it as name
-                if ':' in name:
-                    name = name.split(':', 1)[0].strip()
-                
-                # Remove any leading/trailing quotes or special characters
-                name = re.sub(r'^["\'\s-]+|["\'\s-]+$', '', name)
-                
-                # Rest of the text is reasoning
-                reasoning = section.strip()
-                if name and name in reasoning:
-                    reasoning = reasoning.replace(name, '', 1).strip()
-                
-                recommendations.append({
-                    "name": name,
-                    "reasoning": reasoning,
-                    "relationship": "Complementary addition to bar"  # Default relationship
-                })
-        
-        return recommendations
+    async def _astream_llm_recommendations(self, mode: str, prompt: CompiledPrompt,
+                                            catalog: Optional[Catalog], profile: UserProfile,
+                                            profile_focus: Optional[str] = None,
+                                            sections: Optional[Sequence[str]] = None) -> AsyncIterator[Tuple[str, Dict]]:
+        """Async counterpart of _stream_llm_recommendations"""
+        request, link = self._llm_request(mode, prompt, catalog, profile, profile_focus, sections)
+        items = astream_structured(self.llm_client, **request)
+        matching, unmatched = 0.0, 0
+        try:
+            async for section, item in items:
+                start = time.perf_counter()
+                section, rec = link(section, item)
+                matching += time.perf_counter() - start
+                if rec:
+                    yield section, rec
+                else:
+                    unmatched += 1
+        finally:
+            await items.aclose()
+            metrics.observe_stage("match", matching, mode=mode)
+            metrics.count_recommendations("dropped_unmatched", unmatched, mode)
     
-    def _enhance_recommendations_with_bottle_data(self, recommendations: List[Dict], all_bottles: List[Dict]):
-        """Add actual bottle data to recommendations by matching names"""
-        for rec in recommendations:
-            # Skip if already has bottle_data
-            if "bottle_data" in rec:
-                continue
-
-            bottle_name = rec.get("name", "").lower()
-
-            # Try to find matching bottle
-            for bottle in all_bottles:
-                if bottle.get("name", "").lower() == bottle_name:
-                    rec["bottle_data"] = bottle
-                    break
-                
-    def _process_bar_data(self, user_bar: Dict) -> List[Dict]:
-        """Process user's bar data to extract bottle information"""
-        bottles_owned = []
-        
-        # Check if bar data contains bottles
-        if user_bar and "bottles" in user_bar:
-            bottles_owned = user_bar["bottles"]
-        
-        # Add additional processing here if needed
-        
-        return bottles_owned
-
-def _process_wishlist_data(self, user_wishlist: Dict) -> List[Dict]:
-        """Process user's wishlist data to extract bottle information"""
+    def _llm_request(self, mode: str, prompt: CompiledPrompt, catalog: Optional[Catalog],
+                     profile: UserProfile, profile_focus: Optional[str] = None,
+                     sections: Optional[Sequence[str]] = None) -> Tuple[Dict, Callable]:
+        """(a)stream_structured arguments, and a function linking each answer item to a recommendation"""
+        # Every provider's prompt numbers candidates the same way; only their budgets trim the tail
+        widest = max([prompt, *prompt.variants.values()], key=lambda compiled: len(compiled.candidates))
+        candidates = widest.candidates
+        index_only = self._index_mode(candidates)
+        schema = recommendation_schema(index_only, bool(candidates), sections)
+        
+        candidate_count = len(candidates) if candidates else None
+        # Index-only answers need only a few dozen output tokens
+        max_tokens = config.INDEX_MODE_MAX_TOKENS[mode] if index_only else None
+        expander = PickExpander(catalog, profile.owned_bottles() if catalog else [])
+        request = {
+            "prompt": prompt.text,
+            "parser_factory": lambda: StructuredResponseParser(
+                candidate_count, index_only, sections, config.MAX_RECOMMENDATIONS
+            ),
+            "max_tokens": max_tokens,
+            "schema": schema,
+            "cached_prefix": prompt.prefix or None,
+            "variants": self._variants(prompt, schema),
+        }
+        
+        def link(section: str, item: Dict) -> Tuple[str, Optional[Dict]]:
+            # Section names are modes, so picks default to their section's reason code
+            section = section if sections else mode
+            return section, self._recommendation_from_item(item, candidates, catalog, expander, section, profile_focus)
+        
+        return request, link
+    
+    def _recommendation_from_item(self, item: Dict, candidates: List[Dict], catalog: Optional[Catalog],
+                                  expander: PickExpander, mode: str,
+                                  profile_focus: Optional[str] = None) -> Optional[Dict]:
+        """Link one validated answer item to its catalog bottle"""
+        if self._index_mode(candidates):
+            # Names and explanations are expanded locally from the picked index
+            return expander.expand([(item["i"], item.get("r"))], candidates, mode, profile_focus)[0]
+        rec = {
+            "name": item.get("name"),
+            "reasoning": item.get("reasoning") or "",
+            "relationship": item.get("relationship") or "",
+        }
+        if candidates:
+            bottle = candidates[item["i"]]
+            rec.update(name=bottle.get("name"), bottle_id=item["i"], bottle_data=bottle)
+            return rec
+        # Free-form picks are resolved by name; without a catalog they pass through unlinked
+        rec["name"] = rec["name"].strip()
+        if catalog and not self._attach_bottle_data(rec, catalog):
+            return None
+        return rec
+    
+    def _variants(self, prompt: CompiledPrompt, schema: Dict) -> Optional[Dict[str, Dict]]:
+        """The prompt, schema and cached prefix for each provider a router may send the request to"""
+        if not prompt.variants:
+            return None
+        provider = getattr(self.llm_client, "provider", None)
+        return {
+            name: {"prompt": compiled.text, "schema": schema, "cached_prefix": compiled.prefix or None}
+            for name, compiled in [(provider, prompt), *prompt.variants.items()]
+        }
+    
+    def _build_mode_prompt(self, mode: str, profile: UserProfile, bottles: List[Dict],
+                           user_wishlist: Optional[Dict] = None,
+                           min_price: Optional[float] = None, max_price: Optional[float] = None,
+                           profile_focus: Optional[str] = None) -> CompiledPrompt:
+        """Build a mode's prompt around the candidate list it offers the LLM"""
+        start = time.perf_counter()
+        catalog = Catalog.ensure(bottles)
         wishlist_bottles = []
+        if mode == 'similar-price':
+            min_price, max_price = self._resolve_price_band(profile, bottles, min_price, max_price)
+        elif mode == 'general' and user_wishlist:
+            wishlist_bottles = self._process_wishlist_data(user_wishlist)
         
-        # Check if wishlist data contains bottles
-        if user_wishlist and "bottles" in user_wishlist:
-            wishlist_bottles = user_wishlist["bottles"]
-        
-        # Add additional processing here if needed
-        
-        return wishlist_bottles
-
-def _build_recommendation_prompt(self, bottles_owned: List[Dict], wishlist_bottles: List[Dict]) -> str:
-        """Build a prompt for general recommendations"""
-        prompt = f"I have {len(bottles_owned)} bottles in my whisky collection:\n"
-        
-        # Add bottle details to the prompt
-        for bottle in bottles_owned[:15]:  # Limit to first 15 to avoid overly long prompts
-            prompt += f"- {bottle.get('name', 'Unknown Bottle')}"
-            if bottle.get('spirit_type'):
-                prompt += f" ({bottle.get('spirit_type')})"
-            prompt += "\n"
-        
-        if wishlist_bottles:
-            prompt += f"\nI have {len(wishlist_bottles)} bottles on my wishlist, including:\n"
-            for bottle in wishlist_bottles[:5]:  # Show just a few wishlist bottles
-                prompt += f"- {bottle.get('name', 'Unknown Bottle')}\n"
-        
-        prompt += "\nBased on my collection, recommend 5 whisky bottles that would be good additions. "
-        prompt += "For each recommendation, provide the bottle name, reasoning behind the recommendation, "
-        prompt += "and how it relates to my current collection."
-        
-        return prompt
+        candidates = self._retrieve_candidates(mode, profile, catalog, min_price, max_price, profile_focus)
+        task = f"Recommend {config.MAX_RECOMMENDATIONS} "
+        task += self._mode_instruction(mode, profile, min_price, max_price, profile_focus) + "."
+        compiled = self._compile_prompt(mode, task, profile, catalog, candidates, wishlist_bottles)
+        metrics.observe_stage("prompt_build", time.perf_counter() - start, mode=mode)
+        return compiled
+    
+    def _index_mode(self, candidates: Optional[List[Dict]]) -> bool:
+        """Whether to ask for candidate indices only (needs an indexed candidate list)"""
+        return config.LLM_RESPONSE_MODE == 'index' and bool(candidates)
+    
+    def _retrieve_candidates(self, mode: str, profile: UserProfile, catalog: Optional[Catalog],
+                             min_price: Optional[float] = None, max_price: Optional[float] = None,
+                             profile_focus: Optional[str] = None) -> List[Dict]:
+        """Pre-select catalog bottles the LLM may choose from"""
+        if not catalog:
+            return []
+        return CandidateRetriever(catalog).retrieve(
+            mode, profile, config.MAX_POTENTIAL_BOTTLES,
+            min_price=min_price, max_price=max_price, profile_focus=profile_focus
+        )
+    
+    def _mode_instruction(self, mode: str, profile: UserProfile,
+                          min_price: Optional[float] = None, max_price: Optional[float] = None,
+                          profile_focus: Optional[str] = None) -> str:
+        """What a mode asks the LLM for, e.g. bottles within a price range"""
+        if mode == 'similar-price':
+            return f"bottles within the ${min_price:.2f}-${max_price:.2f} price range"
+        if mode == 'similar-profile':
+            instruction = "bottles with flavor profiles similar to my collection"
+            if profile_focus:
+                instruction += f", particularly focusing on {profile_focus} characteristics"
+            return instruction
+        if mode == 'complementary':
+            instruction = "bottles that would diversify my collection with new flavor experiences"
+            spirit_types = set(profile.spirit_types)
+            if spirit_types:
+                instruction += f" (I currently have {', '.join(sorted(spirit_types))})"
+            return instruction
+        return "bottles I should try next based on my collection"
+    
+    def _compile_prompt(self, mode: str, task: str, profile: UserProfile, catalog: Optional[Catalog],
+                        candidates: Optional[List[Dict]] = None, wishlist_bottles: Optional[List[Dict]] = None,
+                        answer_format: Optional[str] = None) -> CompiledPrompt:
+        """Compact prompt within the provider's input token budget"""
+        candidates = candidates or []
+        if answer_format is None:
+            # Index-only answers are expanded locally from the picked candidate numbers
+            answer_format = format_instructions(self._index_mode(candidates), bool(candidates))
+        # Label this request's remaining stages (LLM call, parse) with the mode
+        metrics.set_labels(mode=mode)
+        provider = getattr(self.llm_client, "provider", None)
+        # Providers with prompt caching get the static persona and answer format marked as a prefix
+        cache_prefix = provider in config.PROMPT_PREFIX_CACHE_PROVIDERS
+        collection = profile.ranked_collection(config.PROMPT_MAX_COLLECTION_ROWS)
+        
+        def compile_for(budget: int) -> CompiledPrompt:
+            return PromptCompiler(budget).compile(
+                task, collection, candidates, answer_format,
+                wishlist=(wishlist_bottles or [])[:10], collection_size=profile.bottle_count,
+                cache_prefix=cache_prefix
+            )
+        
+        compiled = compile_for(token_budget(provider))
+        # A router may hedge or fail over; each other provider gets the prompt for its own budget
+        for other in getattr(self.llm_client, "providers", None) or ():
+            if other != provider:
+                budget = token_budget(other)
+                compiled.variants[other] = compiled if budget == compiled.budget else compile_for(budget)
+        self._record_prompt(mode, compiled)
+        return compiled
+    
+    def _record_prompt(self, mode: str, compiled: CompiledPrompt):
+        """Accumulate estimated input tokens per mode"""
+        with self._prompt_stats_lock:
+            stats = self._prompt_stats.setdefault(mode, {
+                "prompts": 0, "estimated_tokens": 0, "estimated_prefix_tokens": 0, "estimated_max_tokens": 0,
+                "trimmed_rows": 0, "over_budget": 0,
+            })
+            stats["prompts"] += 1
+            stats["estimated_tokens"] += compiled.estimated_tokens
+            stats["estimated_prefix_tokens"] += compiled.prefix_tokens
+            stats["estimated_max_tokens"] = max(stats["estimated_max_tokens"], compiled.estimated_tokens)
+            stats["trimmed_rows"] += compiled.trimmed_rows
+            stats["over_budget"] += compiled.estimated_tokens > compiled.budget
+    
+    def prompt_stats(self) -> Dict[str, Dict[str, int]]:
+        """Per-mode prompt counts and estimated input token totals, beside the input tokens
+        providers reported for that mode's calls (calls without reported usage are left out)"""
+        with self._prompt_stats_lock:
+            stats = {mode: dict(counts) for mode, counts in self._prompt_stats.items()}
+        measured = (self.llm_usage() or {}).get("measured_by_mode", {})
+        for mode, counts in stats.items():
+            reported = measured.get(mode, {})
+            counts["measured_calls"] = reported.get("calls", 0)
+            counts["measured_input_tokens"] = reported.get("input_tokens", 0)
+        return stats
+    
+    def llm_usage(self) -> Optional[Dict]:
+        """Token usage per LLM call, split into prompt-cache reads and uncached input; calls
+        the provider reported no usage for are marked `estimated`"""
+        usage = getattr(self.llm_client, "usage", None)
+        return usage.snapshot() if usage else None
+    
+    def _resolve_price_band(self, profile: UserProfile, bottles: List[Dict],
+                            min_price: Optional[float], max_price: Optional[float]):
+        """Fill in a missing price bound from the collection's price percentile"""
+        if min_price is None or max_price is None:
+            catalog = Catalog.ensure(bottles)
+            if catalog:
+                min_price, max_price = catalog.prices.band_around(
+                    profile.median_price(), config.PRICE_BAND_PERCENTILE_SPREAD, min_price, max_price
+                )
+        if min_price is None or max_price is None:
+            # No catalog, or one without prices: the profile keeps the catalog prices
+            # of the owned bottles; $50 without any
+            avg_price = profile.mean_price()
+            avg_price = avg_price if avg_price is not None else 50.0
+            # Default to ±30% of average price if not specified
+            min_price = avg_price * 0.7 if min_price is None else min_price
+            max_price = avg_price * 1.3 if max_price is None else max_price
+        return min_price, max_price
+    
+    def _process_wishlist_data(self, user_wishlist: Dict) -> List[Dict]:
+        """Extract and process bottles from user's wishlist data"""
+        bottles = []
+        if isinstance(user_wishlist, list):
+            bottles = [flatten_bar_item(item) for item in user_wishlist]
+        elif user_wishlist and "bottles" in user_wishlist:
+            bottles = user_wishlist["bottles"]
+        return bottles
+    
+    def _build_all_modes_prompt(self, modes: List[str], profile: UserProfile, catalog: Optional[Catalog],
+                                candidates: List[Dict], wishlist_bottles: List[Dict],
+                                min_price: float, max_price: float,
+                                profile_focus: Optional[str] = None) -> CompiledPrompt:
+        """Build one prompt asking for a section of recommendations per mode"""
+        # The collection and candidates are listed once and shared by every section
+        task = f"Recommend {config.MAX_RECOMMENDATIONS} different bottles for each of these sections:\n"
+        for mode in modes:
+            task += f"- {mode}: {self._mode_instruction(mode, profile, min_price, max_price, profile_focus)}\n"
+        answer_format = format_instructions(self._index_mode(candidates), bool(candidates), modes)
+        return self._compile_prompt('all', task, profile, catalog, candidates, wishlist_bottles, answer_format)
+    
+    def _generate_llm_recommendations(self, prompt: CompiledPrompt, all_bottles: List[Dict],
+                                      mode: str = 'general', profile: Optional[UserProfile] = None,
+                                      profile_focus: Optional[str] = None) -> List[Dict]:
+        """Generate recommendations using LLM and match with actual bottles"""
+        items = self._stream_llm_recommendations(
+            mode, prompt, Catalog.ensure(all_bottles), profile or UserProfile(), profile_focus
+        )
+        return [rec for _, rec in items]
+    
+    def _attach_bottle_data(self, rec: Dict, catalog: Catalog) -> bool:
+        """Resolve the LLM's bottle name against the catalog name index"""
+        match = catalog.resolve_name(rec.get("name", ""), config.NAME_MATCH_MIN_CONFIDENCE)
+        if not match:
+            return False
+        rec["bottle_data"] = match.bottle
+        rec["match_confidence"] = match.confidence
+        return True
+                
+    def _user_profile(self, username: str, user_bar: Dict, bottles: Optional[List[Dict]]) -> UserProfile:
+        """The user's collection profile, synced incrementally when the profile store is on"""
+        catalog = Catalog.ensure(bottles)
+        if self.profiles is not None and username:
+            return self.profiles.sync(username, user_bar, catalog)
+        return UserProfile.ensure(bar_items(user_bar), catalog)
@@ -0,0 +1,90 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Precomputed results for one user: every mode's recommendations
+Results = Dict[str, List[Dict]]
+
+
+class RecommendationStore:
+    """SQLite key-value store of precomputed recommendations, keyed by username
+
+    Each entry records the fingerprint it was generated from (catalog
+    version, bar and wishlist content hashes). An entry is served only for
+    the same fingerprint, so a changed bar or wishlist (or a new catalog)
+    misses, and only while it was last generated or confirmed unchanged
+    less than `max_age` seconds ago.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_age: float = 36 * 3600):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        if path:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS recommendations ("
+            " username TEXT PRIMARY KEY, catalog_version TEXT, bar_hash TEXT, wishlist_hash TEXT,"
+            " results TEXT, generated_at REAL, checked_at REAL)"
+        )
+        self._db.commit()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "changed": 0, "stale": 0, "stores": 0, "unchanged": 0}
+
+    def get(self, username: str, fingerprint: Tuple[str, str, str]) -> Optional[Results]:
+        """Fresh precomputed results for a user's current (catalog version, bar hash, wishlist hash), or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT results, catalog_version, bar_hash, wishlist_hash, checked_at FROM recommendations"
+                " WHERE username = ?",
+                (username,),
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            if tuple(row[1:4]) != tuple(fingerprint):
+                self.stats["changed"] += 1
+                return None
+            if time.time() - row[4] >= self.max_age:
+                self.stats["stale"] += 1
+                return None
+            self.stats["hits"] += 1
+        return json.loads(row[0])
+
+    def fingerprint(self, username: str) -> Optional[Tuple[str, str, str]]:
+        """(catalog version, bar hash, wishlist hash) of the stored entry"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT catalog_version, bar_hash, wishlist_hash FROM recommendations WHERE username = ?",
+                (username,),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def put(self, username: str, fingerprint: Tuple[str, str, str], results: Results):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO recommendations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (username, *fingerprint, json.dumps(results), now, now),
+            )
+            self._db.commit()
+            self.stats["stores"] += 1
+
+    def touch(self, username: str):
+        """Mark a user's entry as checked against unchanged inputs, restarting its max age"""
+        with self._lock:
+            self._db.execute("UPDATE recommendations SET checked_at = ? WHERE username = ?", (time.time(), username))
+            self._db.commit()
+            self.stats["unchanged"] += 1
+
+    def delete(self, username: str):
+        with self._lock:
+            self._db.execute("DELETE FROM recommendations WHERE username = ?", (username,))
+            self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM recommendations").fetchone()[0]
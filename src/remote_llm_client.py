@@ -1,5 +1,6 @@
 import os
 from huggingface_hub import InferenceClient # type: ignore
+from src.llm_client import LLMError
 
 class RemoteLLMClient:
     """Interface to Hugging Face's inference API for Mistral-7B-Instruct-v0.3"""
@@ -7,13 +8,15 @@ class RemoteLLMClient:
     def __init__(self, api_token=None, model_id="mistralai/Mistral-7B-Instruct-v0.3"):
         self.api_token = api_token or os.environ.get("HUGGINGFACE_API_KEY")
         self.model_id = model_id
+        self.provider = "huggingface"
+        self.model = model_id
         
         if not self.api_token:
             print("Warning: No Hugging Face API token provided. Set HF_API_TOKEN environment variable or pass as parameter.")
         
         self.client = InferenceClient(token=self.api_token)
     
-    def generate_recommendation(self, prompt):
+    def generate_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None):
         try:
             # Format prompt for Mistral-7B-Instruct-v0.3
             formatted_prompt = self._format_prompt(prompt)
@@ -22,17 +25,39 @@ class RemoteLLMClient:
             response = self.client.text_generation(
                 formatted_prompt,
                 model=self.model_id,
-                max_new_tokens=1024,
+                max_new_tokens=max_tokens or 1024,
                 temperature=0.7,
                 top_p=0.9,
-                return_full_text=False
+                return_full_text=False,
+                grammar=self._grammar(schema)
             )
             
             return response
             
         except Exception as e:
-            print(f"Exception contacting Hugging Face API: {e}")
-            return "Hugging Face API connection failed."
+            raise LLMError(f"Hugging Face API request failed: {e}", self.provider) from e
+    
+    def stream_recommendation(self, prompt, max_tokens=None, schema=None, cached_prefix=None):
+        """Yield generated tokens from the Hugging Face Inference API (which has no prompt cache)"""
+        try:
+            formatted_prompt = self._format_prompt(prompt)
+            for token in self.client.text_generation(
+                formatted_prompt,
+                model=self.model_id,
+                max_new_tokens=max_tokens or 1024,
+                temperature=0.7,
+                top_p=0.9,
+                return_full_text=False,
+                grammar=self._grammar(schema),
+                stream=True
+            ):
+                yield token
+        except Exception as e:
+            raise LLMError(f"Hugging Face API stream failed: {e}", self.provider) from e
+    
+    def _grammar(self, schema):
+        """TGI grammar constraining the answer to a JSON schema"""
+        return {"type": "json", "value": schema} if schema else None
     
     def _format_prompt(self, prompt):
         """Format prompt for Mistral-7B-Instruct-v0.3"""
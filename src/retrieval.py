@@ -0,0 +1,103 @@
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+from src.catalog import Catalog, normalize_name
+from src.user_profile import UserProfile
+
+
+class CandidateRetriever:
+    """Pre-select a small, relevant set of catalog bottles for the LLM prompt
+
+    Owned bottles (matched on product.id/release_id or on name) are excluded,
+    fallbacks included; each mode applies its own filter and score as
+    whole-catalog arrays, and a partial sort keeps the top-k.
+    """
+
+    def __init__(self, catalog: Catalog):
+        self.catalog = catalog
+        self.features = catalog.features
+
+    def retrieve(self, mode: str, bar_items: Union[Iterable[Dict], UserProfile], k: int,
+                 min_price: Optional[float] = None, max_price: Optional[float] = None,
+                 profile_focus: Optional[str] = None) -> List[Dict]:
+        """Top-k candidate bottles for a recommendation mode (bar items or their UserProfile)"""
+        if not self.catalog or k <= 0:
+            return []
+        profile = UserProfile.ensure(bar_items, self.catalog)
+        owned_ids = profile.owned_ids
+        # The catalog lists some bottles more than once (sizes, editions)
+        owned_names = profile.owned_names
+        owned_types = profile.owned_types
+
+        # Taste similarity for every row in one matrix-vector product
+        vector = profile.taste_vector()
+        if vector is not None:
+            similarity = self.features.scores(vector)
+        else:
+            similarity = np.zeros(len(self.catalog), dtype=np.float32)
+        quality = self.features.quality
+
+        if mode == 'similar-price':
+            scores = similarity + 0.2 * quality
+        elif mode == 'similar-profile':
+            scores = similarity
+        elif mode == 'complementary':
+            # Reward quality, penalize closeness to what the user already has
+            scores = quality - 0.5 * similarity
+        else:
+            scores = 0.7 * similarity + 0.3 * quality
+
+        # A profile focus that names a spirit type (e.g. "rye") restricts the pool
+        focus_type = None
+        if mode == 'similar-profile' and profile_focus:
+            wanted = profile_focus.strip().lower()
+            if wanted in {t.lower() for t in self.catalog.spirit_types if t}:
+                focus_type = wanted
+
+        # Row masks over the whole catalog, so no bottle is looked at one by one
+        unowned = ~self.catalog.id_mask(owned_ids) & ~self.catalog.name_mask(owned_names)
+        eligible = unowned.copy()
+        if focus_type:
+            eligible &= self.catalog.spirit_type_mask([focus_type], ignore_case=True)
+        if mode == 'complementary' and owned_types:
+            eligible &= ~self.catalog.spirit_type_mask(owned_types)
+
+        if mode == 'similar-price' and (min_price is not None or max_price is not None):
+            # Exact in-band rows straight from the sorted price index
+            pool = np.asarray(self.catalog.prices.range(min_price, max_price), dtype=np.int64)
+        else:
+            pool = np.arange(len(self.catalog))
+        rows = pool[eligible[pool]]
+        if mode == 'complementary' and not len(rows):
+            # Every spirit type is already covered; fall back to any bottle not owned
+            # under its id or its name
+            rows = np.flatnonzero(unowned)
+
+        # Ties break on catalog order so the candidate list is deterministic;
+        # over-fetch a little so duplicate names can be dropped
+        top = self._top(rows, scores, 2 * k)
+        candidates = []
+        seen_names = set()
+        for row in top:
+            name = normalize_name(self.catalog[row].get("name"))
+            if name in seen_names:
+                continue
+            seen_names.add(name)
+            candidates.append(self.catalog[row])
+            if len(candidates) == k:
+                break
+        return candidates
+
+    @staticmethod
+    def _top(rows: np.ndarray, scores: np.ndarray, n: int) -> List[int]:
+        """The `n` rows with the highest scores, ties in row order"""
+        row_scores = scores[rows]
+        if len(rows) > n:
+            # Everything scoring at least the n-th best score, ties included
+            threshold = np.partition(row_scores, len(rows) - n)[len(rows) - n]
+            keep = row_scores >= threshold
+            rows, row_scores = rows[keep], row_scores[keep]
+        order = np.lexsort((rows, -row_scores))[:n]
+        return rows[order].tolist()
+
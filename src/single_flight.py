@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from src import metrics
+
+
+def content_hash(data: Any) -> str:
+    """Stable digest of a JSON-serializable payload (bar, wishlist, ...)"""
+    material = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(material.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Run one call per key at a time; concurrent callers with the same key share its result
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is still running wait on the same future and get the
+    same result or exception. Nothing is kept once the call finishes, so a
+    failure is never served to later callers. A named group also counts its
+    stats in /metrics (bob_single_flight_total).
+    """
+
+    def __init__(self, name: Optional[str] = None):
+        self.name = name
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "coalesced": 0, "errors": 0}
+
+    def _count(self, outcome: str):
+        self._stats[outcome] += 1
+        if self.name:
+            metrics.count_flight(self.name, outcome)
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self._count("calls")
+            else:
+                self._count("coalesced")
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                self._count("errors")
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines: concurrent awaits of the same key share one task
+
+    Waiters are shielded from each other, so a caller that goes away (e.g.
+    its client disconnects) does not cancel the shared call for the rest.
+    """
+
+    def __init__(self, name: Optional[str] = None):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._stats = {"calls": 0, "coalesced": 0, "errors": 0}
+
+    def _count(self, outcome: str):
+        self._stats[outcome] += 1
+        if self.name:
+            metrics.count_flight(self.name, outcome)
+
+    async def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        task = self._calls.get(key)
+        if task is None:
+            self._count("calls")
+            task = self._calls[key] = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self._count("coalesced")
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if task.cancelled() or task.exception() is not None:
+            self._count("errors")
+
+    def stats(self) -> Dict[str, int]:
+        stats = dict(self._stats)
+        stats["in_flight"] = len(self._calls)
+        return stats
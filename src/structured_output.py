@@ -0,0 +1,420 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import config
+from src import metrics
+from src.index_response import REASON_CODES
+from src.llm_client import astream_from, stream_from
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SECTION = "recommendations"
+
+_END = object()
+
+# The scanner jumps between these instead of stepping through every character
+_STRUCTURAL = re.compile(r'[{}\[\]",:]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+
+class MalformedOutputError(ValueError):
+    """The LLM's answer cannot become the requested JSON structure"""
+
+
+def recommendation_schema(index_only: bool = False, indexed: bool = True,
+                          sections: Optional[Sequence[str]] = None) -> Dict:
+    """JSON schema for a recommendation answer, one array per section
+
+    Index-only items are {"i": <candidate number>, "r": <reason code>};
+    full items add "reasoning" and "relationship", and name the bottle
+    with "name" when there is no indexed candidate list.
+    """
+    number = {"type": "integer", "description": "Candidate number"}
+    if index_only:
+        properties = {
+            "i": number,
+            "r": {"type": "string", "enum": list(REASON_CODES), "description": "Reason code"},
+        }
+    else:
+        key = "i" if indexed else "name"
+        properties = {
+            key: number if indexed else {"type": "string"},
+            "reasoning": {"type": "string", "description": "Why it fits, one sentence"},
+            "relationship": {"type": "string", "description": "How it relates to the collection"},
+        }
+    items = {"type": "object", "properties": properties, "required": list(properties)}
+    array = {"type": "array", "items": items, "maxItems": config.MAX_RECOMMENDATIONS}
+    sections = list(sections) if sections else [DEFAULT_SECTION]
+    return {"type": "object", "properties": {s: array for s in sections}, "required": sections}
+
+
+def format_instructions(index_only: bool = False, indexed: bool = True,
+                        sections: Optional[Sequence[str]] = None) -> str:
+    """Prompt text describing the JSON answer by example"""
+    if index_only:
+        example = '[{"i":4,"r":"S"},{"i":11,"r":"V"}]'
+    elif indexed:
+        example = '[{"i":4,"reasoning":"<why it fits>","relationship":"<how it relates to my bottles>"}]'
+    else:
+        example = '[{"name":"<bottle name>","reasoning":"<why it fits>","relationship":"<how it relates to my bottles>"}]'
+    keys = list(sections) if sections else [DEFAULT_SECTION]
+    body = ",".join(f'"{key}":{example if i == 0 else "[...]"}' for i, key in enumerate(keys))
+    text = f"Respond with only a JSON object like {{{body}}}, best pick first."
+    if indexed or index_only:
+        text += ' "i" is a candidate number.'
+    if index_only:
+        text += " \"r\" is a reason code: " + ", ".join(f"{c}={m}" for c, m in REASON_CODES.items()) + "."
+    else:
+        text += " One sentence per field."
+    return text
+
+
+class StructuredResponseParser:
+    """Single-pass, incremental parser for JSON recommendation answers
+
+    Feed text chunks as they stream in. Each element of a section's array
+    is decoded and validated as soon as its closing brace arrives, and
+    anything that cannot become the requested structure (prose before the
+    JSON, a non-object element, an unknown candidate number) raises
+    MalformedOutputError at once, so the caller can abort the generation.
+    """
+
+    def __init__(self, candidate_count: Optional[int] = None, index_only: bool = False,
+                 sections: Optional[Sequence[str]] = None, max_items: Optional[int] = None):
+        self.candidate_count = candidate_count
+        self.index_only = index_only
+        self.sections = tuple(sections) if sections else (DEFAULT_SECTION,)
+        self.max_items = max_items
+        self._counts = {section: 0 for section in self.sections}
+        self._seen = {section: set() for section in self.sections}
+        self._text = ""
+        self._pos = 0
+        self._started = False
+        self._closed = False
+        self._full_sections = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._expect_key = False
+        self._key: Optional[str] = None
+        self._section: Optional[str] = None
+        self._item_start: Optional[int] = None
+
+    @property
+    def done(self) -> bool:
+        """All sections are full, or the top-level object has closed"""
+        return self._closed or self._full_sections == len(self.sections)
+
+    @property
+    def text(self) -> str:
+        """The answer text fed so far"""
+        return self._text
+
+    def feed(self, chunk: str) -> List[Tuple[str, Dict]]:
+        """Consume a chunk and return the (section, item) pairs it completed"""
+        completed: List[Tuple[str, Dict]] = []
+        if not chunk or self.done:
+            return completed
+        self._text += chunk
+        text = self._text
+        while self._pos < len(text) and not self._closed:
+            if not self._started:
+                if not self._skip_preamble():
+                    break
+                continue
+            if not self._advance():
+                break
+            self._scan(text[self._pos], completed)
+            self._pos += 1
+        return completed
+
+    def finish(self) -> List[Tuple[str, Dict]]:
+        """Check the answer once the stream ends (truncated answers keep their items)"""
+        if not self._started:
+            raise MalformedOutputError("no JSON object in response")
+        if not self._closed and not any(self._counts.values()):
+            raise MalformedOutputError("incomplete JSON object")
+        return []
+
+    def _skip_preamble(self) -> bool:
+        """Skip whitespace and a markdown fence before the opening brace"""
+        text = self._text
+        while self._pos < len(text) and text[self._pos].isspace():
+            self._pos += 1
+        if self._pos >= len(text):
+            return False
+        if text.startswith("```", self._pos) or "```".startswith(text[self._pos:]):
+            newline = text.find("\n", self._pos)
+            if newline < 0:
+                return False  # Wait for the rest of the fence line
+            self._pos = newline + 1
+            return True
+        if text[self._pos] != "{":
+            raise MalformedOutputError(f"expected a JSON object, got {text[self._pos:self._pos + 20]!r}")
+        self._started = True
+        return True
+
+    def _in_section_array(self) -> bool:
+        return len(self._stack) == 2 and self._stack[1] == "[" and self._section is not None
+
+    def _advance(self) -> bool:
+        """Move to the next character that can change state; False when the text runs out"""
+        text = self._text
+        if self._in_string:
+            if self._escape:
+                return True
+            match = _STRING_SPECIAL.search(text, self._pos)
+        else:
+            match = _STRUCTURAL.search(text, self._pos)
+            end = match.start() if match else len(text)
+            # Scalars are only allowed inside items, never as array elements
+            if self._in_section_array() and text[self._pos:end].strip():
+                raise MalformedOutputError(f"expected an object in {self._section!r}, got {text[self._pos:end].strip()[:20]!r}")
+        if not match:
+            self._pos = len(text)
+            return False
+        self._pos = match.start()
+        return True
+
+    def _scan(self, char: str, completed: List[Tuple[str, Dict]]):
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if len(self._stack) == 1 and self._expect_key:
+                    self._key = json.loads(self._text[self._string_start:self._pos + 1])
+            return
+
+        depth = len(self._stack)
+        in_array = self._in_section_array()
+        if in_array and char not in "{],":
+            raise MalformedOutputError(f"expected an object in {self._section!r}, got {char!r}")
+
+        if char == '"':
+            self._in_string = True
+            self._string_start = self._pos
+        elif char in "{[":
+            if depth == 1 and char == "[":
+                self._section = self._key if self._key in self._counts else None
+            if in_array and char == "{":
+                self._item_start = self._pos
+            self._stack.append(char)
+            self._expect_key = depth == 0
+        elif char in "}]":
+            if not self._stack or self._stack.pop() != ("{" if char == "}" else "["):
+                raise MalformedOutputError(f"unbalanced {char!r}")
+            if char == "}" and self._item_start is not None and len(self._stack) == 2:
+                try:
+                    item = json.loads(self._text[self._item_start:self._pos + 1])
+                except json.JSONDecodeError as e:
+                    raise MalformedOutputError(f"invalid JSON item: {e}") from e
+                self._item_start = None
+                self._accept(item, completed)
+            elif char == "]" and len(self._stack) == 1:
+                self._section = None
+            if not self._stack:
+                self._closed = True
+        elif depth == 1 and char == ",":
+            self._expect_key = True
+        elif depth == 1 and char == ":":
+            self._expect_key = False
+
+    def _accept(self, item, completed: List[Tuple[str, Dict]]):
+        """Validate one array element and emit it unless it is a repeat"""
+        section = self._section
+        if not isinstance(item, dict):
+            raise MalformedOutputError(f"expected an object, got {item!r}")
+
+        if self.candidate_count is not None:
+            index = item.get("i")
+            if isinstance(index, bool) or not isinstance(index, int) or not 0 <= index < self.candidate_count:
+                raise MalformedOutputError(f"invalid candidate number {index!r}")
+            key = index
+            if self.index_only and item.get("r") not in REASON_CODES:
+                item["r"] = None
+        else:
+            name = item.get("name")
+            if not isinstance(name, str) or not name.strip():
+                raise MalformedOutputError(f"missing bottle name in {item!r}")
+            key = name.strip().lower()
+
+        if key in self._seen[section]:
+            return
+        if self.max_items is not None and self._counts[section] >= self.max_items:
+            return
+        self._seen[section].add(key)
+        self._counts[section] += 1
+        if self._counts[section] == self.max_items:
+            self._full_sections += 1
+        completed.append((section, item))
+
+
+class _StageTimes:
+    """Time spent waiting on the LLM and parsing its answer, across retries"""
+
+    def __init__(self, client):
+        self.llm = 0.0
+        self.parse = 0.0
+        # A router or cache hit replaces this with whoever actually answered
+        metrics.set_labels(provider=getattr(client, "provider", None) or "")
+
+    def record(self):
+        metrics.observe_stage("llm", self.llm)
+        metrics.observe_stage("parse", self.parse)
+
+
+def _store(client, prompt: str, text: str, max_tokens: Optional[int], schema: Optional[Dict],
+           variants: Optional[Dict[str, Dict]]):
+    """Cache a complete answer whose stream was closed as soon as it was complete"""
+    store = getattr(client, "store", None)
+    if store:
+        store(prompt, text, max_tokens=max_tokens, schema=schema, variants=variants)
+
+
+def _unseen(items: Iterable[Tuple[str, Dict]], emitted: Set, counts: Dict[str, int]) -> List[Tuple[str, Dict]]:
+    """Items no earlier attempt yielded, up to MAX_RECOMMENDATIONS per section across attempts"""
+    fresh = []
+    for section, item in items:
+        key = (section, item.get("i", item.get("name")))
+        if key in emitted or counts.get(section, 0) >= config.MAX_RECOMMENDATIONS:
+            continue
+        emitted.add(key)
+        counts[section] = counts.get(section, 0) + 1
+        fresh.append((section, item))
+    return fresh
+
+
+def stream_structured(client, prompt: str, parser_factory, max_tokens: Optional[int] = None,
+                      schema: Optional[Dict] = None, retries: Optional[int] = None,
+                      cached_prefix: Optional[str] = None,
+                      variants: Optional[Dict[str, Dict]] = None) -> Iterator[Tuple[str, Dict]]:
+    """Yield validated (section, item) pairs, aborting and retrying malformed generations
+
+    A malformed answer is abandoned at the first bad token; the retry only
+    contributes items that were not already yielded, and no section yields
+    more than MAX_RECOMMENDATIONS over all attempts. When the last attempt
+    is malformed too, MalformedOutputError is raised. `cached_prefix` marks
+    the static start of the prompt for provider prompt caching; `variants`
+    holds the prompt, schema and prefix built for each provider a router
+    may send the request to.
+    """
+    retries = config.STRUCTURED_OUTPUT_RETRIES if retries is None else retries
+    emitted: Set = set()
+    counts: Dict[str, int] = {}
+    times = _StageTimes(client)
+    try:
+        for attempt in range(retries + 1):
+            parser = parser_factory()
+            stream = stream_from(client, prompt, max_tokens, schema, cached_prefix, variants)
+            chunks = iter(stream)
+            try:
+                while True:
+                    start = time.perf_counter()
+                    chunk = next(chunks, _END)
+                    received = time.perf_counter()
+                    times.llm += received - start
+                    if chunk is _END:
+                        break
+                    items = parser.feed(chunk)
+                    times.parse += time.perf_counter() - received
+                    for section, item in _unseen(items, emitted, counts):
+                        yield section, item
+                    if parser.done:
+                        # The stream is closed unfinished, so the cache wrapper cannot store it itself
+                        _store(client, prompt, parser.text, max_tokens, schema, variants)
+                        return
+                parser.finish()
+                return
+            except MalformedOutputError as e:
+                logger.warning("Malformed LLM output (attempt %d of %d): %s", attempt + 1, retries + 1, e)
+                error = e
+            finally:
+                # Closing the stream stops the provider from generating further
+                close = getattr(stream, "close", None)
+                if close:
+                    close()
+            # Never retry against a cached copy of the bad answer
+            invalidate = getattr(client, "invalidate", None)
+            if invalidate:
+                invalidate(prompt, max_tokens=max_tokens, schema=schema, variants=variants)
+        raise MalformedOutputError(f"no valid answer after {retries + 1} attempts: {error}")
+    finally:
+        times.record()
+
+
+def generate_structured(client, prompt: str, parser_factory, max_tokens: Optional[int] = None,
+                        schema: Optional[Dict] = None, retries: Optional[int] = None,
+                        cached_prefix: Optional[str] = None,
+                        variants: Optional[Dict[str, Dict]] = None) -> Dict[str, List[Dict]]:
+    """Collect a structured answer into one item list per section"""
+    sections: Dict[str, List[Dict]] = {}
+    items = stream_structured(client, prompt, parser_factory, max_tokens, schema, retries, cached_prefix, variants)
+    for section, item in items:
+        sections.setdefault(section, []).append(item)
+    return sections
+
+
+async def astream_structured(client, prompt: str, parser_factory, max_tokens: Optional[int] = None,
+                             schema: Optional[Dict] = None, retries: Optional[int] = None,
+                             cached_prefix: Optional[str] = None,
+                             variants: Optional[Dict[str, Dict]] = None) -> AsyncIterator[Tuple[str, Dict]]:
+    """Async counterpart of stream_structured"""
+    retries = config.STRUCTURED_OUTPUT_RETRIES if retries is None else retries
+    emitted: Set = set()
+    counts: Dict[str, int] = {}
+    times = _StageTimes(client)
+    try:
+        for attempt in range(retries + 1):
+            parser = parser_factory()
+            stream = astream_from(client, prompt, max_tokens, schema, cached_prefix, variants)
+            try:
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        chunk = await stream.__anext__()
+                    except StopAsyncIteration:
+                        times.llm += time.perf_counter() - start
+                        break
+                    received = time.perf_counter()
+                    times.llm += received - start
+                    items = parser.feed(chunk)
+                    times.parse += time.perf_counter() - received
+                    for section, item in _unseen(items, emitted, counts):
+                        yield section, item
+                    if parser.done:
+                        # The cache may write to SQLite; keep that off the event loop
+                        await asyncio.to_thread(_store, client, prompt, parser.text, max_tokens, schema, variants)
+                        return
+                parser.finish()
+                return
+            except MalformedOutputError as e:
+                logger.warning("Malformed LLM output (attempt %d of %d): %s", attempt + 1, retries + 1, e)
+                error = e
+            finally:
+                await stream.aclose()
+            invalidate = getattr(client, "invalidate", None)
+            if invalidate:
+                await asyncio.to_thread(invalidate, prompt, max_tokens=max_tokens, schema=schema, variants=variants)
+        raise MalformedOutputError(f"no valid answer after {retries + 1} attempts: {error}")
+    finally:
+        times.record()
+
+
+async def agenerate_structured(client, prompt: str, parser_factory, max_tokens: Optional[int] = None,
+                               schema: Optional[Dict] = None, retries: Optional[int] = None,
+                               cached_prefix: Optional[str] = None,
+                               variants: Optional[Dict[str, Dict]] = None) -> Dict[str, List[Dict]]:
+    """Async counterpart of generate_structured"""
+    sections: Dict[str, List[Dict]] = {}
+    items = astream_structured(client, prompt, parser_factory, max_tokens, schema, retries, cached_prefix, variants)
+    async for section, item in items:
+        sections.setdefault(section, []).append(item)
+    return sections
@@ -0,0 +1,396 @@
+import json
+import os
+import sqlite3
+import threading
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from src.catalog import Catalog, normalize_name
+from src.price_index import bottle_price
+from src.single_flight import content_hash
+
+
+def bar_items(user_bar) -> List[Dict]:
+    """The item list of a bar payload: BAXUS returns a plain list, older payloads {"bottles": [...]}"""
+    if isinstance(user_bar, list):
+        return user_bar
+    if user_bar and "bottles" in user_bar:
+        return user_bar["bottles"]
+    return []
+
+
+def flatten_bar_item(item: Dict) -> Dict:
+    """Lift name/spirit_type out of a BAXUS bar item's nested product"""
+    product = item.get("product") if isinstance(item, dict) else None
+    if not product:
+        return item
+    return {
+        **item,
+        "name": item.get("name") or product.get("name"),
+        "spirit_type": item.get("spirit_type") or product.get("spirit"),
+    }
+
+
+def _item_keys(items: Iterable[Dict]) -> List[Tuple[str, str]]:
+    """(stable key, version) for each bar item
+
+    BAXUS bar entries are keyed by their id and versioned by updated_at.
+    Items without them (plain bottle dicts) are keyed by content, with an
+    occurrence number so duplicate bottles stay distinct.
+    """
+    keys = []
+    seen: Counter = Counter()
+    for item in items:
+        if ("product" in item or "release_id" in item) and item.get("id") is not None:
+            keys.append((f"id:{item['id']}", item.get("updated_at") or content_hash(item)))
+            continue
+        digest = content_hash(item)
+        seen[digest] += 1
+        keys.append((f"hash:{digest}:{seen[digest]}", digest))
+    return keys
+
+
+def _median(values: List[float]) -> Optional[float]:
+    if not values:
+        return None
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+class UserProfile:
+    """Running aggregates of one user's bar, updated item by item
+
+    Each bar item contributes a small record (its catalog bottle, spirit
+    type, price and legacy profile fields) to counters, sorted price lists
+    and a taste-vector sum. update() diffs a fresh bar against the items
+    already applied, so only added, removed and updated items are
+    (un)applied; reads never touch the raw bar.
+    """
+
+    def __init__(self, catalog: Optional[Catalog] = None):
+        self.catalog = catalog if catalog else None
+        self.catalog_version = catalog.version if catalog else None
+        self.records: Dict[str, Dict] = {}
+        self.owned_ids: Counter = Counter()
+        self.owned_rows: Counter = Counter()  # Feature matrix rows of owned bottles
+        self.owned_names: Counter = Counter()  # Normalized names of owned catalog bottles
+        self.owned_types: Counter = Counter()  # Spirit types of owned catalog bottles
+        self.spirit_types: Counter = Counter()  # Spirit types as listed in the bar
+        self.regions: Counter = Counter()
+        self.distilleries: Counter = Counter()
+        self.types: Counter = Counter()
+        self.ages: Counter = Counter()
+        self.prices: List[float] = []  # Catalog prices of matched bottles, sorted
+        self.item_prices: List[float] = []  # Prices entered on bar items, sorted
+        self.unmatched: Dict[str, Dict] = {}  # Items not in the catalog, in bar order
+        width = self.catalog.features.matrix.shape[1] if self.catalog else 0
+        self._taste_sum = np.zeros(width, dtype=np.float64)
+
+    @classmethod
+    def ensure(cls, bar_items: Iterable[Dict], catalog: Optional[Catalog]) -> "UserProfile":
+        """Return `bar_items` as a UserProfile, aggregating a plain item list on the fly"""
+        if isinstance(bar_items, UserProfile):
+            return bar_items
+        profile = cls(catalog)
+        profile.update(bar_items)
+        return profile
+
+    @classmethod
+    def from_records(cls, catalog: Optional[Catalog], records: Dict[str, Dict]) -> "UserProfile":
+        """Rebuild from stored item records (made against the same catalog version)"""
+        profile = cls(catalog)
+        for key, record in records.items():
+            profile._apply(key, record)
+        return profile
+
+    def copy(self) -> "UserProfile":
+        """Independent copy, so readers of this profile never see a half-applied update"""
+        clone = UserProfile.__new__(UserProfile)
+        clone.__dict__.update(self.__dict__)
+        for name in ("records", "owned_ids", "owned_rows", "owned_names", "owned_types", "spirit_types", "regions",
+                     "distilleries", "types", "ages", "prices", "item_prices", "unmatched", "_taste_sum"):
+            setattr(clone, name, getattr(self, name).copy())
+        return clone
+
+    @property
+    def bottle_count(self) -> int:
+        return len(self.records)
+
+    def diff(self, items: List[Dict]) -> Tuple[Dict[str, Dict], List[str]]:
+        """Records to (re)apply by key and keys to remove, for a fresh list of bar items"""
+        keys = _item_keys(items)
+        changed = {}
+        for (key, version), item in zip(keys, items):
+            current = self.records.get(key)
+            if current is None or current["version"] != version:
+                changed[key] = self._record(item, version)
+        present = {key for key, _ in keys}
+        removed = [key for key in self.records if key not in present]
+        return changed, removed
+
+    def update(self, items: List[Dict]) -> Tuple[Dict[str, Dict], List[str]]:
+        """Apply only the items that were added, updated or removed; returns (changed, removed)"""
+        changed, removed = self.diff(items)
+        self.apply(changed, removed)
+        return changed, removed
+
+    def apply(self, changed: Dict[str, Dict], removed: Iterable[str]):
+        for key in removed:
+            self._unapply(key)
+        for key, record in changed.items():
+            if key in self.records:
+                self._unapply(key)
+            self._apply(key, record)
+
+    def _record(self, item: Dict, version: str) -> Dict:
+        """What one bar item contributes to the aggregates"""
+        flat = flatten_bar_item(item)
+        bottle = self.catalog.match_bar_item(item) if self.catalog else None
+        return {
+            "version": version,
+            "bottle_id": bottle.get("id") if bottle else None,
+            "name": normalize_name(bottle.get("name")) if bottle else None,
+            "owned_type": bottle.get("spirit_type") if bottle else None,
+            "spirit_type": flat.get("spirit_type"),
+            "price": bottle_price(bottle) if bottle else None,
+            "item_price": flat.get("price") or None,
+            "region": flat.get("region", "Unknown"),
+            "distillery": flat.get("distillery", "Unknown"),
+            "type": flat.get("type", "Unknown"),
+            "age": flat.get("age_statement", "NAS"),
+            # Unmatched items are listed in prompts as-is
+            "item": None if bottle else flat,
+        }
+
+    def _apply(self, key: str, record: Dict):
+        self.records[key] = record
+        self._count(record, 1)
+        if record["price"]:
+            insort(self.prices, record["price"])
+        if record["item_price"]:
+            insort(self.item_prices, record["item_price"])
+        if record["item"] is not None:
+            self.unmatched[key] = record["item"]
+        row = self._row(record)
+        if row is not None:
+            self.owned_rows[row] += 1
+            self._taste_sum += self.catalog.features.matrix[row]
+
+    def _unapply(self, key: str):
+        record = self.records.pop(key)
+        self._count(record, -1)
+        if record["price"]:
+            del self.prices[bisect_left(self.prices, record["price"])]
+        if record["item_price"]:
+            del self.item_prices[bisect_left(self.item_prices, record["item_price"])]
+        self.unmatched.pop(key, None)
+        row = self._row(record)
+        if row is not None:
+            self.owned_rows[row] -= 1
+            if not self.owned_rows[row]:
+                del self.owned_rows[row]
+            self._taste_sum -= self.catalog.features.matrix[row]
+
+    def _count(self, record: Dict, delta: int):
+        pairs = [
+            (self.owned_ids, record["bottle_id"]),
+            (self.owned_names, record["name"]),
+            (self.owned_types, record["owned_type"] or None),
+            (self.spirit_types, record["spirit_type"] or None),
+            (self.regions, record["region"]),
+            (self.distilleries, record["distillery"]),
+            (self.types, record["type"]),
+            (self.ages, record["age"]),
+        ]
+        for counter, value in pairs:
+            if value is None:
+                continue
+            counter[value] += delta
+            if counter[value] <= 0:
+                del counter[value]
+
+    def _row(self, record: Dict) -> Optional[int]:
+        if self.catalog is None or record["bottle_id"] is None:
+            return None
+        return self.catalog.features.row_for(record["bottle_id"])
+
+    def owned_bottles(self) -> List[Dict]:
+        """Distinct catalog bottles in the bar"""
+        return [self.catalog[row] for row in self.owned_rows]
+
+    def taste_vector(self) -> Optional[np.ndarray]:
+        """Unit-length mean of the owned bottles' feature rows (duplicates weigh more)"""
+        norm = np.linalg.norm(self._taste_sum) if self._taste_sum.size else 0.0
+        if norm == 0:
+            return None
+        return (self._taste_sum / norm).astype(np.float32)
+
+    def median_price(self) -> Optional[float]:
+        return _median(self.prices)
+
+    def mean_price(self) -> Optional[float]:
+        return sum(self.prices) / len(self.prices) if self.prices else None
+
+    def ranked_collection(self, limit: Optional[int] = None) -> List[Dict]:
+        """Collection bottles, most representative first, as prompt_compiler.rank_collection orders them
+
+        Matched bottles are ranked by closeness to the taste vector (one
+        matrix product over the distinct owned rows), unmatched items follow
+        in bar order, and names repeat at most once. Only the first `limit`
+        are built.
+        """
+        rows = np.fromiter(self.owned_rows, dtype=np.int64, count=len(self.owned_rows))
+        vector = self.taste_vector()
+        if rows.size and vector is not None:
+            # Stable sort keeps bar order among equal scores
+            rows = rows[np.argsort(-(self.catalog.features.matrix[rows] @ vector), kind="stable")]
+        bottles = chain((self.catalog[int(row)] for row in rows), self.unmatched.values())
+
+        seen = set()
+        unique = []
+        for bottle in bottles:
+            if limit is not None and len(unique) == limit:
+                break
+            key = normalize_name(bottle.get("name"))
+            if key in seen:
+                continue
+            seen.add(key)
+            unique.append(bottle)
+        return unique
+
+    def summary(self) -> Dict:
+        """The collection summary WhiskyDataProcessor.create_user_profile returns"""
+        if not self.records:
+            return {"bottle_count": 0}
+        prices = self.item_prices
+        return {
+            "regions": dict(self.regions),
+            "price_range": {
+                "min": prices[0] if prices else 0,
+                "max": prices[-1] if prices else 0,
+                "avg": sum(prices) / len(prices) if prices else 0
+            },
+            "distilleries": dict(self.distilleries),
+            "types": dict(self.types),
+            "ages": dict(self.ages),
+            "bottle_count": self.bottle_count
+        }
+
+
+class ProfileStore:
+    """Per-user profiles kept in step with their bars: in-process LRU over an optional SQLite table
+
+    sync() applies only the bar items that changed since the user's last
+    sync. A changed bar produces an updated copy (requests already holding
+    the old profile keep reading it), and only the changed item records are
+    written. Profiles and stored records carry the catalog version they
+    were matched against; after a reload, records from another version are
+    re-projected from the bar onto the new catalog as each user syncs.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._profiles: "OrderedDict[str, UserProfile]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.stats: Dict[str, int] = {
+            "syncs": 0, "unchanged": 0, "items_applied": 0, "items_removed": 0, "items_reprojected": 0,
+            "loads": 0, "rebuilds": 0,
+        }
+
+        if path:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS profile_items ("
+                " username TEXT, item_key TEXT, catalog_version TEXT, record TEXT,"
+                " PRIMARY KEY (username, item_key))"
+            )
+            self._db.commit()
+
+    def sync(self, username: str, user_bar, catalog: Optional[Catalog]) -> UserProfile:
+        """The user's profile, updated to match `user_bar`"""
+        items = bar_items(user_bar)
+        with self._lock:
+            self.stats["syncs"] += 1
+            profile, stale = self._get(username, catalog)
+        while True:
+            # Diff outside the lock; commit only if no other sync replaced the profile meanwhile
+            changed, removed = profile.diff(items)
+            # Stale records of items still in the bar come back in `changed`; drop the rest
+            gone = [key for key in stale if key not in changed and key not in profile.records]
+            with self._lock:
+                current = self._profiles.get(username)
+                # A profile made against another catalog version (during a reload) is never adopted
+                if current is not None and current is not profile and current.catalog_version == profile.catalog_version:
+                    profile = current
+                    continue
+                if not changed and not removed and not gone:
+                    self.stats["unchanged"] += 1
+                    self._remember(username, profile)
+                    return profile
+                profile = profile.copy()
+                profile.apply(changed, removed)
+                self.stats["items_applied"] += len(changed)
+                self.stats["items_removed"] += len(removed)
+                self.stats["items_reprojected"] += sum(key in stale for key in changed)
+                self._remember(username, profile)
+                if self._db is not None:
+                    self._db.executemany(
+                        "DELETE FROM profile_items WHERE username = ? AND item_key = ?",
+                        [(username, key) for key in removed + gone],
+                    )
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO profile_items VALUES (?, ?, ?, ?)",
+                        [(username, key, profile.catalog_version, json.dumps(record))
+                         for key, record in changed.items()],
+                    )
+                    self._db.commit()
+                return profile
+
+    def _get(self, username: str, catalog: Optional[Catalog]) -> Tuple[UserProfile, Set[str]]:
+        """Cached profile, else the stored records, else an empty profile (all under the lock)
+
+        Also returns the keys of stored records matched against another
+        catalog version. They are left out of the profile, so sync() sees
+        those items as new and re-records them against this catalog.
+        """
+        version = catalog.version if catalog else None
+        profile = self._profiles.get(username)
+        if profile is not None and profile.catalog_version == version:
+            return profile, set()
+
+        records, stale = {}, set()
+        if self._db is not None:
+            rows = self._db.execute(
+                "SELECT item_key, catalog_version, record FROM profile_items WHERE username = ?", (username,)
+            ).fetchall()
+            for key, row_version, record in rows:
+                if row_version == version:
+                    records[key] = json.loads(record)
+                else:
+                    stale.add(key)
+            if records:
+                self.stats["loads"] += 1
+            if stale:
+                self.stats["rebuilds"] += 1
+        elif profile is not None:
+            self.stats["rebuilds"] += 1
+        return UserProfile.from_records(catalog, records), stale
+
+    def _remember(self, username: str, profile: UserProfile):
+        self._profiles[username] = profile
+        self._profiles.move_to_end(username)
+        while len(self._profiles) > self.max_entries:
+            self._profiles.popitem(last=False)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["cached_profiles"] = len(self._profiles)
+        return stats